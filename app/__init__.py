@@ -0,0 +1,42 @@
+# app/__init__.py
+from dotenv import load_dotenv
+import os
+
+# Cargar el fichero .env antes de que cualquier módulo lea la configuración
+load_dotenv()
+
+
+def create_app(config=None):
+    """
+    Crea y configura la aplicación Flask (única factoría de la aplicación).
+    Los módulos se importan aquí para que importar el paquete app (p. ej. app.db) no arrastre las rutas.
+    :param config: Diccionario opcional con valores de configuración que se aplican sobre los por defecto.
+    :return: Aplicación Flask lista para servir con el servidor de desarrollo o con gunicorn.
+    :rtype: flask.Flask
+    """
+    from flask import Flask
+    from flasgger import Swagger
+    from app.routes.routes import routes
+    from app.routes.api import api
+    from app.db import init_app
+    from app.cli import register_commands
+    from app import instrumentation, assets, compression
+
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), "templates"))
+    app.secret_key = os.getenv("APP_SECRET_KEY", "default")
+    if config:
+        app.config.update(config)
+    app.register_blueprint(routes)
+    app.register_blueprint(api) # API JSON en /api/v1
+    Swagger(app) # Documentación de la API en /apidocs
+    init_app(app) # Sesión de base de datos por petición
+    instrumentation.init_app(app) # Métricas por petición (/metrics y cabecera Server-Timing)
+    assets.init_app(app) # Ficheros estáticos locales con huella (/assets) y asset_url en las plantillas
+    compression.init_app(app) # Compresión brotli/gzip de las respuestas
+    register_commands(app) # Comandos flask <comando>
+
+    @app.route("/")
+    def hello():
+        return "¡Hola, soy Miguel, bienvenido a mi app!"
+
+    return app
@@ -0,0 +1,187 @@
+# app/assets.py
+from flask import Blueprint, Response, request, redirect, send_from_directory, url_for, abort, current_app
+from markupsafe import Markup
+from app import compression
+import hashlib
+import logging
+import os
+import threading
+import urllib.request
+import base64
+import mimetypes
+
+logger = logging.getLogger(__name__)
+
+# Configuración de los ficheros estáticos
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+ASSETS_MAX_AGE = int(os.getenv("ASSETS_MAX_AGE", "31536000")) # Segundos de caché de los ficheros con huella (1 año)
+ASSETS_CDN_FALLBACK = os.getenv("ASSETS_CDN_FALLBACK", "").lower() # Usar el CDN si falta el fichero local: true, false o sin valor (solo en depuración o tests)
+
+# Dependencias de terceros servidas desde app/static/vendor: origen e integridad (SRI) publicados por el proyecto.
+# Se descargan una vez al construir la imagen (flask fetch-assets) para que producción no dependa del CDN.
+VENDOR_ASSETS = {
+    "vendor/bootstrap/bootstrap.min.css": (
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+        "sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH",
+    ),
+    "vendor/bootstrap/bootstrap.bundle.min.js": (
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+        "sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz",
+    ),
+}
+
+assets = Blueprint('assets', __name__)
+
+# Ruta del fichero -> (mtime, huella); la huella se recalcula solo si el fichero cambia
+_fingerprints = {}
+# (ruta, codificación) -> (huella, contenido comprimido): cada versión de un fichero se comprime una sola vez
+_compressed = {}
+_lock = threading.Lock()
+
+
+def fingerprint(filename):
+    """
+    Huella del contenido de un fichero estático (primeros 12 caracteres de su SHA-256).
+    :param filename: Ruta relativa a app/static.
+    :return: Huella, o None si el fichero no existe.
+    :rtype: str
+    """
+    path = os.path.join(STATIC_DIR, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        cached = _fingerprints.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    with _lock:
+        _fingerprints[filename] = (mtime, digest)
+    return digest
+
+
+def cdn_fallback_enabled(app=None):
+    """
+    Indica si se enlaza el CDN cuando falta un fichero de VENDOR_ASSETS. Sin ASSETS_CDN_FALLBACK solo se hace
+    en depuración o en tests: producción debe servir los ficheros descargados con flask fetch-assets.
+    """
+    if ASSETS_CDN_FALLBACK:
+        return ASSETS_CDN_FALLBACK in ("1", "true", "yes")
+    app = app or current_app
+    return app.debug or app.testing
+
+
+def _uses_cdn(filename):
+    return filename in VENDOR_ASSETS and fingerprint(filename) is None and cdn_fallback_enabled()
+
+
+def asset_url(filename):
+    """
+    URL de un fichero estático con la huella de su contenido, que se puede cachear sin caducidad:
+    al cambiar el fichero cambia la URL. Si un fichero de VENDOR_ASSETS aún no se ha descargado se usa
+    su URL del CDN (solo en desarrollo; ver cdn_fallback_enabled), que se enlaza con asset_integrity.
+    :param filename: Ruta relativa a app/static.
+    :return: URL del fichero.
+    :rtype: str
+    """
+    digest = fingerprint(filename)
+    if digest is None:
+        if _uses_cdn(filename):
+            return VENDOR_ASSETS[filename][0]
+        logger.warning("Fichero estático no encontrado: %s", filename)
+        return url_for('static', filename=filename)
+    return url_for('assets.asset', digest=digest, filename=filename)
+
+
+def asset_integrity(filename):
+    """
+    Atributos integrity y crossorigin para enlazar un fichero de VENDOR_ASSETS desde el CDN, de modo que el
+    navegador compruebe su hash (vacío si el fichero se sirve en local).
+    :param filename: Ruta relativa a app/static.
+    :return: Atributos HTML.
+    :rtype: Markup
+    """
+    if not _uses_cdn(filename):
+        return Markup("")
+    return Markup(' integrity="{}" crossorigin="anonymous"').format(VENDOR_ASSETS[filename][1])
+
+
+@assets.route('/assets/<digest>/<path:filename>', methods=['GET'])
+def asset(digest, filename):
+    """
+    Sirve un fichero estático con huella con caché de un año e immutable, comprimido con brotli o gzip si
+    el cliente lo acepta. Si la huella no es la actual (p. ej. una página antigua) se redirige a la URL vigente.
+    """
+    current = fingerprint(filename)
+    if current is None:
+        abort(404)
+    if digest != current:
+        return redirect(url_for('assets.asset', digest=current, filename=filename))
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = compression.negotiate_encoding() if compression.COMPRESSION_ENABLED else None
+    if encoding and compression.is_compressible(mimetype):
+        response = Response(_compressed_asset(filename, current, encoding), mimetype=mimetype)
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(f"{current}-{encoding}")
+        response.cache_control.max_age = ASSETS_MAX_AGE
+        response.make_conditional(request)
+    else:
+        response = send_from_directory(STATIC_DIR, filename, max_age=ASSETS_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _compressed_asset(filename, digest, encoding):
+    with _lock:
+        cached = _compressed.get((filename, encoding))
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    with open(os.path.join(STATIC_DIR, filename), "rb") as f:
+        data = compression.compress(f.read(), encoding)
+    with _lock:
+        _compressed[(filename, encoding)] = (digest, data)
+    return data
+
+
+def _check_integrity(data, integrity):
+    # Hash en el formato de Subresource Integrity: "<algoritmo>-<digest en base64>"
+    algorithm = integrity.split("-", 1)[0]
+    return f"{algorithm}-" + base64.b64encode(hashlib.new(algorithm, data).digest()).decode() == integrity
+
+
+def fetch_vendor_assets(force=False, timeout=30):
+    """
+    Descarga las dependencias de VENDOR_ASSETS en app/static y comprueba su integridad.
+    :param force: Volver a descargar los ficheros que ya existen.
+    :raises ValueError: Si un fichero descargado no coincide con su hash de integridad.
+    :return: Lista de ficheros descargados.
+    :rtype: list
+    """
+    downloaded = []
+    for filename, (url, integrity) in VENDOR_ASSETS.items():
+        path = os.path.join(STATIC_DIR, filename)
+        if os.path.exists(path) and not force:
+            continue
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            data = response.read()
+        if not _check_integrity(data, integrity):
+            raise ValueError(f"La integridad de {url} no coincide con {integrity}.")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        downloaded.append(filename)
+    return downloaded
+
+
+def init_app(app):
+    """Registra la ruta de ficheros con huella y las funciones asset_url y asset_integrity de las plantillas."""
+    app.register_blueprint(assets)
+    app.add_template_global(asset_url)
+    app.add_template_global(asset_integrity)
+    missing = [filename for filename in VENDOR_ASSETS if fingerprint(filename) is None]
+    if missing and not cdn_fallback_enabled(app):
+        logger.error("Faltan ficheros estáticos de terceros (%s): ejecute flask fetch-assets", ", ".join(missing))
@@ -0,0 +1,94 @@
+# app/cli.py
+from app.services.batch_generation import generate_tasks_for_stories
+from app.services.transfer_manager import TransferManager, KINDS, FORMATS, detect_format
+from app.services.report_manager import rebuild_task_summaries
+from app.db import db_session
+from app import migrations
+from app.assets import fetch_vendor_assets
+import click
+
+
+def register_commands(app):
+    """Registra los comandos de línea de órdenes de la aplicación (flask <comando>)."""
+
+    @app.cli.command("generate-tasks")
+    @click.option("--story-id", "story_ids", type=int, multiple=True, help="ID de una historia de usuario (se puede repetir).")
+    @click.option("--project", help="Generar tareas para todas las historias del proyecto.")
+    @click.option("--concurrency", type=int, default=None, help="Número máximo de llamadas simultáneas al modelo.")
+    @click.option("--timeout", type=float, default=None, help="Tiempo máximo en segundos de cada llamada al modelo.")
+    @click.option("--force", is_flag=True, help="Regenerar también las historias que no han cambiado.")
+    def generate_tasks_command(story_ids, project, concurrency, timeout, force):
+        """Genera con IA las tareas de varias historias de usuario en paralelo."""
+        if not story_ids and not project:
+            raise click.UsageError("Indica al menos un --story-id o un --project.")
+        results = generate_tasks_for_stories(story_ids=list(story_ids), project=project,
+                                             concurrency=concurrency, timeout=timeout, force=force)
+        for result in results:
+            if result["status"] == "unchanged":
+                click.echo(f"Historia {result['user_story_id']}: sin cambios desde la última generación")
+            elif result["status"] == "ok":
+                click.echo(f"Historia {result['user_story_id']}: {len(result['task_ids'])} tareas ({result['elapsed_seconds']:.2f}s)")
+            else:
+                click.echo(f"Historia {result['user_story_id']}: error - {result['error']}", err=True)
+
+    @app.cli.command("db-upgrade")
+    @click.option("--target", type=int, default=None, help="Versión máxima a aplicar.")
+    def db_upgrade_command(target):
+        """Aplica las migraciones pendientes del esquema de la base de datos."""
+        applied = migrations.upgrade(target=target)
+        click.echo(f"Migraciones aplicadas: {applied}" if applied else "El esquema ya está actualizado.")
+
+    @app.cli.command("db-status")
+    def db_status_command():
+        """Muestra la versión del esquema y las diferencias con los modelos."""
+        problems = migrations.check_schema()
+        if not problems:
+            click.echo("El esquema está actualizado.")
+        for problem in problems:
+            click.echo(problem)
+
+    @app.cli.command("export-data")
+    @click.argument("kind", type=click.Choice(list(KINDS)))
+    @click.option("--output", "-o", default="-", help="Fichero de salida (por defecto la salida estándar).")
+    @click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default=None, help="Formato (por defecto según la extensión de --output).")
+    @click.option("--project", help="Exportar solo un proyecto.")
+    @click.option("--batch-size", type=int, default=None, help="Filas leídas en cada lote.")
+    def export_data_command(kind, output, fmt, project, batch_size):
+        """Exporta historias de usuario o tareas en NDJSON o CSV."""
+        fmt = fmt or detect_format(output)
+        with click.open_file(output, "wb") as file:
+            for chunk in TransferManager().export_records(kind, fmt, project=project, batch_size=batch_size):
+                file.write(chunk)
+
+    @app.cli.command("import-data")
+    @click.argument("kind", type=click.Choice(list(KINDS)))
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default=None, help="Formato (por defecto según la extensión del fichero).")
+    @click.option("--batch-size", type=int, default=None, help="Filas insertadas en cada transacción.")
+    @click.option("--new-ids", is_flag=True, help="Ignorar los IDs del fichero y dejar que la base de datos los asigne.")
+    def import_data_command(kind, path, fmt, batch_size, new_ids):
+        """Importa historias de usuario o tareas desde un fichero NDJSON o CSV."""
+        with open(path, encoding="utf-8", newline="") as file:
+            summary = TransferManager().import_records(kind, file, fmt or detect_format(path),
+                                                       batch_size=batch_size, keep_ids=not new_ids)
+        click.echo(f"Importados: {summary['imported']} en {summary['batches']} lotes. Filas no válidas: {summary['failed']}")
+        for error in summary["errors"]:
+            click.echo(f"Línea {error['line']}: {error['error']}", err=True)
+
+    @app.cli.command("rebuild-reports")
+    def rebuild_reports_command():
+        """Reconstruye la tabla de resúmenes de tareas usada por los informes."""
+        try:
+            rows = rebuild_task_summaries(db_session)
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        click.echo(f"Resúmenes de tareas reconstruidos: {rows} filas.")
+
+    @app.cli.command("fetch-assets")
+    @click.option("--force", is_flag=True, help="Volver a descargar los ficheros que ya existen.")
+    def fetch_assets_command(force):
+        """Descarga Bootstrap en app/static (comprobando su integridad) para servirlo sin CDN."""
+        downloaded = fetch_vendor_assets(force=force)
+        click.echo(f"Ficheros descargados: {', '.join(downloaded)}" if downloaded else "Los ficheros ya están descargados.")
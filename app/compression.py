@@ -0,0 +1,74 @@
+# app/compression.py
+from flask import request
+import gzip
+import os
+
+# Configuración de la compresión de respuestas
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500")) # Bytes mínimos para comprimir una respuesta
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")) # Nivel de gzip (1 - 9)
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5")) # Calidad de brotli (0 - 11)
+
+# Tipos de contenido que se comprimen (las imágenes y ficheros binarios ya lo están)
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "text/csv", "text/javascript", "application/javascript",
+                      "application/json", "application/problem+json", "image/svg+xml")
+
+try:
+    import brotli # Dependencia opcional: si no está instalada solo se usa gzip
+except ImportError:
+    brotli = None
+
+
+def encodings():
+    """Codificaciones soportadas por el servidor, en orden de preferencia."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding():
+    """
+    Codificación a usar con la petición en curso según su cabecera Accept-Encoding.
+    :return: 'br', 'gzip' o None si el cliente no acepta ninguna.
+    :rtype: str
+    """
+    accepted = request.accept_encodings
+    for encoding in encodings():
+        if accepted[encoding]:
+            return encoding
+    return None
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype in COMPRESSIBLE_TYPES
+
+
+def compress(data, encoding):
+    """Comprime bytes con gzip (sin fecha en la cabecera, para que el resultado sea estable) o brotli."""
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _after_request(response):
+    # Solo respuestas completas en memoria: los streams (SSE, exportaciones) y los ficheros se envían tal cual
+    if (request.method == "HEAD" or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or not is_compressible(response.mimetype)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESSION_MIN_SIZE:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # El cuerpo comprimido no es idéntico byte a byte: el ETag pasa a ser débil (If-None-Match compara en débil)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """Comprime con brotli o gzip las respuestas HTML, JSON, CSS y JavaScript según Accept-Encoding."""
+    if COMPRESSION_ENABLED:
+        app.after_request(_after_request)
@@ -1,11 +1,471 @@
 # app/db.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import sessionmaker, declarative_base, scoped_session, Session
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.sql.dml import UpdateBase
+from app.registry import LazyResource
+import functools
+import itertools
+import logging
+import threading
+import time
 import os
 
+logger = logging.getLogger(__name__)
+
 # Usar variables de entorno para seguridad
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+# Réplicas de solo lectura del primario (DATABASE_URL)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()] # URLs separadas por comas
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30")) # Segundos sin usar una réplica caída antes de reintentarlo
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5")) # Lecturas en el primario tras una escritura (retraso de replicación)
+
+# Configuración del pool de conexiones (ajustable según el número de workers/hilos de gunicorn)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10")) # Conexiones persistentes por proceso
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20")) # Conexiones extra permitidas en picos de carga
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30")) # Segundos máximos esperando una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # Reciclar conexiones antes del wait_timeout de MySQL
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+class PoolMetrics:
+    """
+    Métricas del pool de conexiones: checkouts, checkins y tiempo de espera por una conexión.
+    Permiten dimensionar el pool de MySQL en función del número de workers de gunicorn.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0 # Conexiones físicas abiertas
+            self.checkouts = 0 # Conexiones entregadas por el pool
+            self.checkins = 0 # Conexiones devueltas al pool
+            self.invalidations = 0 # Conexiones descartadas (p. ej. por pre-ping fallido)
+            self.timeouts = 0 # Esperas que superaron DB_POOL_TIMEOUT
+            self.wait_count = 0 # Número de esperas medidas
+            self.wait_total = 0.0 # Tiempo total de espera en segundos
+            self.wait_max = 0.0 # Mayor tiempo de espera en segundos
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "checked_out": self.checkouts - self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_count": self.wait_count,
+                "wait_total_seconds": self.wait_total,
+                "wait_max_seconds": self.wait_max,
+                "wait_avg_seconds": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool que mide cuánto tiempo espera cada petición hasta obtener una conexión."""
+    metrics = pool_metrics
+
+    @classmethod
+    def with_metrics(cls, metrics):
+        """Clase de pool que registra en otras métricas (p. ej. las de una réplica); se mantiene al recrear el pool."""
+        return type(cls.__name__, (cls,), {"metrics": metrics})
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.incr("timeouts")
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+
+def _engine_options(url, metrics=pool_metrics):
+    """Devuelve los argumentos de create_engine adecuados para la URL de base de datos."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # SQLite en memoria: una única conexión compartida entre hilos (tests y desarrollo)
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    options = {
+        "poolclass": MeteredQueuePool if metrics is pool_metrics else MeteredQueuePool.with_metrics(metrics),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def _instrument_pool(engine, metrics=pool_metrics):
+    """Registra los eventos del pool que alimentan metrics (por defecto pool_metrics, las del primario)."""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        metrics.incr("connects")
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.incr("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        metrics.incr("checkins")
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.incr("invalidations")
+
+
+def _sqlite_foreign_keys(engine):
+    """SQLite solo aplica las claves foráneas (y ON DELETE CASCADE) si se activan en cada conexión."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _enable_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def _create_engine():
+    return create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+
+
+def _engine_after_fork(engine):
+    # El hijo descarta las sesiones y conexiones heredadas sin cerrarlas (siguen siendo del padre) y
+    # conserva el engine con sus eventos registrados: abrirá conexiones nuevas en el primer uso
+    db_session.registry.clear()
+    engine.dispose(close=False)
+
+
+# Engine de la aplicación: se crea en la primera consulta, no al importar el módulo
+engine_resource = LazyResource("database", _create_engine, dispose=lambda engine: engine.dispose(),
+                               after_fork=_engine_after_fork)
+engine_resource.on_create(_instrument_pool)
+engine_resource.on_create(_sqlite_foreign_keys)
+
+
+# Funciones aplicadas a cada engine creado, el del primario y los de las réplicas (ver on_engine_create)
+_engine_hooks = []
+
+
+def on_engine_create(callback):
+    """
+    Registra callback(engine) para el engine del primario y para los de las réplicas, tanto los que ya
+    existen como los que se creen después (p. ej. la instrumentación de las consultas de cada petición).
+    """
+    _engine_hooks.append(callback)
+    engine_resource.on_create(callback)
+    replicas.apply(callback)
+    return callback
+
+
+def get_engine():
+    """Engine de base de datos del proceso (se crea en la primera llamada)."""
+    return engine_resource.get()
+
+
+def __getattr__(name):
+    # app.db.engine se mantiene por compatibilidad, pero se resuelve de forma perezosa
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class ReplicaSet:
+    """
+    Réplicas de solo lectura del primario. Los engines se crean en el primer uso y se reparten las lecturas
+    por turnos. Una réplica que no acepta conexiones (o que pierde la conexión a mitad de una consulta) se
+    deja de usar durante retry_seconds: mientras tanto sus lecturas van a las demás o al primario.
+    :param urls: URLs de las réplicas.
+    :param retry_seconds: Segundos sin usar una réplica caída.
+    """
+    def __init__(self, urls=(), retry_seconds=DB_REPLICA_RETRY_SECONDS):
+        self.urls = list(urls)
+        self.retry_seconds = retry_seconds
+        self.metrics = {url: PoolMetrics() for url in self.urls} # Métricas del pool de cada réplica
+        self._down_until = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._engines = LazyResource("database_replicas", self._create_engines,
+                                     dispose=lambda engines: [engine.dispose() for engine in engines],
+                                     after_fork=lambda engines: [engine.dispose(close=False) for engine in engines])
+
+    def __bool__(self):
+        return bool(self.urls)
+
+    def _create_engines(self):
+        engines = []
+        for url in self.urls:
+            engine = create_engine(url, **_engine_options(url, self.metrics[url]))
+            _instrument_pool(engine, self.metrics[url])
+            _sqlite_foreign_keys(engine)
+            event.listen(engine, "handle_error", self._on_error)
+            for hook in _engine_hooks:
+                hook(engine)
+            engines.append(engine)
+        return engines
+
+    def apply(self, callback):
+        """Aplica callback(engine) a las réplicas ya creadas (las siguientes lo reciben de _engine_hooks)."""
+        if self._engines.initialized:
+            for engine in self._engines.get():
+                callback(engine)
+
+    def _on_error(self, context):
+        # Conexión perdida a mitad de una consulta o réplica que no acepta conexiones (sin conexión en el
+        # contexto). Un pre-ping fallido no cuenta: el pool vuelve a conectar y, si no puede, llega aquí.
+        # is_disconnect marca el error como connection_invalidated para que read_only repita la lectura
+        if context.is_pre_ping or not (context.is_disconnect or context.connection is None):
+            return
+        context.is_disconnect = True
+        self.mark_down(context.engine, context.original_exception)
+
+    def mark_down(self, engine, error=None):
+        with self._lock:
+            self._down_until[engine.url] = time.monotonic() + self.retry_seconds
+        logger.warning("Réplica %s no disponible durante %ss: %s", engine.url.render_as_string(hide_password=True),
+                       self.retry_seconds, error)
+
+    def is_up(self, engine):
+        with self._lock:
+            return self._down_until.get(engine.url, 0) <= time.monotonic()
+
+    def choose(self):
+        """
+        Réplica disponible para una sesión nueva (por turnos). No se comprueba la conexión: de eso se
+        encargan el pre-ping del pool y handle_error, y read_only repite en el primario la lectura que falle.
+        :return: Engine de la réplica, o None si no hay ninguna disponible.
+        """
+        engines = self._engines.get() if self.urls else []
+        start = next(self._turn)
+        for i in range(len(engines)):
+            engine = engines[(start + i) % len(engines)]
+            if self.is_up(engine):
+                return engine
+        return None
+
+    def status(self):
+        engines = self._engines.get() if self.urls else []
+        return [{"url": engine.url.render_as_string(hide_password=True), "available": self.is_up(engine),
+                 **_pool_status(engine, self.metrics[url])} for url, engine in zip(self.urls, engines)]
+
+
+# Réplicas del proceso (vacío si no se configura DATABASE_REPLICA_URLS)
+replicas = ReplicaSet(DATABASE_REPLICA_URLS)
+
+# Destino de las lecturas del contexto actual: None (primario), 'replica' o 'primary' (forzado)
+_read_route = ContextVar("db_read_route", default=None)
+# Lecturas hechas en réplicas dentro de track_replica_reads
+_replica_reads = ContextVar("db_replica_reads", default=None)
+
+
+@contextmanager
+def replica_reads():
+    """Las consultas de lectura del bloque pueden ir a una réplica (salvo que se haya forzado el primario)."""
+    token = _read_route.set(_read_route.get() or "replica")
+    try:
+        yield
+    finally:
+        _read_route.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Todas las consultas del bloque van al primario, aunque se llame a métodos de solo lectura."""
+    token = _read_route.set("primary")
+    try:
+        yield
+    finally:
+        _read_route.reset(token)
+
+
+@contextmanager
+def track_replica_reads():
+    """
+    Registra si alguna consulta del bloque se ha leído de una réplica (p. ej. para cachear menos tiempo
+    un resultado que puede llevar retraso).
+    :return: Lista con un elemento por cada consulta leída de una réplica.
+    """
+    outer = _replica_reads.get()
+    reads = []
+    token = _replica_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _replica_reads.reset(token)
+        if outer is not None:
+            outer.extend(reads)
+
+
+def read_only(method):
+    """
+    Decorador de los métodos de los managers que solo leen: sus consultas pueden ir a una réplica.
+    Si la réplica pierde la conexión (o no la acepta) durante la lectura, handle_error la marca como caída
+    y el método se repite una vez en el primario, siempre que la sesión no tenga cambios sin guardar.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _read_route.get() is not None:
+            # Dentro de otro método de solo lectura (o de primary_reads): el reintento lo hace el externo
+            with replica_reads():
+                return method(*args, **kwargs)
+        session = getattr(args[0], "db", None) if args else None
+        session = session if session is not None else db_session
+        with replica_reads(), track_replica_reads() as reads:
+            try:
+                return method(*args, **kwargs)
+            except exc.DBAPIError as e:
+                if not (e.connection_invalidated and reads) or session.new or session.dirty or session.deleted:
+                    raise
+                logger.warning("Lectura repetida en el primario tras fallar la réplica: %s", e.orig)
+        # La transacción de la sesión incluye la conexión invalidada: se descarta antes de repetir
+        session.rollback()
+        session.info.pop("replica", None)
+        with primary_reads():
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class LazySession(Session):
+    """
+    Sesión que obtiene el engine en el momento de ejecutar, no al crear la factoría de sesiones.
+    Las escrituras (flush e INSERT/UPDATE/DELETE) van siempre al primario. Las lecturas de los métodos
+    marcados con read_only van a una réplica, la misma durante toda la sesión, salvo que la sesión ya haya
+    escrito o haya escrito hace menos de DB_READ_YOUR_WRITES_SECONDS (lee lo que acaba de escribir) o que
+    sea la sesión de una petición que modifica datos (info["primary"]).
+    """
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.bind is not None:
+            return self.bind
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+            return get_engine()
+        if (_read_route.get() != "replica" or not replicas or self.info.get("primary") or self.info.get("wrote")
+                or self.info.get("primary_until", 0) > time.time()):
+            return get_engine()
+        replica = self.info.get("replica")
+        if replica is None or not replicas.is_up(replica):
+            replica = self.info["replica"] = replicas.choose()
+        if replica is None:
+            return get_engine()
+        reads = _replica_reads.get()
+        if reads is not None:
+            reads.append(replica.url)
+        return replica
+
+
+@event.listens_for(LazySession, "after_commit")
+def _after_commit(session):
+    # Lo escrito puede tardar en llegar a las réplicas: la sesión sigue leyendo del primario un tiempo
+    if session.info.pop("wrote", False):
+        session.info["primary_until"] = time.time() + DB_READ_YOUR_WRITES_SECONDS
+
+
+@event.listens_for(LazySession, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("wrote", None)
+
+
+# En SQLite CURRENT_TIMESTAMP se guarda sin microsegundos: usar el mismo formato en los parámetros
+# permite comparar fechas por igualdad (p. ej. en la paginación por clave)
+SQLITE_TIMESTAMP = sqlite.DATETIME(
+    storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+)
+SessionLocal = sessionmaker(class_=LazySession, autocommit=False, autoflush=False)
+Base = declarative_base()
+
+# Sesión por hilo/petición: cada petición obtiene su propia sesión y se libera en el teardown
+db_session = scoped_session(SessionLocal)
+
+
+def _pool_status(engine, metrics):
+    status = metrics.snapshot()
+    pool = engine.pool
+    status["pool_class"] = type(pool).__name__
+    if isinstance(pool, QueuePool):
+        status.update({
+            "pool_size": pool.size(),
+            "pool_checked_in": pool.checkedin(),
+            "pool_checked_out": pool.checkedout(),
+            "pool_overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        })
+    return status
+
+
+def pool_status():
+    """
+    Estado actual del pool del primario junto con las métricas acumuladas de checkout y espera, y el de
+    cada réplica (con sus propias métricas) en "replicas".
+    """
+    status = _pool_status(get_engine(), pool_metrics)
+    if replicas:
+        status["replicas"] = replicas.status()
+        status["replicas_available"] = sum(replica["available"] for replica in status["replicas"])
+    return status
+
+
+def shutdown_session(exception=None):
+    """Deshace la transacción pendiente (si la petición falló) y libera la sesión de la petición."""
+    if exception is not None:
+        db_session.rollback()
+    db_session.remove()
+
+
+def _route_reads_before():
+    # Solo las peticiones GET y HEAD leen de las réplicas: las demás comprueban datos que van a modificar.
+    # Si el cliente escribió hace poco (en esta u otra instancia) sus lecturas también van al primario
+    from flask import request, session
+    if not replicas:
+        return
+    if request.method not in ("GET", "HEAD"):
+        db_session.info["primary"] = True
+    primary_until = session.get("_db_primary_until", 0)
+    if primary_until > time.time():
+        db_session.info["primary_until"] = primary_until
+
+
+def _read_your_writes_after(response):
+    # Tras escribir se recuerda en la cookie de sesión, para que p. ej. la página a la que se redirige
+    # tras crear una historia no se lea de una réplica que aún no la tiene
+    from flask import session
+    if not replicas:
+        return response
+    primary_until = db_session.info.get("primary_until", 0)
+    if primary_until > session.get("_db_primary_until", 0):
+        session["_db_primary_until"] = primary_until
+    return response
+
+
+def init_app(app):
+    """Conecta el ciclo de vida de la sesión de base de datos con el de la aplicación Flask."""
+    app.teardown_appcontext(shutdown_session)
+    app.before_request(_route_reads_before)
+    app.after_request(_read_your_writes_after)
@@ -0,0 +1,314 @@
+# app/instrumentation.py
+from contextlib import contextmanager
+from collections import Counter
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+import logging
+import threading
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la instrumentación
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000")) # Peticiones más lentas se registran en el log
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10")) # Repeticiones de la misma consulta en una petición
+
+# Límites de los histogramas de duración (segundos)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels) + "}"
+
+
+class Metric:
+    """Métrica con etiquetas en formato de exposición de Prometheus."""
+    kind = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {value}"]
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (1 if amount <= bound else 0) for c, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + amount, count + 1)
+
+    def count(self, **labels):
+        with self._lock:
+            item = self._values.get(self._key(labels))
+            return item[2] if item else 0
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = [f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {c}" for c, bound in zip(counts, self.buckets)]
+        lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# Métricas del proceso (cada worker de gunicorn expone las suyas)
+http_requests = CounterMetric("http_requests_total", "Peticiones HTTP atendidas", ("method", "endpoint", "status"))
+http_duration = HistogramMetric("http_request_duration_seconds", "Duración de las peticiones HTTP", ("endpoint",))
+db_queries = CounterMetric("db_queries_total", "Consultas SQL ejecutadas durante peticiones HTTP", ("endpoint",))
+db_duration = CounterMetric("db_query_duration_seconds_total", "Tiempo en consultas SQL durante peticiones HTTP", ("endpoint",))
+llm_requests = CounterMetric("llm_requests_total", "Llamadas al modelo de IA", ("operation", "outcome"))
+llm_duration = HistogramMetric("llm_request_duration_seconds", "Latencia de las llamadas al modelo de IA", ("operation",))
+llm_tokens = CounterMetric("llm_tokens_total", "Tokens consumidos en las llamadas al modelo de IA", ("kind",))
+llm_retries = CounterMetric("llm_retries_total", "Reintentos de llamadas al modelo de IA por causa", ("reason",))
+llm_fallbacks = CounterMetric("llm_backend_fallbacks_total", "Generaciones que pasaron al siguiente backend tras un fallo", ("template", "backend"))
+render_duration = CounterMetric("template_render_duration_seconds_total", "Tiempo de renderizado de plantillas", ("endpoint",))
+slow_requests = CounterMetric("http_slow_requests_total", "Peticiones por encima de SLOW_REQUEST_MS", ("endpoint",))
+n_plus_one = CounterMetric("db_n_plus_one_total", "Peticiones con una consulta repetida N_PLUS_ONE_THRESHOLD veces o más", ("endpoint",))
+search_duration = HistogramMetric("search_query_duration_seconds", "Duración de las búsquedas de texto completo", ("backend",))
+
+METRICS = [http_requests, http_duration, db_queries, db_duration, llm_requests, llm_duration, llm_tokens,
+           llm_retries, llm_fallbacks, render_duration, slow_requests, n_plus_one, search_duration]
+
+
+class RequestMetrics:
+    """Mediciones de una petición: consultas, tiempo de base de datos, llamadas al modelo y renderizado."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.llm_calls = 0
+        self.llm_time = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.render_time = 0.0
+        self._render_start = None
+
+    def server_timing(self, total):
+        """Valor de la cabecera Server-Timing (duraciones en milisegundos)."""
+        parts = [f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"']
+        if self.llm_calls:
+            parts.append(f'llm;dur={self.llm_time * 1000:.2f};desc="{self.llm_calls} calls, '
+                         f'{self.prompt_tokens}+{self.completion_tokens} tokens"')
+        if self.render_time:
+            parts.append(f"render;dur={self.render_time * 1000:.2f}")
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def current_request_metrics():
+    """Mediciones de la petición en curso (None fuera de una petición o con la instrumentación desactivada)."""
+    if not has_request_context():
+        return None
+    return g.get("request_metrics")
+
+
+class LLMCall:
+    """Llamada al modelo en curso; record_usage() anota los tokens de la respuesta."""
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record_usage(self, usage):
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+
+@contextmanager
+def track_llm_call(operation):
+    """
+    Mide una llamada al cliente de Azure OpenAI: latencia, resultado y tokens consumidos.
+    Se acumula en las métricas del proceso y, dentro de una petición, en las de la petición.
+    :param operation: Nombre de la operación (p. ej. "parse" o "stream").
+    """
+    call = LLMCall()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield call
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        llm_requests.inc(operation=operation, outcome=outcome)
+        llm_duration.observe(elapsed, operation=operation)
+        llm_tokens.inc(call.prompt_tokens, kind="prompt")
+        llm_tokens.inc(call.completion_tokens, kind="completion")
+        metrics = current_request_metrics()
+        if metrics is not None:
+            metrics.llm_calls += 1
+            metrics.llm_time += elapsed
+            metrics.prompt_tokens += call.prompt_tokens
+            metrics.completion_tokens += call.completion_tokens
+
+
+def _instrument_engine(engine):
+    """Registra los eventos del engine que miden el número y la duración de las consultas de cada petición."""
+    if getattr(engine, "_request_metrics_instrumented", False):
+        return
+    engine._request_metrics_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        metrics = current_request_metrics()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_time += time.perf_counter() - start
+            metrics.statements[statement] += 1
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # La consulta falló: after_cursor_execute no se ejecutará
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+
+def _before_request():
+    g.request_metrics = RequestMetrics()
+
+
+def _before_render_template(sender, template, context, **extra):
+    metrics = current_request_metrics()
+    if metrics is not None:
+        metrics._render_start = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    metrics = current_request_metrics()
+    if metrics is not None and metrics._render_start is not None:
+        metrics.render_time += time.perf_counter() - metrics._render_start
+        metrics._render_start = None
+
+
+def _after_request(response):
+    metrics = g.pop("request_metrics", None)
+    if metrics is None:
+        return response
+    total = time.perf_counter() - metrics.start
+    endpoint = request.endpoint or "none"
+    http_requests.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    http_duration.observe(total, endpoint=endpoint)
+    db_queries.inc(metrics.queries, endpoint=endpoint)
+    db_duration.inc(metrics.db_time, endpoint=endpoint)
+    if metrics.render_time:
+        render_duration.inc(metrics.render_time, endpoint=endpoint)
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = metrics.server_timing(total)
+
+    if total * 1000 >= SLOW_REQUEST_MS:
+        slow_requests.inc(endpoint=endpoint)
+        logger.warning("Petición lenta %s %s: %.0f ms (db %.0f ms en %d consultas, llm %.0f ms en %d llamadas, render %.0f ms)",
+                       request.method, request.path, total * 1000, metrics.db_time * 1000, metrics.queries,
+                       metrics.llm_time * 1000, metrics.llm_calls, metrics.render_time * 1000)
+    repeated = [(statement, count) for statement, count in metrics.statements.items()
+                if count >= N_PLUS_ONE_THRESHOLD and statement.lstrip().upper().startswith("SELECT")]
+    if repeated:
+        n_plus_one.inc(endpoint=endpoint)
+        for statement, count in repeated:
+            logger.warning("Posible N+1 en %s %s: consulta repetida %d veces: %s",
+                           request.method, request.path, count, " ".join(statement.split())[:200])
+    return response
+
+
+def render_metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    from app.db import pool_status
+    from app.services.llm_cache import llm_cache
+    from app.services.llm_client import llm
+    from app.services.prompts import prompt_stats
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    # Estado del pool de conexiones y de la caché del modelo como gauges
+    for name, value in pool_status().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"# TYPE db_pool_{name} gauge")
+            lines.append(f"db_pool_{name} {value}")
+    for name, value in llm_cache.stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"# TYPE llm_cache_{name} gauge")
+            lines.append(f"llm_cache_{name} {value}")
+    # Tokens por plantilla de prompt: estimación local, recortes y tokens facturados por el proveedor
+    for name in ("renders", "trimmed", "over_budget", "estimated_tokens", "prompt_tokens", "completion_tokens"):
+        lines.append(f"# TYPE llm_prompt_{name}_total counter")
+        for template, stats in prompt_stats().items():
+            lines.append(f"llm_prompt_{name}_total{_format_labels((('template', template),))} {stats[name]}")
+    status = llm.status()
+    lines.append("# TYPE llm_circuit_open gauge")
+    lines.append(f"llm_circuit_open {0 if status['circuit'] == 'cerrado' else 1}")
+    lines.append("# TYPE llm_circuit_consecutive_failures gauge")
+    lines.append(f"llm_circuit_consecutive_failures {status['consecutive_failures']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    """Reinicia las métricas del proceso (p. ej. en tests)."""
+    for metric in METRICS:
+        metric.reset()
+
+
+def init_app(app, engine=None):
+    """Conecta la instrumentación por petición con la aplicación Flask y el engine de base de datos."""
+    if not METRICS_ENABLED:
+        return
+    if engine is None:
+        # Los engines del primario y de las réplicas se crean en el primer uso: los eventos se registran cuando existan
+        from app.db import on_engine_create
+        on_engine_create(_instrument_engine)
+    else:
+        _instrument_engine(engine)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
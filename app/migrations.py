@@ -0,0 +1,244 @@
+# app/migrations.py
+from sqlalchemy import Table, MetaData, Column, Integer, String, DateTime, inspect, insert, select, bindparam
+from sqlalchemy.schema import Index, DropIndex, ForeignKeyConstraint, AddConstraint, DropConstraint
+from sqlalchemy.sql import func
+from app.db import Base, get_engine
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tabla con las migraciones aplicadas (una fila por versión)
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# Migraciones registradas, en orden de versión
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registra una función upgrade(connection) como la migración con la versión indicada."""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _load_models():
+    # Importar los modelos registra sus tablas en Base.metadata
+    from app.models import user_story, task, task_summary, generation_job, collection_change # noqa: F401
+
+
+def _model_index(table_name, index_name):
+    """Devuelve el índice definido en el modelo para la tabla indicada."""
+    for index in Base.metadata.tables[table_name].indexes:
+        if index.name == index_name:
+            return index
+    raise KeyError(index_name)
+
+
+def _index_names(connection, table_name):
+    return {index["name"] for index in inspect(connection).get_indexes(table_name)}
+
+
+def _create_index_if_missing(connection, table_name, index_name):
+    if index_name not in _index_names(connection, table_name):
+        _model_index(table_name, index_name).create(bind=connection)
+
+
+def _add_column_if_missing(connection, table_name, column_name):
+    # Añade una columna del modelo con ALTER TABLE (nullable y sin valor por defecto, válido en todos los motores)
+    if column_name in {column["name"] for column in inspect(connection).get_columns(table_name)}:
+        return
+    column = Base.metadata.tables[table_name].c[column_name]
+    connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_name} "
+                               f"{column.type.compile(dialect=connection.dialect)}")
+
+
+def _drop_index_if_exists(connection, table_name, index_name, *columns):
+    # El índice se declara sobre una tabla auxiliar para no modificar los metadatos de los modelos
+    if index_name in _index_names(connection, table_name):
+        table = Table(table_name, MetaData(), *(Column(name, String(255)) for name in columns))
+        connection.execute(DropIndex(Index(index_name, *(table.c[name] for name in columns))))
+
+
+@migration(1, "Esquema inicial")
+def _initial_schema(connection):
+    # En una base de datos nueva crea todas las tablas; en una existente no modifica nada
+    Base.metadata.create_all(bind=connection)
+
+
+@migration(2, "Índices de tareas por historia de usuario y estado, e historias por proyecto y fecha")
+def _foreign_key_and_status_indexes(connection):
+    _create_index_if_missing(connection, "tasks", "ix_tasks_user_story_id")
+    _create_index_if_missing(connection, "tasks", "ix_tasks_user_story_id_status")
+    _create_index_if_missing(connection, "user_stories", "ix_user_stories_created_at_id")
+    _create_index_if_missing(connection, "user_stories", "ix_user_stories_project_created_at")
+    # ix_user_stories_project queda cubierto por ix_user_stories_project_created_at
+    _drop_index_if_exists(connection, "user_stories", "ix_user_stories_project", "project")
+
+
+@migration(3, "Borrado en cascada (ON DELETE CASCADE) de las tareas al eliminar su historia de usuario")
+def _cascade_task_foreign_key(connection):
+    # SQLite no permite modificar restricciones existentes: en bases de datos SQLite anteriores las tareas
+    # se siguen borrando explícitamente en la misma transacción que sus historias (UserStoryManager)
+    if connection.dialect.name == "sqlite":
+        return
+    for foreign_key in inspect(connection).get_foreign_keys("tasks"):
+        if foreign_key["referred_table"] != "user_stories" or foreign_key["constrained_columns"] != ["user_story_id"]:
+            continue
+        if (foreign_key.get("options") or {}).get("ondelete", "").upper() == "CASCADE":
+            return
+        # Tablas auxiliares para no modificar los metadatos de los modelos
+        metadata = MetaData()
+        Table("user_stories", metadata, Column("id", Integer, primary_key=True))
+        tasks = Table("tasks", metadata, Column("user_story_id", Integer))
+        old = ForeignKeyConstraint(["user_story_id"], ["user_stories.id"], name=foreign_key["name"])
+        tasks.append_constraint(old)
+        connection.execute(DropConstraint(old))
+        new = ForeignKeyConstraint(["user_story_id"], ["user_stories.id"], name=foreign_key["name"], ondelete="CASCADE")
+        tasks.append_constraint(new)
+        connection.execute(AddConstraint(new))
+
+
+@migration(4, "Tabla task_summaries con los totales de tareas por historia, estado y prioridad")
+def _task_summaries(connection):
+    from app.models.task_summary import TaskSummary
+    from app.services.report_manager import rebuild_task_summaries
+    TaskSummary.__table__.create(bind=connection, checkfirst=True)
+    rebuild_task_summaries(connection)
+
+
+@migration(5, "Huellas del contenido de las historias de usuario para la regeneración incremental de tareas")
+def _story_fingerprints(connection, batch_size=1000):
+    from app.models.user_story import UserStory
+    from app.models.task import Task
+    from app.services.user_story_manager import FINGERPRINT_FIELDS, story_fingerprint
+    _add_column_if_missing(connection, "user_stories", "content_fingerprint")
+    _add_column_if_missing(connection, "user_stories", "tasks_fingerprint")
+    # Tabla auxiliar: la del modelo tiene columnas de migraciones posteriores (updated_at, que además se
+    # añadiría a cada UPDATE)
+    model = UserStory.__table__
+    table = Table("user_stories", MetaData(), Column("id", Integer, primary_key=True),
+                  *(Column(name, model.c[name].type) for name in (*FINGERPRINT_FIELDS, "content_fingerprint", "tasks_fingerprint")))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, *(table.c[field] for field in FINGERPRINT_FIELDS))
+            .where(table.c.id > last_id, table.c.content_fingerprint.is_(None))
+            .order_by(table.c.id).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        connection.execute(
+            table.update().where(table.c.id == bindparam("story_id")).values(content_fingerprint=bindparam("fingerprint")),
+            [{"story_id": row["id"], "fingerprint": story_fingerprint(row)} for row in rows],
+        )
+        last_id = rows[-1]["id"]
+    # Las tareas existentes se consideran generadas con el contenido actual de su historia: solo las historias
+    # que se editen a partir de ahora se regeneran
+    has_tasks = select(Task.__table__.c.id).where(Task.__table__.c.user_story_id == table.c.id).exists()
+    connection.execute(table.update().where(table.c.tasks_fingerprint.is_(None), has_tasks)
+                       .values(tasks_fingerprint=table.c.content_fingerprint))
+
+
+@migration(6, "Búsqueda de texto completo de historias y tareas (FTS5 en SQLite, FULLTEXT en MySQL)")
+def _full_text_search(connection):
+    from app.services.search_index import create_native_index
+    create_native_index(connection)
+
+
+@migration(7, "Fecha de modificación de historias y tareas y de borrado de historias (Last-Modified de la API)")
+def _modification_dates(connection):
+    from app.models.user_story import UserStory
+    from app.models.task import Task
+    from app.models.collection_change import CollectionChange
+    for table in (UserStory.__table__, Task.__table__):
+        _add_column_if_missing(connection, table.name, "updated_at")
+        # Las filas existentes se consideran sin cambios desde su creación
+        connection.execute(table.update().where(table.c.updated_at.is_(None))
+                           .values(updated_at=func.coalesce(table.c.created_at, func.now())))
+    _create_index_if_missing(connection, "user_stories", "ix_user_stories_updated_at")
+    CollectionChange.__table__.create(bind=connection, checkfirst=True)
+
+
+def current_version(connection):
+    """Versión del esquema aplicada en la base de datos (0 si nunca se ha migrado)."""
+    if not inspect(connection).has_table(schema_migrations.name):
+        return 0
+    return connection.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def pending_migrations(connection):
+    version = current_version(connection)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade(engine=None, target=None):
+    """
+    Aplica en orden las migraciones pendientes, cada una en su propia transacción.
+    :param engine: Engine sobre el que migrar (por defecto el de la aplicación).
+    :param target: Versión máxima a aplicar (por defecto la última).
+    :return: Lista de versiones aplicadas.
+    """
+    _load_models()
+    engine = engine if engine is not None else get_engine()
+    with engine.begin() as connection:
+        schema_migrations.create(bind=connection, checkfirst=True)
+        pending = pending_migrations(connection)
+    applied = []
+    for version, description, upgrade_fn in pending:
+        if target is not None and version > target:
+            break
+        with engine.begin() as connection:
+            upgrade_fn(connection)
+            connection.execute(insert(schema_migrations).values(version=version, description=description))
+        logger.info("Migración %s aplicada: %s", version, description)
+        applied.append(version)
+    return applied
+
+
+def check_schema(engine=None):
+    """
+    Compara el esquema de la base de datos con los modelos y las migraciones registradas.
+    :return: Lista de diferencias encontradas (vacía si el esquema está al día).
+    """
+    _load_models()
+    engine = engine if engine is not None else get_engine()
+    problems = []
+    with engine.connect() as connection:
+        for version, description, _ in pending_migrations(connection):
+            problems.append(f"Migración pendiente {version}: {description}")
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                problems.append(f"Falta la tabla {table.name}")
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    problems.append(f"Falta la columna {table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    problems.append(f"Falta el índice {index.name} en {table.name}")
+    return problems
+
+
+def report_schema_drift(engine=None):
+    """Registra en el log las diferencias entre el esquema y los modelos. Devuelve la lista de diferencias."""
+    try:
+        problems = check_schema(engine)
+    except Exception as e:
+        logger.warning("No se pudo comprobar el esquema de la base de datos: %s", e)
+        return [str(e)]
+    for problem in problems:
+        logger.warning("Esquema desactualizado: %s", problem)
+    if problems:
+        logger.warning("Ejecuta 'flask --app run db-upgrade' o 'python create_tables.py' para actualizar el esquema.")
+    return problems
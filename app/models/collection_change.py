@@ -0,0 +1,9 @@
+# app/models/collection_change.py
+from sqlalchemy import Column, String, DateTime
+from app.db import Base, SQLITE_TIMESTAMP
+
+class CollectionChange(Base):
+    """Fecha del último borrado en una colección: un listado no la puede deducir de las filas que quedan."""
+    __tablename__ = "collection_changes"
+    name = Column(String(50), primary_key=True) # Colección (p. ej. "user_stories")
+    changed_at = Column(DateTime(timezone=True).with_variant(SQLITE_TIMESTAMP, "sqlite"), nullable=False) # Fecha y hora del último borrado
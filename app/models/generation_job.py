@@ -0,0 +1,17 @@
+# app/models/generation_job.py
+from sqlalchemy import Column, Integer, String, Text, DateTime, Enum
+from sqlalchemy.sql import func
+from app.db import Base
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+    id = Column(String(36), primary_key=True) # Identificador único del trabajo (UUID)
+    kind = Column(Enum('user_story', 'tasks', name='job_kind_enum'), nullable=False) # Tipo de generación (historia de usuario o tareas)
+    status = Column(Enum('pendiente', 'en_progreso', 'completado', 'fallido', name='job_status_enum'), nullable=False, default='pendiente') # Estado del trabajo
+    prompt = Column(Text) # Prompt del usuario (solo para generación de historias de usuario)
+    user_story_id = Column(Integer) # Historia de usuario generada o para la que se generan las tareas
+    result = Column(Text) # Resultado del trabajo en formato JSON (IDs creados)
+    error = Column(Text) # Mensaje de error si el trabajo ha fallado
+    created_at = Column(DateTime(timezone=True), server_default=func.now()) # Fecha y hora de creación del trabajo
+    started_at = Column(DateTime(timezone=True)) # Fecha y hora de inicio de la ejecución
+    finished_at = Column(DateTime(timezone=True)) # Fecha y hora de finalización de la ejecución
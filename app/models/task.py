@@ -1,11 +1,15 @@
 # app/models/task.py
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Enum, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Enum, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db import Base
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_user_story_id", "user_story_id"), # Tareas de una historia de usuario
+        Index("ix_tasks_user_story_id_status", "user_story_id", "status"), # Tareas de una historia por estado
+    )
     id = Column(Integer, primary_key=True, index=True) # Identificador único de la tarea
     title = Column(String(255), nullable=False) # Título de la tarea
     description = Column(Text) # Descripción detallada de la tarea 
@@ -16,7 +20,8 @@ class Task(Base):
     category = Column(String(100)) # Categoría de la tarea (ej. "Desarrollo", "Pruebas", "Documentación")
     risk_analysis = Column(Text) # Análisis de riesgos asociado a la tarea
     risk_mitigation = Column(Text) # Plan de mitigación de riesgos asociado a la tarea
-    user_story_id = Column(Integer, ForeignKey("user_stories.id")) # ID de la historia de usuario a la que pertenece la tarea
+    user_story_id = Column(Integer, ForeignKey("user_stories.id", ondelete="CASCADE")) # ID de la historia de usuario a la que pertenece la tarea (se borra con ella)
     created_at = Column(DateTime(timezone=True), server_default=func.now()) # Fecha y hora de creación de la tarea
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now()) # Fecha y hora de la última modificación de la tarea
 
     user_story = relationship("UserStory", back_populates="tasks") # Relación con la historia de usuario a la que pertenece la tarea
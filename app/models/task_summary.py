@@ -0,0 +1,16 @@
+# app/models/task_summary.py
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
+from app.db import Base
+
+class TaskSummary(Base):
+    """Resumen de las tareas de cada historia de usuario por estado y prioridad (se mantiene en cada escritura de tareas)."""
+    __tablename__ = "task_summaries"
+    __table_args__ = (
+        Index("ix_task_summaries_user_story_id", "user_story_id"), # Resúmenes de una historia de usuario
+    )
+    id = Column(Integer, primary_key=True) # Identificador de la fila de resumen
+    user_story_id = Column(Integer, ForeignKey("user_stories.id", ondelete="CASCADE"), nullable=False) # Historia de usuario resumida (se borra con ella)
+    status = Column(String(20)) # Estado de las tareas agrupadas
+    priority = Column(String(20)) # Prioridad de las tareas agrupadas
+    task_count = Column(Integer, nullable=False, default=0) # Número de tareas
+    effort_hours = Column(Float, nullable=False, default=0) # Suma de las horas de esfuerzo estimadas de las tareas
@@ -1,11 +1,16 @@
 # app/models/user_story.py
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Enum
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Enum, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
-from app.db import Base
+from app.db import Base, SQLITE_TIMESTAMP
 
 class UserStory(Base):
     __tablename__ = "user_stories"
+    __table_args__ = (
+        Index("ix_user_stories_created_at_id", "created_at", "id"), # Paginación por clave (created_at, id)
+        Index("ix_user_stories_project_created_at", "project", "created_at"), # Filtro por proyecto ordenado por fecha
+        Index("ix_user_stories_updated_at", "updated_at"), # Última modificación de las historias (Last-Modified del listado)
+    )
     id = Column(Integer, primary_key=True, index=True) # Identificador único de la historia de usuario
     project = Column(String(100), nullable=False) # Proyecto al que pertenece la historia de usuario
     role = Column(String(100), nullable=False) # Rol del usuario que solicita la historia (ej. "Como usuario", "Como administrador")
@@ -15,6 +20,10 @@ class UserStory(Base):
     priority = Column(Enum('baja', 'media', 'alta', 'bloqueante', name='priority_enum')) # Prioridad de la historia de usuario (baja, media, alta, bloqueante)
     story_points = Column(Integer) # Puntos de historia asignados a la historia de usuario (estimación del esfuerzo)
     effort_hours = Column(Float) # Horas de esfuerzo estimadas para completar la historia de usuario
-    created_at = Column(DateTime(timezone=True), server_default=func.now()) # Fecha y hora de creación de la historia de usuario    
+    created_at = Column(DateTime(timezone=True).with_variant(SQLITE_TIMESTAMP, "sqlite"), server_default=func.now()) # Fecha y hora de creación de la historia de usuario    
+    updated_at = Column(DateTime(timezone=True).with_variant(SQLITE_TIMESTAMP, "sqlite"), default=func.now(), onupdate=func.now()) # Fecha y hora de la última modificación de la historia o de sus tareas
+    content_fingerprint = Column(String(64)) # Huella (SHA-256) de los campos de la historia que forman el prompt de sus tareas
+    tasks_fingerprint = Column(String(64)) # Huella del contenido con el que se generaron sus tareas (None = sin generar)
 
-    tasks = relationship("Task", back_populates="user_story", cascade="all, delete-orphan")
+    # passive_deletes: al borrar la historia el ORM no carga sus tareas, las borra la base de datos (ON DELETE CASCADE)
+    tasks = relationship("Task", back_populates="user_story", cascade="all, delete-orphan", passive_deletes=True)
@@ -0,0 +1,105 @@
+# app/registry.py
+import atexit
+import logging
+import threading
+import os
+
+logger = logging.getLogger(__name__)
+
+# Recursos compartidos registrados (engine de base de datos, clientes HTTP...)
+RESOURCES = []
+
+
+class LazyResource:
+    """
+    Recurso compartido por el proceso que se crea en el primer uso y no al importar el módulo.
+    Tras un fork el proceso hijo no reutiliza las conexiones del padre: el recurso se descarta (o se
+    ajusta con after_fork) y se vuelve a crear en el hijo la próxima vez que se pida.
+    :param name: Nombre del recurso (para el log).
+    :param factory: Función sin argumentos que crea el recurso.
+    :param dispose: Función que libera el recurso al apagar el proceso.
+    :param after_fork: Función que prepara el recurso heredado para usarse en el hijo. Si no se indica,
+        el recurso heredado se descarta sin cerrarlo (sus conexiones pertenecen al padre).
+    """
+    def __init__(self, name, factory, dispose=None, after_fork=None):
+        self.name = name
+        self.factory = factory
+        self._dispose = dispose
+        self._after_fork = after_fork
+        self._value = None
+        self._pid = None
+        self._on_create = []
+        self._lock = threading.RLock()
+        RESOURCES.append(self)
+
+    @property
+    def initialized(self):
+        return self._value is not None
+
+    def get(self):
+        """Devuelve el recurso, creándolo si es la primera vez que se usa en este proceso."""
+        value = self._value
+        if value is not None and self._pid == os.getpid():
+            return value
+        with self._lock:
+            if self._value is not None and self._pid != os.getpid():
+                # Fork sin os.register_at_fork (no debería ocurrir): preparar el recurso heredado
+                self.reset_after_fork()
+            if self._value is None:
+                value = self.factory()
+                for callback in self._on_create:
+                    callback(value)
+                self._value = value
+                self._pid = os.getpid()
+                logger.debug("Recurso %s inicializado", self.name)
+            return self._value
+
+    def on_create(self, callback):
+        """Registra callback(recurso) para cada recurso creado (y lo aplica al actual si ya existe)."""
+        with self._lock:
+            self._on_create.append(callback)
+            if self._value is not None:
+                callback(self._value)
+        return callback
+
+    def set(self, value):
+        """Sustituye el recurso (p. ej. por un doble en los tests). Devuelve el anterior."""
+        with self._lock:
+            previous, self._value, self._pid = self._value, value, os.getpid()
+            return previous
+
+    def reset_after_fork(self):
+        with self._lock:
+            if self._value is not None and self._after_fork is not None:
+                self._after_fork(self._value)
+                self._pid = os.getpid()
+            else:
+                self._value = None
+                self._pid = None
+
+    def dispose(self):
+        """Libera el recurso; se volverá a crear si se vuelve a usar."""
+        with self._lock:
+            value, self._value, self._pid = self._value, None, None
+        if value is not None and self._dispose is not None:
+            try:
+                self._dispose(value)
+            except Exception:
+                logger.exception("Error al liberar el recurso %s", self.name)
+
+
+def after_fork():
+    """Prepara todos los recursos heredados para el proceso hijo."""
+    for resource in RESOURCES:
+        resource.reset_after_fork()
+
+
+def dispose_all():
+    """Libera todos los recursos compartidos (al apagar el proceso o el worker)."""
+    for resource in reversed(RESOURCES):
+        resource.dispose()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork)
+atexit.register(dispose_all)
@@ -0,0 +1,548 @@
+from flask import Blueprint, request, Response, stream_with_context
+from pydantic import ValidationError
+from sqlalchemy import Enum
+from app.services.user_story_manager import UserStoryManager
+from app.services.task_manager import TaskManager
+from app.schemas.UserStorySchema import UserStorySchema
+from app.schemas.UserStorySchemas import UserStorySchemas
+from app.schemas.TaskSchema import TaskSchema
+from app.schemas.TaskSchemas import TaskSchemas
+from app.services.transfer_manager import TransferManager, KINDS, FORMATS
+from app.services.report_manager import ReportManager
+from app.services.search_index import search_index
+from app.models.user_story import UserStory
+from app.models.task import Task
+from datetime import datetime, timezone
+import io
+import orjson
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Managers
+user_story_manager = UserStoryManager()
+task_manager = TaskManager()
+transfer_manager = TransferManager()
+report_manager = ReportManager()
+
+# Campos que asigna la base de datos y que no se envían al crear
+SERVER_FIELDS = {"id": None, "created_at": None}
+
+
+def _json(payload, status=200, last_modified=None):
+    """
+    Respuesta JSON serializada con orjson y con soporte de peticiones condicionales.
+    Se añade un ETag calculado sobre el cuerpo y, si se indica, la cabecera Last-Modified (fecha updated_at
+    de las filas); si el cliente envía If-None-Match o If-Modified-Since y el recurso no ha cambiado se
+    responde 304 sin cuerpo.
+    """
+    response = Response(orjson.dumps(payload), status=status, mimetype='application/json')
+    if request.method == 'GET' and status == 200:
+        response.headers['Cache-Control'] = 'no-cache'
+        response.add_etag()
+        last_modified = _http_date(last_modified)
+        # Las fechas se guardan con resolución de segundos: si el recurso se ha modificado en el segundo en
+        # curso, otra escritura en el mismo segundo no cambiaría la fecha y un If-Modified-Since posterior
+        # respondería 304 con datos antiguos. En ese caso solo se envía el ETag
+        if last_modified is not None and last_modified < datetime.now(timezone.utc).replace(microsecond=0):
+            response.last_modified = last_modified
+        response.make_conditional(request)
+    return response
+
+
+def _http_date(value):
+    # Las fechas de SQLite no llevan zona horaria: func.now() las guarda en UTC
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def _not_modified(last_modified):
+    """
+    Responde 304 a un If-Modified-Since sin cargar ni serializar las filas, comparándolo con la fecha de
+    modificación del recurso (una consulta por índice). Si el cliente envía también If-None-Match, este
+    tiene prioridad y se resuelve con el ETag del cuerpo en _json.
+    :param last_modified: Fecha updated_at del recurso.
+    :return: Respuesta 304, o None si hay que generar la respuesta completa.
+    """
+    since = request.if_modified_since
+    last_modified = _http_date(last_modified)
+    if since is None or request.if_none_match or last_modified is None or last_modified > since:
+        return None
+    response = Response(status=304)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _error(message, status):
+    return _json({"error": message}, status=status)
+
+
+def _check_enums(model, values, loc=()):
+    """
+    Comprueba los campos Enum del modelo (prioridad, estado) que los esquemas aceptan como texto libre:
+    un valor desconocido se guardaría pero fallaría al volver a leer la fila.
+    :param model: Modelo cuyas columnas Enum se comprueban.
+    :param values: Valores a guardar.
+    :param loc: Prefijo de la ubicación de los errores (p. ej. ("tasks", 0)).
+    :raises ValidationError: Si algún valor no es uno de los permitidos.
+    """
+    errors = [
+        {"type": "enum", "loc": (*loc, column.name), "input": values[column.name],
+         "ctx": {"expected": ", ".join(f"'{value}'" for value in column.type.enums)}}
+        for column in model.__table__.columns
+        if isinstance(column.type, Enum) and values.get(column.name) is not None
+        and values[column.name] not in column.type.enums
+    ]
+    if errors:
+        raise ValidationError.from_exception_data(model.__name__, errors)
+
+
+def _validation_error(e):
+    return _error([{"field": ".".join(str(loc) for loc in error["loc"]), "message": error["msg"]} for error in e.errors()], 422)
+
+
+# Listar historias de usuario
+@api.route('/user-stories', methods=['GET'])
+def list_user_stories():
+    """
+    Listar historias de usuario (paginado por cursor).
+    ---
+    tags: [Historias de usuario]
+    parameters:
+      - {name: project, in: query, type: string, required: false}
+      - {name: priority, in: query, type: string, required: false, enum: [baja, media, alta, bloqueante]}
+      - {name: limit, in: query, type: integer, required: false, default: 20}
+      - {name: cursor, in: query, type: string, required: false, description: Cursor devuelto en next_cursor}
+    responses:
+      200: {description: 'Página de historias de usuario: {"user_stories": [...], "next_cursor": ...}'}
+      304: {description: La página no ha cambiado (If-None-Match / If-Modified-Since)}
+      400: {description: Cursor no válido}
+    """
+    # La fecha es la de la última modificación de cualquier historia o tarea (también los borrados)
+    last_modified = user_story_manager.get_last_modified()
+    not_modified = _not_modified(last_modified)
+    if not_modified is not None:
+        return not_modified
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    try:
+        rows, next_cursor = user_story_manager.list_user_stories(
+            limit=limit,
+            cursor=request.args.get('cursor') or None,
+            project=request.args.get('project') or None,
+            priority=request.args.get('priority') or None
+        )
+    except ValueError as e:
+        return _error(str(e), 400)
+    stories = UserStorySchemas(user_stories=[UserStorySchema.model_validate(story) for story, _ in rows])
+    payload = stories.model_dump()
+    payload["next_cursor"] = next_cursor
+    return _json(payload, last_modified=last_modified)
+
+
+# Obtener una historia de usuario con sus tareas
+@api.route('/user-stories/<int:user_story_id>', methods=['GET'])
+def get_user_story(user_story_id):
+    """
+    Obtener una historia de usuario con sus tareas.
+    ---
+    tags: [Historias de usuario]
+    parameters:
+      - {name: user_story_id, in: path, type: integer, required: true}
+    responses:
+      200: {description: Historia de usuario con la lista de tareas en "tasks"}
+      304: {description: La historia no ha cambiado (If-None-Match / If-Modified-Since)}
+      404: {description: Historia de usuario no encontrada}
+    """
+    last_modified = user_story_manager.get_last_modified(user_story_id)
+    not_modified = _not_modified(last_modified)
+    if not_modified is not None:
+        return not_modified
+    story = user_story_manager.get_user_story_detail(user_story_id)
+    if story is None:
+        return _error("Historia de usuario no encontrada.", 404)
+    tasks = task_manager.get_task_list(user_story_id)
+    payload = story.model_dump()
+    payload["tasks"] = [task.model_dump() for task in tasks]
+    return _json(payload, last_modified=last_modified)
+
+
+# Crear una historia de usuario
+@api.route('/user-stories', methods=['POST'])
+def create_user_story():
+    """
+    Crear una historia de usuario a partir de sus campos.
+    ---
+    tags: [Historias de usuario]
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required: [project, role, goal, reason]
+          properties:
+            project: {type: string}
+            role: {type: string}
+            goal: {type: string}
+            reason: {type: string}
+            description: {type: string}
+            priority: {type: string, enum: [baja, media, alta, bloqueante]}
+            story_points: {type: integer}
+            effort_hours: {type: number}
+    responses:
+      201: {description: Historia de usuario creada}
+      422: {description: Datos no válidos}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return _error("El cuerpo de la petición debe ser un objeto JSON.", 400)
+    try:
+        schema = UserStorySchema.model_validate({**dict.fromkeys(UserStorySchema.model_fields), **data, **SERVER_FIELDS})
+        _check_enums(UserStory, schema.model_dump())
+    except ValidationError as e:
+        return _validation_error(e)
+    story = user_story_manager.create_user_story(**schema.model_dump(exclude=set(SERVER_FIELDS)))
+    return _json(UserStorySchema.model_validate(story).model_dump(), status=201)
+
+
+# Modificar una historia de usuario
+@api.route('/user-stories/<int:user_story_id>', methods=['PATCH'])
+def update_user_story(user_story_id):
+    """
+    Modificar algunos campos de una historia de usuario. Si cambia su contenido, la siguiente generación de
+    tareas la vuelve a enviar al modelo y guarda solo las diferencias con sus tareas actuales.
+    ---
+    tags: [Historias de usuario]
+    parameters:
+      - {name: user_story_id, in: path, type: integer, required: true}
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            project: {type: string}
+            role: {type: string}
+            goal: {type: string}
+            reason: {type: string}
+            description: {type: string}
+            priority: {type: string, enum: [baja, media, alta, bloqueante]}
+            story_points: {type: integer}
+            effort_hours: {type: number}
+    responses:
+      200: {description: Historia de usuario modificada}
+      404: {description: Historia de usuario no encontrada}
+      422: {description: Datos no válidos}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return _error("El cuerpo de la petición debe ser un objeto JSON.", 400)
+    story = user_story_manager.get_user_story_by_id(user_story_id)
+    if story is None:
+        return _error("Historia de usuario no encontrada.", 404)
+    fields = {key: value for key, value in data.items() if key not in SERVER_FIELDS}
+    try:
+        schema = UserStorySchema.model_validate({**UserStorySchema.model_validate(story).model_dump(), **fields})
+        _check_enums(UserStory, schema.model_dump(include=set(fields)))
+    except ValidationError as e:
+        return _validation_error(e)
+    try:
+        story = user_story_manager.update_user_story(user_story_id, **schema.model_dump(include=set(fields)))
+    except ValueError as e:
+        return _error(str(e), 422)
+    return _json(UserStorySchema.model_validate(story).model_dump())
+
+
+# Eliminar una historia de usuario y sus tareas
+@api.route('/user-stories/<int:user_story_id>', methods=['DELETE'])
+def delete_user_story(user_story_id):
+    """
+    Eliminar una historia de usuario y sus tareas.
+    ---
+    tags: [Historias de usuario]
+    parameters:
+      - {name: user_story_id, in: path, type: integer, required: true}
+    responses:
+      204: {description: Historia de usuario eliminada}
+      404: {description: Historia de usuario no encontrada}
+    """
+    if not user_story_manager.delete_user_story(user_story_id):
+        return _error("Historia de usuario no encontrada.", 404)
+    return Response(status=204)
+
+
+# Eliminar varias historias de usuario o un proyecto completo
+@api.route('/user-stories', methods=['DELETE'])
+def delete_user_stories():
+    """
+    Eliminar varias historias de usuario (o todas las de un proyecto) y sus tareas en una única transacción.
+    ---
+    tags: [Historias de usuario]
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            story_ids: {type: array, items: {type: integer}}
+            project: {type: string}
+    responses:
+      200: {description: IDs de las historias eliminadas}
+      400: {description: Falta story_ids o project}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return _error('El cuerpo de la petición debe ser un objeto JSON con "story_ids" o "project".', 400)
+    story_ids = data.get("story_ids")
+    project = data.get("project")
+    if story_ids is not None and (not isinstance(story_ids, list) or not all(isinstance(i, int) for i in story_ids)):
+        return _error('"story_ids" debe ser una lista de enteros.', 400)
+    if project is not None and not isinstance(project, str):
+        return _error('"project" debe ser una cadena.', 400)
+    try:
+        deleted = user_story_manager.delete_user_stories(user_story_ids=story_ids, project=project)
+    except ValueError as e:
+        return _error(str(e), 400)
+    return _json({"deleted": deleted})
+
+
+# Listar las tareas de una historia de usuario
+@api.route('/user-stories/<int:user_story_id>/tasks', methods=['GET'])
+def list_tasks(user_story_id):
+    """
+    Listar las tareas de una historia de usuario.
+    ---
+    tags: [Tareas]
+    parameters:
+      - {name: user_story_id, in: path, type: integer, required: true}
+    responses:
+      200: {description: 'Tareas de la historia: {"tasks": [...]}'}
+      304: {description: Las tareas no han cambiado (If-None-Match / If-Modified-Since)}
+      404: {description: Historia de usuario no encontrada}
+    """
+    # La fecha de modificación de la historia incluye la de sus tareas
+    last_modified = user_story_manager.get_last_modified(user_story_id)
+    not_modified = _not_modified(last_modified)
+    if not_modified is not None:
+        return not_modified
+    tasks = task_manager.get_task_list(user_story_id)
+    if not tasks and user_story_manager.get_user_story_detail(user_story_id) is None:
+        return _error("Historia de usuario no encontrada.", 404)
+    payload = TaskSchemas(tasks=tasks).model_dump()
+    return _json(payload, last_modified=last_modified)
+
+
+# Crear tareas en una historia de usuario
+@api.route('/user-stories/<int:user_story_id>/tasks', methods=['POST'])
+def create_tasks(user_story_id):
+    """
+    Crear varias tareas en una historia de usuario (todas o ninguna).
+    ---
+    tags: [Tareas]
+    parameters:
+      - {name: user_story_id, in: path, type: integer, required: true}
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            tasks:
+              type: array
+              items:
+                type: object
+                required: [title, description]
+                properties:
+                  title: {type: string}
+                  description: {type: string}
+                  priority: {type: string, enum: [baja, media, alta, bloqueante]}
+                  effort_hours: {type: number}
+                  status: {type: string, enum: [pendiente, en_progreso, en_revision, completada]}
+                  assigned_to: {type: string}
+                  category: {type: string}
+                  risk_analysis: {type: string}
+                  risk_mitigation: {type: string}
+    responses:
+      201: {description: Tareas creadas}
+      404: {description: Historia de usuario no encontrada}
+      422: {description: Datos no válidos}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("tasks"), list):
+        return _error('El cuerpo de la petición debe ser un objeto JSON con una lista "tasks".', 400)
+    if user_story_manager.get_user_story_detail(user_story_id) is None:
+        return _error("Historia de usuario no encontrada.", 404)
+    defaults = dict.fromkeys(TaskSchema.model_fields)
+    try:
+        tasks = TaskSchemas(tasks=[{**defaults, **task, **SERVER_FIELDS} for task in data["tasks"] if isinstance(task, dict)])
+        for i, task in enumerate(tasks.tasks):
+            _check_enums(Task, task.model_dump(), loc=("tasks", i))
+        created = task_manager.create_tasks(tasks, user_story_id=user_story_id)
+    except ValidationError as e:
+        return _validation_error(e)
+    except ValueError as e:
+        return _error(str(e), 422)
+    payload = TaskSchemas(tasks=[TaskSchema.model_validate(task) for task in created]).model_dump()
+    return _json(payload, status=201)
+
+
+# Obtener una tarea
+@api.route('/tasks/<int:task_id>', methods=['GET'])
+def get_task(task_id):
+    """
+    Obtener una tarea.
+    ---
+    tags: [Tareas]
+    parameters:
+      - {name: task_id, in: path, type: integer, required: true}
+    responses:
+      200: {description: Tarea}
+      304: {description: La tarea no ha cambiado (If-None-Match / If-Modified-Since)}
+      404: {description: Tarea no encontrada}
+    """
+    last_modified = task_manager.get_last_modified(task_id)
+    not_modified = _not_modified(last_modified)
+    if not_modified is not None:
+        return not_modified
+    task = task_manager.get_task_by_id(task_id)
+    if task is None:
+        return _error("Tarea no encontrada.", 404)
+    return _json(TaskSchema.model_validate(task).model_dump(), last_modified=last_modified)
+
+
+# Eliminar una tarea
+@api.route('/tasks/<int:task_id>', methods=['DELETE'])
+def delete_task(task_id):
+    """
+    Eliminar una tarea.
+    ---
+    tags: [Tareas]
+    parameters:
+      - {name: task_id, in: path, type: integer, required: true}
+    responses:
+      204: {description: Tarea eliminada}
+      404: {description: Tarea no encontrada}
+    """
+    if not task_manager.delete_task(task_id):
+        return _error("Tarea no encontrada.", 404)
+    return Response(status=204)
+
+
+# Exportar historias de usuario o tareas
+@api.route('/export/<kind>', methods=['GET'])
+def export_data(kind):
+    """
+    Exportar todas las historias de usuario o tareas en NDJSON o CSV (en streaming).
+    ---
+    tags: [Importación y exportación]
+    parameters:
+      - {name: kind, in: path, type: string, required: true, enum: [user-stories, tasks]}
+      - {name: format, in: query, type: string, required: false, enum: [ndjson, csv], default: ndjson}
+      - {name: project, in: query, type: string, required: false}
+      - {name: user_story_id, in: query, type: integer, required: false}
+    responses:
+      200: {description: Registros exportados (una línea por registro)}
+      400: {description: Tipo o formato no soportado}
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if kind not in KINDS or fmt not in FORMATS:
+        return _error(f"Tipo o formato no soportado. Tipos: {', '.join(KINDS)}. Formatos: {', '.join(FORMATS)}.", 400)
+    chunks = transfer_manager.export_records(kind, fmt, project=request.args.get('project') or None,
+                                             user_story_id=request.args.get('user_story_id', type=int))
+    return Response(stream_with_context(chunks), mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+
+# Importar historias de usuario o tareas
+@api.route('/import/<kind>', methods=['POST'])
+def import_data(kind):
+    """
+    Importar historias de usuario o tareas desde un cuerpo NDJSON o CSV (por lotes).
+    ---
+    tags: [Importación y exportación]
+    consumes: [application/x-ndjson, text/csv]
+    parameters:
+      - {name: kind, in: path, type: string, required: true, enum: [user-stories, tasks]}
+      - {name: format, in: query, type: string, required: false, enum: [ndjson, csv], description: Por defecto según Content-Type}
+      - {name: new_ids, in: query, type: boolean, required: false, description: Ignorar los IDs del fichero}
+    responses:
+      200: {description: Resumen de la importación (filas importadas, lotes y errores de validación)}
+      400: {description: Tipo o formato no soportado}
+      409: {description: Un lote no se pudo guardar (los anteriores quedan guardados)}
+    """
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if kind not in KINDS or fmt not in FORMATS:
+        return _error(f"Tipo o formato no soportado. Tipos: {', '.join(KINDS)}. Formatos: {', '.join(FORMATS)}.", 400)
+    # El cuerpo se lee línea a línea sin cargarlo entero en memoria
+    stream = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8', newline='')
+    try:
+        summary = transfer_manager.import_records(kind, stream, fmt,
+                                                  keep_ids=request.args.get('new_ids', '').lower() not in ('1', 'true'))
+    except Exception as e:
+        return _error(f"Error al guardar un lote: {e}", 409)
+    return _json(summary)
+
+
+# Totales de esfuerzo por proyecto
+@api.route('/reports/projects', methods=['GET'])
+def project_summary():
+    """
+    Totales de historias, story points y horas (estimadas, de tareas y pendientes) de cada proyecto.
+    ---
+    tags: [Informes]
+    responses:
+      200: {description: Totales por proyecto}
+    """
+    return _json({"projects": report_manager.project_summary()})
+
+
+# Informe de esfuerzo y capacidad de un proyecto
+@api.route('/reports/projects/<path:project>', methods=['GET'])
+def project_report(project):
+    """
+    Informe de un proyecto: totales, desglose por prioridad de las historias y por estado de las tareas, y horas de tareas frente a la estimación de cada historia.
+    ---
+    tags: [Informes]
+    parameters:
+      - {name: project, in: path, type: string, required: true}
+      - {name: capacity_hours, in: query, type: number, required: false, description: Horas disponibles por sprint}
+    responses:
+      200: {description: Informe del proyecto}
+      400: {description: Capacidad no válida}
+      404: {description: El proyecto no tiene historias de usuario}
+    """
+    capacity_hours = request.args.get('capacity_hours', type=float)
+    if capacity_hours is not None and capacity_hours <= 0:
+        return _error("capacity_hours debe ser un número positivo.", 400)
+    report = report_manager.project_report(project, capacity_hours=capacity_hours)
+    if report is None:
+        return _error("El proyecto no tiene historias de usuario.", 404)
+    return _json(report)
+
+
+# Búsqueda de texto completo
+@api.route('/search', methods=['GET'])
+def search():
+    """
+    Buscar historias de usuario y tareas por texto, ordenadas por relevancia y paginadas.
+    ---
+    tags: [Búsqueda]
+    parameters:
+      - {name: q, in: query, type: string, required: true, description: Texto a buscar}
+      - {name: type, in: query, type: string, enum: [user_story, task], required: false}
+      - {name: page, in: query, type: integer, required: false}
+      - {name: per_page, in: query, type: integer, required: false}
+    responses:
+      200: {description: Resultados con su puntuación y el total de coincidencias}
+      400: {description: Tipo no válido}
+    """
+    try:
+        results = search_index.search(request.args.get('q', ''), kind=request.args.get('type') or None,
+                                      page=request.args.get('page', 1, type=int),
+                                      per_page=request.args.get('per_page', type=int))
+    except ValueError as e:
+        return _error(str(e), 400)
+    return _json(results)
@@ -1,33 +1,58 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, current_app, make_response, session
+from markupsafe import Markup
 from app.services.user_story_manager import UserStoryManager
 from app.services.task_manager import TaskManager
-from app.schemas.UserStorySchema import UserStorySchema
-from app.schemas.TaskSchemas import TaskSchemas
-from openai import AzureOpenAI
-import os
+from app.services.job_manager import JobManager
+from app.services.job_queue import enqueue_user_story, enqueue_tasks
+from app.services.batch_generation import generate_tasks_for_stories
+from app.services import generation
+from app.services.llm_cache import llm_cache
+from app.services.story_index import find_similar_stories, story_index
+from app.services.search_index import search_index, KINDS as SEARCH_KINDS
+from app.services.prompts import prompt_stats
+from app.services.llm_backends import backend_status
+from app.services.cache import cached_fragment, story_card_key
+from app.db import pool_status
+from app.instrumentation import render_metrics
+import json
+import zlib
 
 routes = Blueprint('routes', __name__)
 
 # Managers
 user_story_manager = UserStoryManager()
 task_manager = TaskManager()
+job_manager = JobManager()
 
+# Historias de usuario por página en el listado
+STORIES_PER_PAGE = 20
 
-# Configurar Azure OpenAI
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-    )
-# Nombre del modelo de despliegue
-deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+
+@routes.app_template_global('story_card')
+def story_card(story, task_count):
+    """
+    Tarjeta HTML de una historia de usuario en el listado, servida desde la caché de fragmentos.
+    La clave es el ID de la historia y la versión incluye el número de tareas y el contenido de la historia,
+    de modo que solo se vuelven a renderizar las tarjetas que han cambiado; las escrituras la invalidan con
+    invalidate_story. Se renderiza con el entorno de Jinja para no contar como una plantilla más por petición.
+    :param story: Historia de usuario (UserStorySchema).
+    :param task_count: Número de tareas de la historia.
+    :return: HTML de la tarjeta.
+    :rtype: markupsafe.Markup
+    """
+    version = f"{task_count}:{zlib.crc32(story.model_dump_json().encode())}"
+    template = current_app.jinja_env.get_template('_story_card.html')
+    return Markup(cached_fragment(story_card_key(story.id), version,
+                                  lambda: template.render(s=story, task_count=task_count)))
 
 # Mostrar todas las historias de usuario
 @routes.route('/user-stories', methods=['GET'])
 def user_stories():
     """
-    Mostrar todas las historias de usuario.
-    Esta función recupera todas las historias de usuario almacenadas y las muestra en una plantilla HTML.
+    Mostrar las historias de usuario de forma paginada.
+    Esta función recupera una página de historias de usuario (filtrable por proyecto y prioridad mediante los
+    parámetros 'project' y 'priority') y la muestra en una plantilla HTML. La página siguiente se solicita con el
+    parámetro 'cursor' devuelto en la página actual.
     Se utiliza el UserStoryManager para obtener las historias de usuario y renderizar la plantilla correspondiente.
     Se espera que las historias de usuario se muestren en una tabla o lista, permitiendo al usuario ver detalles como el proyecto, rol, objetivo, razón, descripción, prioridad, puntos de historia y horas de esfuerzo.
     Si no hay historias de usuario, se mostrará un mensaje indicando que no hay historias disponibles.
@@ -35,11 +60,53 @@ def user_stories():
     :return: Renderiza la plantilla 'user-stories.html' con las historias de usuario.
     :rtype: flask.Response
     """
-    stories = user_story_manager.get_all_user_stories() # Obtener todas las historias de usuario
+    filters = {
+        'project': request.args.get('project', '').strip(),
+        'priority': request.args.get('priority', '').strip(),
+    }
+    limit = min(max(request.args.get('limit', STORIES_PER_PAGE, type=int), 1), 100)
+    try:
+        # Obtener una página de historias de usuario con el número de tareas de cada una
+        stories, next_cursor = user_story_manager.list_user_stories(
+            limit=limit,
+            cursor=request.args.get('cursor') or None,
+            project=filters['project'] or None,
+            priority=filters['priority'] or None
+        )
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('routes.user_stories'))
+    # Historias parecidas al prompt enviado (POST /user-stories redirige aquí para ofrecer reutilizarlas).
+    # El prompt se guarda en la sesión: en la URL quedaría en el historial del navegador y en los logs
+    similar_ids = [int(i) for i in request.args.get('similar', '').split(',') if i.strip().isdigit()]
+    similar = {
+        'stories': user_story_manager.get_user_stories_by_ids(similar_ids) if similar_ids else [],
+        'prompt': session.get(SIMILAR_PROMPT_KEY, '') if similar_ids else '',
+    }
     if not stories:
         flash('No hay historias de usuario disponibles.', 'info')
-        return render_template('user-stories.html', stories=[])
-    return render_template('user-stories.html', stories=stories)
+        next_cursor = None
+    # ETag del HTML: si nada ha cambiado el navegador recibe un 304 sin cuerpo
+    response = make_response(render_template('user-stories.html', stories=stories, next_cursor=next_cursor,
+                                             filters=filters, similar=similar))
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Buscar en historias de usuario y tareas
+@routes.route('/search', methods=['GET'])
+def search():
+    """
+    Buscar historias de usuario y tareas por texto, con los resultados ordenados por relevancia y paginados.
+    Parámetros de la URL: "q" (texto), "type" (user_story o task; por defecto ambos) y "page".
+    :return: Página con los resultados de la búsqueda.
+    :rtype: flask.Response
+    """
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('type') if request.args.get('type') in SEARCH_KINDS else None
+    results = search_index.search(query, kind=kind, page=request.args.get('page', 1, type=int))
+    pages = -(-results['total'] // results['per_page'])
+    return render_template('search.html', results=results, kind=kind, pages=pages)
 
 # Crear una nueva historia de usuario
 @routes.route('/user-stories', methods=['POST'])
@@ -48,67 +115,78 @@ def add_user_story():
     Crear una nueva historia de usuario utilizando IA.
     Esta función recibe un prompt del usuario a través de un formulario, lo procesa utilizando el modelo
     de IA de Azure OpenAI y genera una historia de usuario basada en el prompt proporcionado.
-    Si el prompt está vacío, se muestra un mensaje de error. Si la generación es exitosa, se guarda la historia de usuario
+    Si el prompt está vacío, se muestra un mensaje de error. Si ya existe una historia parecida al prompt no se llama al modelo:
+    se redirige al listado ofreciendo reutilizarla (el prompt se guarda en la sesión, no en la URL), salvo que el formulario incluya 'force'. Si la generación es exitosa, se guarda la historia de usuario
     en la base de datos utilizando el UserStoryManager. En caso de error durante la generación o el guardado, se muestra un mensaje de error.
     :return: Redirige a la vista de historias de usuario con un mensaje de éxito o error.
     :rtype: flask.Response  
     """
     # Obtener el prompt del formulario
-    if not deployment_name: 
+    if not generation.is_configured('user_story'):
         flash('El modelo de IA no está configurado correctamente.', 'error')
         return redirect(url_for('routes.user_stories'))
-    if not client:
-        flash('El cliente de IA no está configurado correctamente.', 'error')
-        return redirect(url_for('routes.user_stories'))
     
     prompt = request.form.get('prompt', '').strip()
     if not prompt:
         flash('Por favor, ingresa un prompt para generar tareas.', 'error')
         return redirect(url_for('routes.user_stories'))
+
+    # Ofrecer reutilizar una historia parecida antes de llamar al modelo (salvo que se pida generar igualmente)
+    if not request.form.get('force'):
+        similar = _similar_stories(prompt)
+        if similar:
+            flash(SIMILAR_STORY_MESSAGE, 'info')
+            session[SIMILAR_PROMPT_KEY] = prompt
+            return redirect(url_for('routes.user_stories', similar=','.join(str(s.id) for s, _ in similar)))
+    session.pop(SIMILAR_PROMPT_KEY, None)
     
     # Generar la historia de usuario utilizando IA
     try:
-        # Configurar el modelo de IA y el formato de respuesta
-        completion = client.beta.chat.completions.parse(
-            model=deployment_name,
-            messages=[
-                {"role": "system", "content": 
-                '''
-                Eres un asistente de creación de historias de usuario, cada historia de usuario tendrá la siguiente estructura:
-                    project: Nombre del proyecto,
-                    role: Rol del usuario que solicita la historia (ej. "Como usuario", "Como administrador"),
-                    goal: Objetivo de la historia de usuario (ej. "Quiero poder iniciar sesión"),
-                    reason: Razón del objetivo (ej. "Para acceder a mi cuenta"),
-                    description: Descripción detallada de la historia de usuario,
-                    priority: Prioridad de la historia de usuario (baja, media, alta, bloqueante),
-                    story_points: Puntos de historia asignados a la historia de usuario (estimación del esfuerzo),
-                    effort_hours: Horas de esfuerzo estimadas para completar la historia de usuario
-                '''},
-                {"role": "user", "content": prompt}],
-                response_format=UserStorySchema
-        )
-        user_story = completion.choices[0].message.parsed # Obtener la historia de usuario generada
+        user_story = generation.generate_user_story(prompt) # Obtener la historia de usuario generada
     except Exception as e:
         flash(f'Error al generar la historia de usuario: {str(e)}', 'error')
         return redirect(url_for('routes.user_stories'))
     
     # Guardar la historia de usuario generada   
     try:
-        user_story_manager.create_user_story(
-            project=user_story.project,
-            role=user_story.role,
-            goal=user_story.goal,
-            reason=user_story.reason,
-            description=user_story.description,
-            priority=user_story.priority,
-            story_points=user_story.story_points,
-            effort_hours=user_story.effort_hours
-        )
+        generation.save_user_story(user_story, user_story_manager)
         flash('Historia de usuario creada correctamente.')
     except Exception as e:
         flash(f'Error al crear la historia de usuario: {str(e)}', 'error')
     return redirect(url_for('routes.user_stories'))
 
+SIMILAR_STORY_MESSAGE = 'Ya existe una historia de usuario similar. Puedes reutilizarla o generar una nueva igualmente.'
+SIMILAR_PROMPT_KEY = 'similar_prompt' # Clave de la sesión con el prompt para el que se ofrecen historias parecidas
+
+def _similar_stories(prompt):
+    """
+    Buscar historias de usuario existentes parecidas a un prompt.
+    Las historias del índice que ya no existen en la base de datos (eliminadas por otro proceso) se quitan del índice.
+    :param prompt: Prompt con el que se va a generar la historia.
+    :return: Lista de tuplas (historia, puntuación) de mayor a menor puntuación.
+    :rtype: list
+    """
+    scores = dict(find_similar_stories(prompt))
+    if not scores:
+        return []
+    stories = user_story_manager.get_user_stories_by_ids(list(scores))
+    for story_id in scores.keys() - {s.id for s in stories}:
+        story_index.remove(story_id)
+    return sorted(((s, scores[s.id]) for s in stories), key=lambda item: -item[1])
+
+def _similar_response(similar):
+    """Respuesta JSON 409 con las historias parecidas que se pueden reutilizar."""
+    return jsonify({
+        "error": SIMILAR_STORY_MESSAGE,
+        "similar": [{
+            "id": story.id,
+            "project": story.project,
+            "goal": story.goal,
+            "score": score,
+            "url": url_for('routes.show_tasks', user_story_id=story.id),
+        } for story, score in similar],
+    }), 409
+
 # Mostrar tareas de una historia de usuario
 @routes.route('/user-stories/<int:user_story_id>/tasks', methods=['GET'])
 def show_tasks(user_story_id):
@@ -122,13 +200,13 @@ def show_tasks(user_story_id):
     :return: Renderiza la plantilla 'tasks.html' con la historia de usuario y sus tareas.
     :rtype: flask.Response
     """
-    # Obtener la historia de usuario por ID
-    story = user_story_manager.get_user_story_by_id(user_story_id)
+    # Obtener la historia de usuario por ID (desde la caché de lectura si está disponible)
+    story = user_story_manager.get_user_story_detail(user_story_id)
     if story is None:
         flash('Historia de usuario no encontrada.')
         return redirect(url_for('routes.user_stories'))
     # Obtener las tareas asociadas a la historia de usuario
-    tasks = task_manager.get_tasks_by_user_story(user_story_id)
+    tasks = task_manager.get_task_list(user_story_id)
     if not tasks:
         flash('No hay tareas asociadas a esta historia de usuario.', 'info')
         return render_template('tasks.html', story=story, tasks=[], user_story_id=user_story_id, user_story_title=story.project)
@@ -137,96 +215,158 @@ def show_tasks(user_story_id):
 # Añadir una tarea a una historia de usuario con IA
 @routes.route('/user-stories/<int:user_story_id>/tasks', methods=['POST'])
 def add_task(user_story_id):
+    """
+    Generar con IA las tareas de una historia de usuario de forma incremental.
+    Si la historia no ha cambiado desde la última generación no se llama al modelo (salvo que el formulario
+    incluya 'force'); si ha cambiado, solo se guardan las diferencias con las tareas existentes.
+    :param user_story_id: ID de la historia de usuario.
+    :type user_story_id: int
+    :return: Redirige a la vista de tareas de la historia con un mensaje con el resultado.
+    :rtype: flask.Response
+    """
     user_story = user_story_manager.get_user_story_by_id(user_story_id)
     if user_story is None:
         flash('Historia de usuario no encontrada.', 'error')
         return redirect(url_for('routes.user_stories'))
-    if not deployment_name:
+    if not generation.is_configured('tasks'):
         flash('El modelo de IA no está configurado correctamente.', 'error')
         return redirect(url_for('routes.show_tasks', user_story_id=user_story_id))
-    if not client:
-        flash('El cliente de IA no está configurado correctamente.', 'error')
-        return redirect(url_for('routes.show_tasks', user_story_id=user_story_id))
-    # Generar las tareas utilizando IA
-    # Preparar el prompt para la IA
-    prompt = "Eres un Producto Owner experto en la creación de tareas para historias de usuario. Debes generar tareas tecnicamente precisas y detalladas basadas en la historia de usuario proporcionada:\n\n"
-    prompt += f"Historia de Usuario:\n- Proyecto: {user_story.project}\n"
-    prompt += f"- Rol: {user_story.role}\n" 
-    prompt += f"- Objetivo: {user_story.goal}\n"
-    prompt += f"- Razón: {user_story.reason}\n"
-    prompt += f"- Descripción: {user_story.description}\n"
-    prompt += f"- Prioridad: {user_story.priority}\n"   
-    prompt += f"- Puntos de Historia: {user_story.story_points}\n"
-    prompt += f"- Horas de Esfuerzo: {user_story.effort_hours}\n\n"
-    prompt += "Por favor, genera una lista de tareas detalladas que deben realizarse para completar esta historia de usuario. Cada tarea debe incluir:\n"
-    prompt += "- Título de la tarea\n"
-    prompt += "- Descripción detallada de la tarea\n"   
-    prompt += "- Prioridad (baja, media, alta, bloqueante)\n"
-    prompt += "- Horas de esfuerzo estimadas\n"
-    prompt += "- Estado (pendiente, en progreso, en revisión, completada)\n"
-    prompt += "- Usuario asignado (nombre o ID del usuario)\n"
-    prompt += "- Categoría de la tarea (ej. 'Desarrollo', 'Pruebas', 'Documentación')\n"
-    prompt += "- Análisis de riesgos asociado a la tarea\n"
-    prompt += "- Plan de mitigación de riesgos asociado a la tarea\n"
-    prompt += "Formato de respuesta:\n"
-    prompt += "```json\n"
-    prompt += "{\n"
-    prompt += "  \"tasks\": [\n"
-    prompt += "    {\n"
-    prompt += "      \"title\": \"Título de la tarea\",\n"
-    prompt += "      \"description\": \"Descripción detallada de la tarea\",\n"
-    prompt += "      \"priority\": \"baja/ media/ alta/ bloqueante\",\n"
-    prompt += "      \"effort_hours\": 0.0,\n"
-    prompt += "      \"status\": \"pendiente/ en progreso/ en revisión/ completada\",\n"
-    prompt += "      \"assigned_to\": \"Nombre o ID del usuario\",\n"
-    prompt += "      \"category\": \"Categoría de la tarea\",\n"
-    prompt += "      \"risk_analysis\": \"Análisis de riesgos asociado a la tarea\",\n"     
-    prompt += "      \"risk_mitigation\": \"Plan de mitigación de riesgos asociado a la tarea\"\n"
-    prompt += "    }\n"
-    prompt += "  ]\n"
-    prompt += "}\n"
-    prompt += "```"
-    # Llamar al modelo de IA para generar las tareas
+    # Generar las tareas utilizando IA y guardarlas en la base de datos
     try:
-        completion = client.beta.chat.completions.parse(
-            model=deployment_name,
-            messages=[
-                {"role": "system", "content": 
-                '''
-                Eres un Product Owner experto en la creación de tareas para historias de usuario.
-                '''},
-                {"role": "user", "content": prompt}],
-            response_format=TaskSchemas
-        )
-        tasks_data = completion.choices[0].message.parsed
-
-        tasks = TaskSchemas(**tasks_data.model_dump()) # Obtener las tareas generadas
-
-
-        # Guardar las tareas generadas en la base de datos
-        for task in tasks.tasks:
-            # Verificar que la tarea tenga un título y una descripción
-            if not task.title or not task.description:
-                flash('Todas las tareas deben tener un título y una descripción.', 'error')
-                return redirect(url_for('routes.show_tasks', user_story_id=user_story_id))
-            task_manager.create_task(
-                title=task.title,
-                description=task.description,
-                priority=task.priority,
-                effort_hours=task.effort_hours,
-                status=task.status,
-                assigned_to=task.assigned_to,
-                category=task.category,
-                risk_analysis=task.risk_analysis,
-                risk_mitigation=task.risk_mitigation,
-                user_story_id=user_story_id
-            )
-        flash('Tareas generadas y guardadas correctamente.', 'info')
+        result = generation.plan_tasks(user_story, task_manager, force=bool(request.form.get('force')))
+        flash(_plan_message(result), 'info')
+    except ValueError as e:
+        flash(str(e), 'error')
     except Exception as e:
         flash(f'Error al generar las tareas: {str(e)}', 'error') 
     return redirect(url_for('routes.show_tasks', user_story_id=user_story_id))
 
 
+def _plan_message(result):
+    """Mensaje para el usuario con el resultado de una generación incremental de tareas."""
+    if result["status"] == "unchanged":
+        return 'La historia no ha cambiado desde la última generación: las tareas ya están al día.'
+    return (f'Tareas generadas y guardadas correctamente: {len(result["created"])} nuevas, '
+            f'{len(result["updated"])} actualizadas y {len(result["deleted"])} eliminadas.')
+
+
+def _sse(event, data):
+    """Formatea un evento Server-Sent Events con datos JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _sse_response(events):
+    """Respuesta en streaming text/event-stream que se envía al navegador a medida que se genera."""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Crear una historia de usuario con IA enviando la respuesta en streaming
+@routes.route('/user-stories/stream', methods=['POST'])
+def stream_user_story():
+    """
+    Crear una historia de usuario con IA enviando al navegador los tokens a medida que se generan (SSE).
+    Emite eventos 'delta' con cada fragmento de texto, un evento 'story' con la historia guardada cuando
+    el stream termina, o un evento 'error' si la generación o el guardado fallan.
+    Si ya existe una historia parecida al prompt responde 409 con las historias similares, salvo que se envíe 'force'.
+    :return: Respuesta text/event-stream.
+    :rtype: flask.Response
+    """
+    if not generation.is_configured('user_story'):
+        return jsonify({"error": "El modelo de IA no está configurado correctamente."}), 503
+    data = request.get_json(silent=True) or request.form
+    prompt = (data.get('prompt') or '').strip()
+    if not prompt:
+        return jsonify({"error": "Por favor, ingresa un prompt para generar la historia de usuario."}), 400
+    if not data.get('force'):
+        similar = _similar_stories(prompt)
+        if similar:
+            return _similar_response(similar)
+
+    def events():
+        try:
+            for kind, value in generation.stream_user_story(prompt):
+                if kind == 'delta':
+                    yield _sse('delta', {"text": value})
+                else:
+                    story = generation.save_user_story(value, user_story_manager)
+                    yield _sse('story', {"id": story.id, "project": story.project, "goal": story.goal})
+        except Exception as e:
+            yield _sse('error', {"error": f'Error al generar la historia de usuario: {str(e)}'})
+    return _sse_response(events())
+
+# Generar tareas con IA enviando cada tarea en cuanto está completa
+@routes.route('/user-stories/<int:user_story_id>/tasks/stream', methods=['POST'])
+def stream_tasks(user_story_id):
+    """
+    Generar con IA las tareas de una historia de usuario enviándolas al navegador a medida que se completan (SSE).
+    Emite un evento 'task' por cada tarea terminada y, cuando el stream se cierra, guarda las diferencias con las
+    tareas existentes y emite un evento 'done' con los IDs creados, actualizados y eliminados, o un evento 'error'
+    si algo falla. Si la historia no ha cambiado desde la última generación (y no se envía 'force') solo se emite
+    'done' con status 'unchanged', sin llamar al modelo.
+    :param user_story_id: ID de la historia de usuario.
+    :type user_story_id: int
+    :return: Respuesta text/event-stream.
+    :rtype: flask.Response
+    """
+    if not generation.is_configured('tasks'):
+        return jsonify({"error": "El modelo de IA no está configurado correctamente."}), 503
+    user_story = user_story_manager.get_user_story_by_id(user_story_id)
+    if user_story is None:
+        return jsonify({"error": "Historia de usuario no encontrada."}), 404
+
+    fingerprint = generation.tasks_fingerprint(user_story)
+    data = request.get_json(silent=True) or request.form
+    force = bool(data.get('force'))
+    if fingerprint is None and not force:
+        return _sse_response(iter([_sse('done', {"status": "unchanged", "task_ids": []})]))
+    fingerprint = fingerprint or generation.story_fingerprint(user_story)
+
+    def events():
+        try:
+            for kind, value in generation.stream_tasks(user_story, use_cache=not force):
+                if kind == 'task':
+                    yield _sse('task', value)
+                else:
+                    result = generation.save_tasks(user_story_id, value, task_manager, fingerprint=fingerprint)
+                    yield _sse('done', {"status": "synced", "task_ids": result["created"] + result["updated"], **result})
+        except Exception as e:
+            yield _sse('error', {"error": f'Error al generar las tareas: {str(e)}'})
+    return _sse_response(events())
+
+
+# Generar tareas con IA para varias historias de usuario a la vez
+@routes.route('/user-stories/tasks/batch', methods=['POST'])
+def add_tasks_batch():
+    """
+    Generar en paralelo las tareas de varias historias de usuario.
+    Recibe un JSON con "story_ids" (lista de IDs) o "project" (nombre del proyecto), y opcionalmente
+    "concurrency" (llamadas simultáneas al modelo), "timeout" (segundos por llamada) y "force" (regenerar
+    también las historias que no han cambiado desde la última generación).
+    Las llamadas al modelo se ejecutan de forma concurrente y cada historia obtiene su propio resultado.
+    :return: JSON con el resultado de cada historia de usuario.
+    :rtype: flask.Response
+    """
+    if not generation.is_configured('tasks'):
+        return jsonify({"error": "El modelo de IA no está configurado correctamente."}), 503
+    data = request.get_json(silent=True) or {}
+    story_ids = data.get('story_ids') or []
+    project = data.get('project')
+    if not story_ids and not project:
+        return jsonify({"error": "Indica una lista de historias (story_ids) o un proyecto (project)."}), 400
+    try:
+        story_ids = [int(story_id) for story_id in story_ids]
+        concurrency = int(data['concurrency']) if data.get('concurrency') else None
+        timeout = float(data['timeout']) if data.get('timeout') else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "Parámetros de la petición no válidos."}), 400
+    results = generate_tasks_for_stories(story_ids=story_ids, project=project, concurrency=concurrency,
+                                         timeout=timeout, force=bool(data.get('force')),
+                                         user_story_manager=user_story_manager, task_manager=task_manager)
+    return jsonify({"results": results})
+
+
 # Eliminar una historia de usuario y sus tareas asociadas
 @routes.route('/user-stories/<int:user_story_id>/delete', methods=['POST']) 
 def delete_user_story(user_story_id):
@@ -240,15 +380,11 @@ def delete_user_story(user_story_id):
     :return: Redirige a la vista de historias de usuario con un mensaje de éxito o error.
     :rtype: flask.Response
     """
-    # Obtener la historia de usuario por ID
-    user_story = user_story_manager.get_user_story_by_id(user_story_id)
-    if user_story is None:
-        flash('Historia de usuario no encontrada.', 'error')
-        return redirect(url_for('routes.user_stories'))
-    
+    # La historia y sus tareas se eliminan en una única transacción
     try:
-        task_manager.delete_tasks_by_user_story(user_story_id)
-        user_story_manager.delete_user_story(user_story_id)
+        if not user_story_manager.delete_user_story(user_story_id):
+            flash('Historia de usuario no encontrada.', 'error')
+            return redirect(url_for('routes.user_stories'))
         flash('Historia de usuario y tareas asociadas eliminadas correctamente.', 'success')
     except Exception as e:
         flash(f'Error al eliminar la historia de usuario: {str(e)}', 'error')
@@ -256,4 +392,133 @@ def delete_user_story(user_story_id):
     return redirect(url_for('routes.user_stories'))
 
 
+# Métricas del pool de conexiones
+@routes.route('/db/pool', methods=['GET'])
+def db_pool():
+    """
+    Mostrar el estado del pool de conexiones de la base de datos.
+    Incluye el tamaño del pool, las conexiones en uso, el overflow y las métricas acumuladas de checkout y
+    tiempo de espera, útiles para dimensionar el pool de MySQL frente al número de workers de gunicorn.
+    :return: JSON con el estado y las métricas del pool.
+    :rtype: flask.Response
+    """
+    return jsonify(pool_status())
+
+
+# Métricas de rendimiento en formato Prometheus
+@routes.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exponer las métricas de rendimiento del proceso en formato de texto de Prometheus.
+    Incluye peticiones y latencias por endpoint, consultas y tiempo de base de datos, llamadas, latencia y
+    tokens del modelo de IA, tiempo de renderizado, peticiones lentas, posibles N+1 y el estado del pool.
+    :return: Texto plano con las métricas.
+    :rtype: flask.Response
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# Estadísticas de la caché de respuestas del modelo
+@routes.route('/llm/cache', methods=['GET'])
+def llm_cache_stats():
+    """
+    Mostrar las estadísticas de la caché de respuestas del modelo de IA.
+    :return: JSON con el número de entradas, aciertos, fallos, expulsiones y ratio de aciertos.
+    :rtype: flask.Response
+    """
+    return jsonify(llm_cache.stats())
 
+# Estadísticas de tokens de las plantillas de prompt
+@routes.route('/llm/prompts', methods=['GET'])
+def llm_prompt_stats():
+    """
+    Mostrar las estadísticas de tokens de cada plantilla de prompt.
+    :return: JSON con, por plantilla, los prompts construidos, los recortados, los tokens estimados en local
+        (media, máximo y parte fija) y los tokens de entrada y salida facturados por el proveedor.
+    :rtype: flask.Response
+    """
+    return jsonify(prompt_stats())
+
+# Backends de generación configurados
+@routes.route('/llm/backends', methods=['GET'])
+def llm_backends():
+    """
+    Mostrar los backends de generación de cada plantilla (en orden de preferencia) y el estado de cada backend.
+    :return: JSON con las rutas por plantilla y, por backend, el modelo, si está configurado y el estado de su circuito.
+    :rtype: flask.Response
+    """
+    return jsonify(backend_status())
+
+
+def _job_to_dict(job):
+    """Representación JSON del estado de un trabajo de generación."""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "user_story_id": job.user_story_id,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "status_url": url_for('routes.job_status', job_id=job.id),
+    }
+
+# Encolar la generación de una historia de usuario
+@routes.route('/jobs/user-stories', methods=['POST'])
+def enqueue_user_story_job():
+    """
+    Encolar la generación de una historia de usuario con IA.
+    A diferencia de POST /user-stories, la petición no espera a la respuesta del modelo: se crea un trabajo
+    en segundo plano y se devuelve su ID inmediatamente. El resultado se consulta en GET /jobs/<job_id>.
+    Si ya existe una historia parecida al prompt se devuelve 409 con las historias similares, salvo que se envíe 'force'.
+    :return: JSON con el trabajo creado y código 202, 400 si el prompt está vacío o 409 si hay historias similares.
+    :rtype: flask.Response
+    """
+    if not generation.is_configured('user_story'):
+        return jsonify({"error": "El modelo de IA no está configurado correctamente."}), 503
+    data = request.get_json(silent=True) or request.form
+    prompt = (data.get('prompt') or '').strip()
+    if not prompt:
+        return jsonify({"error": "Por favor, ingresa un prompt para generar la historia de usuario."}), 400
+    if not data.get('force'):
+        similar = _similar_stories(prompt)
+        if similar:
+            return _similar_response(similar)
+    job = enqueue_user_story(prompt)
+    return jsonify(_job_to_dict(job)), 202
+
+# Encolar la generación de tareas de una historia de usuario
+@routes.route('/jobs/user-stories/<int:user_story_id>/tasks', methods=['POST'])
+def enqueue_tasks_job(user_story_id):
+    """
+    Encolar la generación de tareas con IA para una historia de usuario.
+    Con "force" en el cuerpo se regeneran aunque la historia no haya cambiado desde la última generación.
+    :param user_story_id: ID de la historia de usuario para la que se generan las tareas.
+    :type user_story_id: int
+    :return: JSON con el trabajo creado y código 202, o 404 si la historia no existe.
+    :rtype: flask.Response
+    """
+    if not generation.is_configured('tasks'):
+        return jsonify({"error": "El modelo de IA no está configurado correctamente."}), 503
+    if user_story_manager.get_user_story_by_id(user_story_id) is None:
+        return jsonify({"error": "Historia de usuario no encontrada."}), 404
+    data = request.get_json(silent=True) or request.form
+    job = enqueue_tasks(user_story_id, force=bool(data.get('force')))
+    return jsonify(_job_to_dict(job)), 202
+
+# Consultar el estado de un trabajo de generación
+@routes.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Consultar el estado de un trabajo de generación (pendiente, en_progreso, completado o fallido).
+    :param job_id: ID del trabajo devuelto al encolarlo.
+    :type job_id: str
+    :return: JSON con el estado y el resultado del trabajo, o 404 si no existe.
+    :rtype: flask.Response
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado."}), 404
+    return jsonify(_job_to_dict(job))
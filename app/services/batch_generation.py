@@ -0,0 +1,91 @@
+# app/services/batch_generation.py
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.schemas.UserStorySchema import UserStorySchema
+from app.services.user_story_manager import UserStoryManager
+from app.services.task_manager import TaskManager
+from app.services import generation
+from app.db import primary_reads
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Número máximo de llamadas simultáneas al modelo en una generación por lotes
+BATCH_GENERATION_CONCURRENCY = int(os.getenv("BATCH_GENERATION_CONCURRENCY", "8"))
+# Tiempo máximo en segundos de cada llamada al modelo
+BATCH_GENERATION_TIMEOUT = float(os.getenv("BATCH_GENERATION_TIMEOUT", "60"))
+
+
+def _generate(user_story, timeout, use_cache=True):
+    # Solo la llamada al modelo se ejecuta en los hilos; la escritura en base de datos queda en el hilo llamante
+    start = time.perf_counter()
+    tasks = generation.generate_tasks(user_story, timeout=timeout, use_cache=use_cache)
+    return tasks, time.perf_counter() - start
+
+
+def generate_tasks_for_stories(story_ids=None, project=None, concurrency=None, timeout=None, force=False,
+                               user_story_manager=None, task_manager=None):
+    """
+    Genera en paralelo las tareas de varias historias de usuario.
+    Las llamadas al modelo se reparten en un pool de hilos con un límite de concurrencia, de modo que el
+    tiempo total se aproxima al de la llamada más lenta en lugar de a la suma de todas. Las tareas de cada
+    historia se guardan en cuanto llega su respuesta; el fallo de una historia no afecta al resto.
+    Las historias que no han cambiado desde su última generación no se envían al modelo (status 'unchanged')
+    y, de las que sí, solo se guardan las diferencias con sus tareas actuales.
+    :param story_ids: IDs de las historias de usuario.
+    :param project: Nombre del proyecto cuyas historias se procesan (alternativa a story_ids).
+    :param concurrency: Número máximo de llamadas simultáneas al modelo.
+    :param timeout: Tiempo máximo en segundos de cada llamada al modelo.
+    :param force: Regenerar también las historias que no han cambiado, sin usar la caché de respuestas del modelo.
+    :return: Lista de resultados por historia (user_story_id, status, task_ids, error, elapsed_seconds).
+    """
+    user_story_manager = user_story_manager or UserStoryManager()
+    task_manager = task_manager or TaskManager()
+    concurrency = concurrency or BATCH_GENERATION_CONCURRENCY
+    timeout = timeout or BATCH_GENERATION_TIMEOUT
+
+    # Las historias se leen del primario: sus tareas se van a guardar con la huella de su contenido actual
+    with primary_reads():
+        if story_ids:
+            stories = user_story_manager.get_user_stories_by_ids(story_ids)
+        elif project:
+            stories = user_story_manager.get_user_stories_by_project(project)
+        else:
+            stories = []
+
+    results = {}
+    found = {story.id for story in stories}
+    for story_id in story_ids or []:
+        if story_id not in found:
+            results[story_id] = {"user_story_id": story_id, "status": "error", "task_ids": [],
+                                 "error": "Historia de usuario no encontrada.", "elapsed_seconds": 0.0}
+
+    fingerprints = {}
+    for story in stories:
+        fingerprint = generation.tasks_fingerprint(story)
+        if fingerprint is None and not force:
+            results[story.id] = {"user_story_id": story.id, "status": "unchanged", "task_ids": [], "error": None,
+                                 "elapsed_seconds": 0.0}
+        else:
+            fingerprints[story.id] = fingerprint or generation.story_fingerprint(story)
+
+    # Copias desacopladas de la sesión para poder usarlas desde otros hilos
+    snapshots = [UserStorySchema.model_validate(story) for story in stories if story.id in fingerprints]
+    if snapshots:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(snapshots)), thread_name_prefix="batch-generation") as executor:
+            futures = {executor.submit(_generate, story, timeout, not force): story.id for story in snapshots}
+            for future in as_completed(futures):
+                story_id = futures[future]
+                result = {"user_story_id": story_id, "status": "ok", "task_ids": [], "error": None, "elapsed_seconds": 0.0}
+                try:
+                    tasks, result["elapsed_seconds"] = future.result()
+                    synced = generation.save_tasks(story_id, tasks, task_manager, fingerprint=fingerprints[story_id])
+                    result["task_ids"] = synced["created"] + synced["updated"]
+                except Exception as e:
+                    logger.warning("Error al generar las tareas de la historia %s: %s", story_id, e)
+                    result["status"] = "error"
+                    result["error"] = str(e)
+                results[story_id] = result
+
+    return [results[story_id] for story_id in sorted(results)]
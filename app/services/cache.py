@@ -0,0 +1,206 @@
+# app/services/cache.py
+from collections import OrderedDict
+from app.db import track_replica_reads
+import pickle
+import threading
+import time
+import os
+
+# Configuración de la caché de lectura
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory") # memory, redis o none
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300")) # Segundos de validez de cada entrada en la caché compartida (redis)
+CACHE_MEMORY_TTL = int(os.getenv("CACHE_MEMORY_TTL", "5")) # Segundos de validez en la caché en memoria: cada proceso no ve las invalidaciones de los demás
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000")) # Máximo de entradas en memoria (LRU)
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "proyecto_ia:")
+CACHE_REPLICA_TTL = int(os.getenv("CACHE_REPLICA_TTL", "5")) # Segundos de validez de lo leído de una réplica (puede llevar retraso)
+
+
+class TTLCache:
+    """
+    Caché en memoria del proceso con caducidad por entrada y expulsión LRU.
+    Las invalidaciones solo llegan al proceso que hace la escritura: con varios workers de gunicorn los demás
+    sirven datos antiguos hasta que caduca la entrada, por eso ttl es también el máximo de cualquier entrada.
+    """
+    def __init__(self, ttl=CACHE_MEMORY_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._versions = {} # Contadores de versión: no caducan ni se expulsan
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + min(ttl or self.ttl, self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def version(self, key):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return self._versions[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    """
+    Caché compartida entre procesos sobre un cliente compatible con Redis (get, set, delete, incr).
+    Los valores se serializan con pickle; los contadores de versión se guardan como enteros de Redis.
+    """
+    def __init__(self, client, ttl=CACHE_TTL, prefix=CACHE_PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def version(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class NullCache:
+    """Caché desactivada: todas las lecturas van a la base de datos."""
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def version(self, key):
+        return 0
+
+    def incr(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+def create_cache(backend=CACHE_BACKEND):
+    """Crea el backend de caché configurado."""
+    if backend == "redis":
+        import redis # Dependencia opcional, solo necesaria con CACHE_BACKEND=redis
+        return RedisCache(redis.Redis.from_url(CACHE_REDIS_URL))
+    if backend == "none":
+        return NullCache()
+    return TTLCache()
+
+
+cache = create_cache()
+
+
+def set_cache(backend):
+    """Sustituye el backend de caché (p. ej. en tests)."""
+    global cache
+    cache = backend
+
+
+def cached(key, loader, ttl=None):
+    """
+    Lectura a través de la caché: devuelve el valor guardado o lo carga con loader() y lo guarda.
+    Si loader() ha leído de una réplica el valor se guarda como mucho CACHE_REPLICA_TTL segundos, para que
+    el retraso de replicación no quede en la caché hasta la siguiente invalidación.
+    """
+    value = cache.get(key)
+    if value is None:
+        with track_replica_reads() as replica_reads:
+            value = loader()
+        if value is not None:
+            cache.set(key, value, min(ttl or CACHE_TTL, CACHE_REPLICA_TTL) if replica_reads else ttl)
+    return value
+
+
+def cached_fragment(key, version, render, ttl=None):
+    """
+    Fragmento HTML a través de la caché, guardado junto con la versión de los datos con los que se renderizó.
+    Si la versión guardada no coincide (p. ej. otro proceso ya ve datos más recientes) se vuelve a renderizar.
+    :param key: Clave del fragmento.
+    :param version: Valor que cambia cuando cambian los datos mostrados en el fragmento.
+    :param render: Función que devuelve el HTML del fragmento.
+    :return: HTML del fragmento.
+    :rtype: str
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    html = str(render())
+    cache.set(key, (version, html), ttl)
+    return html
+
+
+# Claves de la caché de lectura
+def story_key(user_story_id):
+    return f"story:{user_story_id}"
+
+def story_tasks_key(user_story_id):
+    return f"story:{user_story_id}:tasks"
+
+def story_card_key(user_story_id):
+    # Fragmento HTML de la tarjeta de la historia en el listado
+    return f"story:{user_story_id}:card"
+
+INDEX_VERSION_KEY = "stories:index:version"
+
+def index_key(*parts):
+    # El índice de historias depende de muchos parámetros: se invalida entero cambiando su versión
+    version = cache.version(INDEX_VERSION_KEY)
+    return "stories:index:{}:{}".format(version, ":".join(str(part) for part in parts))
+
+
+def invalidate_story(user_story_id=None):
+    """Invalida la ficha, las tareas y la tarjeta de una historia de usuario y el índice de historias."""
+    if user_story_id is not None:
+        cache.delete(story_key(user_story_id), story_tasks_key(user_story_id), story_card_key(user_story_id))
+    cache.incr(INDEX_VERSION_KEY)
+
+def invalidate_stories(user_story_ids):
+    """Invalida varias historias de usuario con un único borrado y un único cambio de versión del índice."""
+    keys = [key for story_id in user_story_ids
+            for key in (story_key(story_id), story_tasks_key(story_id), story_card_key(story_id))]
+    if keys:
+        cache.delete(*keys)
+    cache.incr(INDEX_VERSION_KEY)
@@ -0,0 +1,250 @@
+# app/services/generation.py
+from app.schemas.UserStorySchema import UserStorySchema
+from app.schemas.TaskSchemas import TaskSchemas
+from app.services.llm_cache import llm_cache
+from app.services.llm_client import get_client, LLMUnavailableError
+from app.services.llm_backends import backends_for, LLM_FALLBACK_TIMEOUT
+from app.services.prompts import TEMPLATES, USER_STORY_PROMPT, TASK_PROMPT
+from app.services.user_story_manager import story_fingerprint
+from app.instrumentation import track_llm_call, llm_fallbacks
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def __getattr__(name):
+    # generation.client: el cliente de Azure OpenAI se crea en el primer uso (ver llm_client)
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def is_configured(template=None):
+    """
+    Indica si hay algún backend de generación configurado para una plantilla de prompt
+    ('user_story' o 'tasks'; sin plantilla, para todas).
+    """
+    templates = [template] if template else [USER_STORY_PROMPT.name, TASK_PROMPT.name]
+    return all(backends_for(name) for name in templates)
+
+
+def _backends(prompt):
+    backends = backends_for(prompt.template)
+    if not backends:
+        raise LLMUnavailableError("El modelo de IA no está configurado correctamente.")
+    return backends
+
+
+def _backend_timeout(timeout, has_fallback):
+    # Un backend con alternativa tiene como máximo LLM_FALLBACK_TIMEOUT segundos; el último, el plazo completo
+    if has_fallback and LLM_FALLBACK_TIMEOUT:
+        return min(timeout, LLM_FALLBACK_TIMEOUT) if timeout else LLM_FALLBACK_TIMEOUT
+    return timeout
+
+
+def _fallback(prompt, backend, next_backend, error):
+    llm_fallbacks.inc(template=prompt.template, backend=backend.name)
+    logger.warning("El backend de IA %s falló con la plantilla %s (%s); se usa %s",
+                   backend.name, prompt.template, error, next_backend.name)
+
+
+def build_task_prompt(user_story):
+    """
+    Construye el prompt para generar las tareas de una historia de usuario con la plantilla precompilada.
+    Si la descripción es demasiado larga para PROMPT_TOKEN_BUDGET se recorta.
+    :return: Prompt renderizado (RenderedPrompt).
+    """
+    return TASK_PROMPT.render(
+        project=user_story.project,
+        role=user_story.role,
+        goal=user_story.goal,
+        reason=user_story.reason,
+        description=user_story.description,
+        priority=user_story.priority,
+        story_points=user_story.story_points,
+        effort_hours=user_story.effort_hours,
+    )
+
+
+def parse_completion(prompt, response_format, timeout=None, use_cache=True):
+    """
+    Genera con salida estructurada y devuelve la respuesta ya validada.
+    Se prueban en orden los backends configurados para la plantilla (LLM_BACKENDS_*): si uno falla o supera
+    su plazo se pasa al siguiente. Si la misma combinación de modelo, mensajes y esquema ya se resolvió, se
+    devuelve la respuesta guardada en la caché sin llamar al modelo.
+    :param prompt: Prompt renderizado con una plantilla (RenderedPrompt).
+    :param timeout: Tiempo máximo en segundos de la llamada al modelo, reintentos incluidos (None = LLM_DEADLINE).
+    :param use_cache: Si es False se ignora la caché y siempre se consulta al modelo.
+    """
+    backends = _backends(prompt)
+    for i, backend in enumerate(backends):
+        key = llm_cache.make_key(backend.cache_namespace, prompt.system, prompt.user, response_format) \
+            if backend.cacheable else None
+        if key and use_cache:
+            cached = llm_cache.get(key, response_format)
+            if cached is not None:
+                return cached
+        has_fallback = i < len(backends) - 1
+        try:
+            with track_llm_call("parse") as call:
+                # Plazo total, reintentos, cuota y circuit breaker: ver llm_client.ResilientLLM
+                parsed, usage = backend.parse(prompt, response_format, timeout=_backend_timeout(timeout, has_fallback))
+                call.record_usage(usage)
+        except Exception as e:
+            if not has_fallback:
+                raise
+            _fallback(prompt, backend, backends[i + 1], e)
+            continue
+        TEMPLATES[prompt.template].record_usage(call.prompt_tokens, call.completion_tokens)
+        if key:
+            llm_cache.set(key, parsed)
+        return parsed
+
+
+def generate_user_story(prompt, use_cache=True):
+    """
+    Genera una historia de usuario a partir de un prompt con los backends de LLM_BACKENDS_USER_STORY.
+    :param prompt: Texto del usuario describiendo la historia.
+    :return: Historia de usuario generada (UserStorySchema).
+    """
+    return parse_completion(USER_STORY_PROMPT.render(prompt=prompt), UserStorySchema, use_cache=use_cache)
+
+
+def generate_tasks(user_story, timeout=None, use_cache=True):
+    """
+    Genera las tareas de una historia de usuario con los backends de LLM_BACKENDS_TASKS.
+    :param user_story: Historia de usuario (modelo o esquema) para la que se generan las tareas.
+    :param timeout: Tiempo máximo en segundos de la llamada al modelo, reintentos incluidos (None = LLM_DEADLINE).
+    :return: Tareas generadas (TaskSchemas).
+    """
+    tasks_data = parse_completion(build_task_prompt(user_story), TaskSchemas, timeout=timeout, use_cache=use_cache)
+    return TaskSchemas(**tasks_data.model_dump())
+
+
+def stream_completion(prompt, response_format, use_cache=True):
+    """
+    Genera en modo streaming con salida estructurada.
+    Genera tuplas ("delta", texto, json_parcial) a medida que llegan los tokens y, al cerrarse el stream,
+    una tupla final ("done", respuesta_validada, None). Si la respuesta ya está en la caché se devuelve
+    directamente la tupla final sin llamar al modelo. Un backend que falla antes de enviar el primer
+    fragmento se sustituye por el siguiente; una vez empezado el stream ya no se cambia de backend.
+    :param use_cache: Si es False se ignora la caché y siempre se consulta al modelo.
+    """
+    backends = _backends(prompt)
+    for i, backend in enumerate(backends):
+        key = llm_cache.make_key(backend.cache_namespace, prompt.system, prompt.user, response_format) \
+            if backend.cacheable else None
+        if key and use_cache:
+            cached = llm_cache.get(key, response_format)
+            if cached is not None:
+                yield "done", cached, None
+                return
+        has_fallback = i < len(backends) - 1
+        started = False
+        parsed = None
+        try:
+            with track_llm_call("stream") as call:
+                for kind, value, extra in backend.stream(prompt, response_format,
+                                                         timeout=_backend_timeout(None, has_fallback)):
+                    if kind == "delta":
+                        started = True
+                        yield kind, value, extra
+                    else:
+                        parsed = value
+                        call.record_usage(extra)
+                # Un stream que se cierra sin respuesta final cuenta como un fallo del backend
+                if parsed is None:
+                    raise LLMUnavailableError(f"El backend de IA {backend.name} cerró el stream sin respuesta.")
+        except Exception as e:
+            if started or not has_fallback:
+                raise
+            _fallback(prompt, backend, backends[i + 1], e)
+            continue
+        TEMPLATES[prompt.template].record_usage(call.prompt_tokens, call.completion_tokens)
+        if key:
+            llm_cache.set(key, parsed)
+        yield "done", parsed, None
+        return
+
+
+def stream_user_story(prompt):
+    """
+    Genera una historia de usuario en modo streaming.
+    Produce ("delta", texto) por cada fragmento recibido y ("done", UserStorySchema) al terminar.
+    """
+    for kind, value, _ in stream_completion(USER_STORY_PROMPT.render(prompt=prompt), UserStorySchema):
+        yield kind, value
+
+
+def stream_tasks(user_story, use_cache=True):
+    """
+    Genera las tareas de una historia de usuario en modo streaming.
+    Produce ("task", dict) en cuanto cada tarea está completa (cuando el modelo empieza la siguiente) y
+    ("done", TaskSchemas) con la respuesta final validada.
+    :param use_cache: Si es False se ignora la caché y siempre se consulta al modelo.
+    """
+    emitted = 0
+    for kind, value, partial in stream_completion(build_task_prompt(user_story), TaskSchemas, use_cache=use_cache):
+        if kind == "delta":
+            tasks = (partial or {}).get("tasks") or []
+            # Todas las tareas salvo la última del JSON parcial ya están cerradas
+            while emitted < len(tasks) - 1:
+                yield "task", tasks[emitted]
+                emitted += 1
+        else:
+            tasks = TaskSchemas(**value.model_dump())
+            for task in tasks.tasks[emitted:]:
+                yield "task", task.model_dump(mode="json")
+            yield "done", tasks
+
+
+def save_user_story(user_story, user_story_manager):
+    """Guarda en base de datos una historia de usuario generada."""
+    return user_story_manager.create_user_story(
+        project=user_story.project,
+        role=user_story.role,
+        goal=user_story.goal,
+        reason=user_story.reason,
+        description=user_story.description,
+        priority=user_story.priority,
+        story_points=user_story.story_points,
+        effort_hours=user_story.effort_hours
+    )
+
+
+def tasks_fingerprint(user_story):
+    """
+    Huella del contenido de una historia con la que se comparan sus tareas generadas.
+    :return: Huella actual de la historia, o None si sus tareas ya están generadas para ese contenido.
+    """
+    fingerprint = getattr(user_story, "content_fingerprint", None) or story_fingerprint(user_story)
+    return None if getattr(user_story, "tasks_fingerprint", None) == fingerprint else fingerprint
+
+
+def save_tasks(user_story_id, tasks, task_manager, fingerprint=None):
+    """
+    Guarda en base de datos, en una única transacción, las tareas generadas para una historia de usuario,
+    escribiendo solo las diferencias con las tareas que ya tenía (ver TaskManager.sync_tasks).
+    :param fingerprint: Huella de la historia con la que se generaron (las siguientes generaciones sin cambios se omiten).
+    :raises ValueError: Si alguna tarea no tiene título o descripción (no se guarda ninguna).
+    :return: Diccionario con los IDs creados, actualizados y eliminados y el número de tareas sin cambios.
+    """
+    return task_manager.sync_tasks(user_story_id, tasks, fingerprint=fingerprint)
+
+
+def plan_tasks(user_story, task_manager, force=False, timeout=None):
+    """
+    Generación incremental de las tareas de una historia de usuario: si la historia no ha cambiado desde la
+    última generación no se llama al modelo ni se escribe nada; si ha cambiado (o se fuerza), se generan las
+    tareas y se guardan solo las diferencias.
+    :param force: Generar aunque la historia no haya cambiado, sin usar la caché de respuestas del modelo
+        (con la historia sin cambios el prompt es idéntico y la caché devolvería las mismas tareas).
+    :return: Diccionario con status ('unchanged' o 'synced') y los cambios aplicados.
+    :rtype: dict
+    """
+    fingerprint = tasks_fingerprint(user_story)
+    if fingerprint is None and not force:
+        return {"status": "unchanged", "created": [], "updated": [], "deleted": []}
+    tasks = generate_tasks(user_story, timeout=timeout, use_cache=not force)
+    fingerprint = fingerprint or story_fingerprint(user_story)
+    return {"status": "synced", **save_tasks(user_story.id, tasks, task_manager, fingerprint=fingerprint)}
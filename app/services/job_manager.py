@@ -0,0 +1,59 @@
+# app/services/job_manager.py
+
+from app.models.generation_job import GenerationJob
+from app.db import db_session
+from datetime import datetime, timezone
+import json
+import uuid
+
+class JobManager:
+    def __init__(self, db=None):
+        # Por defecto se usa la sesión de la petición o del hilo en curso (scoped_session)
+        self.db = db if db is not None else db_session
+
+    def create_job(self, kind, prompt=None, user_story_id=None):
+        job = GenerationJob(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            status='pendiente',
+            prompt=prompt,
+            user_story_id=user_story_id
+        )
+        self.db.add(job)
+        self._commit()
+        return job
+
+    def get_job(self, job_id):
+        return self.db.get(GenerationJob, job_id)
+
+    def mark_running(self, job_id):
+        job = self.get_job(job_id)
+        job.status = 'en_progreso'
+        job.started_at = datetime.now(timezone.utc)
+        self._commit()
+        return job
+
+    def mark_completed(self, job_id, result):
+        job = self.get_job(job_id)
+        job.status = 'completado'
+        job.result = json.dumps(result)
+        job.user_story_id = result.get('user_story_id', job.user_story_id)
+        job.finished_at = datetime.now(timezone.utc)
+        self._commit()
+        return job
+
+    def mark_failed(self, job_id, error):
+        job = self.get_job(job_id)
+        job.status = 'fallido'
+        job.error = error
+        job.finished_at = datetime.now(timezone.utc)
+        self._commit()
+        return job
+
+    def _commit(self):
+        # Si el commit falla se deshace la transacción para no dejar la sesión inutilizable
+        try:
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
@@ -0,0 +1,109 @@
+# app/services/job_queue.py
+from concurrent.futures import ThreadPoolExecutor
+from app.db import db_session, primary_reads
+from app.services.job_manager import JobManager
+from app.services.user_story_manager import UserStoryManager
+from app.services.task_manager import TaskManager
+from app.services import generation
+import logging
+import threading
+import os
+
+logger = logging.getLogger(__name__)
+
+# Número de hilos que ejecutan generaciones en segundo plano (0 = ejecución inmediata en la petición)
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+
+
+class JobQueue:
+    """
+    Cola de trabajos de generación con IA respaldada por un pool de hilos local.
+    El estado de cada trabajo se persiste en la tabla generation_jobs, de modo que cualquier
+    worker puede responder a las consultas de estado aunque el trabajo se ejecute en otro proceso.
+    """
+    def __init__(self, max_workers=GENERATION_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # El pool de hilos se crea en el primer uso para que sea seguro tras un fork
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="generation")
+            return self._executor
+
+    def submit(self, job_id, fn, *args):
+        """
+        Encola la ejecución de fn(*args) para el trabajo indicado.
+        :return: Future del trabajo, o None si se ejecutó de forma inmediata (max_workers=0).
+        """
+        if self.max_workers <= 0:
+            self._run(job_id, fn, *args)
+            return None
+        return self._get_executor().submit(self._run, job_id, fn, *args)
+
+    def _run(self, job_id, fn, *args):
+        jobs = JobManager()
+        try:
+            jobs.mark_running(job_id)
+            result = fn(*args)
+            jobs.mark_completed(job_id, result)
+        except Exception as e:
+            logger.exception("Error en el trabajo de generación %s", job_id)
+            db_session.rollback()
+            jobs.mark_failed(job_id, str(e))
+        finally:
+            # Cada hilo del pool libera su sesión al terminar el trabajo
+            if self.max_workers > 0:
+                db_session.remove()
+
+    def reset(self):
+        """Descarta el pool de hilos heredado tras un fork (los hilos no sobreviven al fork)."""
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+job_queue = JobQueue()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=job_queue.reset)
+
+
+def run_user_story_job(prompt):
+    """Genera una historia de usuario a partir del prompt y la guarda en la base de datos."""
+    user_story = generation.generate_user_story(prompt)
+    story = generation.save_user_story(user_story, UserStoryManager())
+    return {"user_story_id": story.id}
+
+
+def run_tasks_job(user_story_id, force=False):
+    """
+    Genera las tareas de una historia de usuario y guarda las diferencias con las existentes.
+    Si la historia no ha cambiado desde la última generación (y no se fuerza) no se llama al modelo.
+    """
+    with primary_reads():
+        user_story = UserStoryManager().get_user_story_by_id(user_story_id)
+    if user_story is None:
+        raise ValueError('Historia de usuario no encontrada.')
+    result = generation.plan_tasks(user_story, TaskManager(), force=force)
+    return {"user_story_id": user_story_id, "task_ids": result["created"] + result["updated"], **result}
+
+
+def enqueue_user_story(prompt):
+    """Crea y encola un trabajo de generación de historia de usuario. Devuelve el trabajo creado."""
+    job = JobManager().create_job('user_story', prompt=prompt)
+    job_queue.submit(job.id, run_user_story_job, prompt)
+    return job
+
+
+def enqueue_tasks(user_story_id, force=False):
+    """Crea y encola un trabajo de generación de tareas. Devuelve el trabajo creado."""
+    job = JobManager().create_job('tasks', user_story_id=user_story_id)
+    job_queue.submit(job.id, run_tasks_job, user_story_id, force)
+    return job
@@ -0,0 +1,251 @@
+# app/services/llm_backends.py
+from app.registry import LazyResource
+from app.services.llm_client import llm, ResilientLLM, RateLimiter, CircuitBreaker, create_http_client, close_client
+import orjson
+import re
+import os
+
+# Backends de generación de cada plantilla de prompt, en orden de preferencia: si uno falla (o supera su
+# plazo) se usa el siguiente. Nombres disponibles: azure, local (endpoint compatible con OpenAI) y template.
+LLM_BACKENDS_USER_STORY = os.getenv("LLM_BACKENDS_USER_STORY", "azure") # Backends de la generación de historias
+LLM_BACKENDS_TASKS = os.getenv("LLM_BACKENDS_TASKS", "azure") # Backends de la generación de tareas (p. ej. local,azure)
+LLM_FALLBACK_TIMEOUT = float(os.getenv("LLM_FALLBACK_TIMEOUT", "0")) # Segundos máximos de un backend con alternativa (0 = LLM_DEADLINE)
+
+# Modelo local o de terceros con API compatible con OpenAI (vLLM, servidor de llama.cpp, Ollama...)
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL") # p. ej. http://localhost:8000/v1
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "local")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL") # Nombre del modelo servido
+LOCAL_LLM_RPM_LIMIT = int(os.getenv("LOCAL_LLM_RPM_LIMIT", "0")) # Peticiones por minuto (0 = sin límite)
+
+ROUTES = {
+    "user_story": LLM_BACKENDS_USER_STORY,
+    "tasks": LLM_BACKENDS_TASKS,
+}
+
+# Backends registrados, por nombre
+BACKENDS = {}
+
+
+class GenerationBackend:
+    """
+    Backend de generación: recibe un prompt renderizado (RenderedPrompt) y devuelve la respuesta validada con
+    el esquema Pydantic indicado.
+    """
+    name = None
+    model = None
+    cacheable = True # Guardar sus respuestas en la caché del modelo
+
+    @property
+    def cache_namespace(self):
+        # Parte de la clave de la caché del modelo: respuestas de modelos distintos no se mezclan
+        return f"{self.name}:{self.model}"
+
+    def is_configured(self):
+        return True
+
+    def parse(self, prompt, response_format, timeout=None):
+        """
+        Genera la respuesta completa.
+        :return: Tupla (respuesta validada, uso de tokens o None).
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt, response_format, timeout=None):
+        """
+        Genera la respuesta en streaming: tuplas ("delta", texto, json_parcial) y una final
+        ("done", respuesta validada, uso de tokens o None).
+        """
+        raise NotImplementedError
+
+    def status(self):
+        return {"model": self.model, "configured": self.is_configured()}
+
+
+class OpenAICompatibleBackend(GenerationBackend):
+    """
+    Backend sobre la API de chat completions con salida estructurada (Azure OpenAI, OpenAI, vLLM o el
+    servidor de llama.cpp). Cada backend tiene su propio ResilientLLM: reintentos, cuota y circuit breaker
+    no se comparten entre endpoints.
+    :param name: Nombre del backend en LLM_BACKENDS_*.
+    :param model: Modelo (o despliegue de Azure) al que se llama.
+    :param resilient: ResilientLLM con el cliente del endpoint.
+    :param cache_namespace: Prefijo de las claves de la caché (por defecto nombre:modelo).
+    """
+    def __init__(self, name, model, resilient, cache_namespace=None):
+        self.name = name
+        self.model = model
+        self.llm = resilient
+        self._cache_namespace = cache_namespace
+
+    @property
+    def cache_namespace(self):
+        return self._cache_namespace or super().cache_namespace
+
+    def is_configured(self):
+        return bool(self.model) and bool(self.llm.client_factory())
+
+    def parse(self, prompt, response_format, timeout=None):
+        completion = self.llm.parse(model=self.model, messages=prompt.messages, response_format=response_format,
+                                    timeout=timeout)
+        return completion.choices[0].message.parsed, getattr(completion, "usage", None)
+
+    def stream(self, prompt, response_format, timeout=None):
+        with self.llm.stream(model=self.model, messages=prompt.messages, response_format=response_format,
+                             timeout=timeout) as stream:
+            for event in stream:
+                if event.type == "content.delta":
+                    yield "delta", event.delta, event.parsed
+            completion = stream.get_final_completion()
+        yield "done", completion.choices[0].message.parsed, getattr(completion, "usage", None)
+
+    def status(self):
+        return {**super().status(), **self.llm.status()}
+
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_PROJECT = re.compile(r"\bproyecto\s+([\w-]+)", re.IGNORECASE)
+_POINTS = (1, 2, 3, 5, 8, 13)
+_PRIORITIES = ("baja", "media", "alta", "bloqueante")
+
+# Tareas del generador sin modelo: categoría, título, parte del esfuerzo de la historia, riesgo y mitigación
+TEMPLATE_TASKS = (
+    ("Análisis", "Detallar los criterios de aceptación", 0.15,
+     "Requisitos ambiguos o incompletos.", "Revisar los criterios de aceptación con el Product Owner antes de empezar."),
+    ("Desarrollo", "Implementar la funcionalidad", 0.5,
+     "La estimación puede no cubrir casos límite.", "Dividir la implementación en entregas pequeñas y revisables."),
+    ("Pruebas", "Cubrir la funcionalidad con pruebas automatizadas", 0.25,
+     "Regresiones en funcionalidades existentes.", "Ejecutar la batería de pruebas completa en la integración continua."),
+    ("Documentación", "Documentar el cambio", 0.1,
+     "Documentación desactualizada.", "Revisar la documentación junto con el código en la misma petición de cambios."),
+)
+
+
+def _number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def template_user_story(values):
+    """Historia de usuario deducida del prompt sin llamar a ningún modelo (siempre la misma para el mismo prompt)."""
+    prompt = " ".join((values.get("prompt") or "").split())
+    first = _SENTENCE.split(prompt)[0].rstrip(".!?") if prompt else "Completar la petición"
+    project = _PROJECT.search(prompt)
+    points = _POINTS[min(len(prompt.split()) // 8, len(_POINTS) - 1)]
+    return {
+        "id": None,
+        "project": project.group(1) if project else "General",
+        "role": "Como usuario",
+        "goal": first if first.lower().startswith("quiero") else f"Quiero {first[:1].lower()}{first[1:]}",
+        "reason": "Para cubrir la necesidad descrita en la petición",
+        "description": prompt,
+        "priority": "media",
+        "story_points": points,
+        "effort_hours": float(points * 4),
+        "created_at": None,
+    }
+
+
+def template_tasks(values):
+    """Tareas estándar (análisis, desarrollo, pruebas y documentación) repartiendo el esfuerzo de la historia."""
+    hours = _number(values.get("effort_hours"), 8.0) or 8.0
+    priority = values.get("priority") if values.get("priority") in _PRIORITIES else "media"
+    goal = values.get("goal") or "la historia de usuario"
+    return {"tasks": [{
+        "id": None,
+        "title": f"{title}: {goal}",
+        "description": f"{title} para la historia «{goal}» del proyecto {values.get('project') or 'General'}.",
+        "priority": priority,
+        "effort_hours": round(hours * share, 1),
+        "status": "pendiente",
+        "category": category,
+        "risk_analysis": risk,
+        "risk_mitigation": mitigation,
+        "assigned_to": None,
+        "user_story_id": None,
+        "created_at": None,
+    } for category, title, share, risk, mitigation in TEMPLATE_TASKS]}
+
+
+class TemplateBackend(GenerationBackend):
+    """
+    Generador determinista sin modelo ni red: construye la respuesta a partir de los campos del prompt.
+    Sirve como último recurso cuando ningún modelo responde y para trabajar sin conexión; sus respuestas no
+    se guardan en la caché porque generarlas no cuesta nada.
+    """
+    name = "template"
+    model = "template"
+    cacheable = False
+    generators = {
+        "user_story": template_user_story,
+        "tasks": template_tasks,
+    }
+
+    def _generate(self, prompt, response_format):
+        generator = self.generators.get(prompt.template)
+        if generator is None:
+            raise ValueError(f"El generador sin modelo no admite la plantilla {prompt.template}.")
+        data = generator(prompt.values)
+        return data, response_format.model_validate(data)
+
+    def parse(self, prompt, response_format, timeout=None):
+        return self._generate(prompt, response_format)[1], None
+
+    def stream(self, prompt, response_format, timeout=None):
+        data, parsed = self._generate(prompt, response_format)
+        yield "delta", orjson.dumps(data).decode(), data
+        yield "done", parsed, None
+
+
+def register_backend(backend):
+    """Registra un backend para poder usarlo en LLM_BACKENDS_*."""
+    BACKENDS[backend.name] = backend
+    return backend
+
+
+def _create_local_client():
+    from openai import OpenAI
+    return OpenAI(base_url=LOCAL_LLM_BASE_URL, api_key=LOCAL_LLM_API_KEY, http_client=create_http_client(), max_retries=0)
+
+
+# Cliente del endpoint local: solo se crea si algún backend lo usa
+local_client = LazyResource("local_llm", _create_local_client, dispose=close_client)
+
+
+def _local_client():
+    return local_client.get() if LOCAL_LLM_BASE_URL else None
+
+
+# La clave de la caché de Azure sigue siendo el nombre del despliegue: las respuestas ya guardadas siguen valiendo
+register_backend(OpenAICompatibleBackend("azure", os.getenv("AZURE_OPENAI_DEPLOYMENT"), llm,
+                                         cache_namespace=os.getenv("AZURE_OPENAI_DEPLOYMENT")))
+register_backend(OpenAICompatibleBackend("local", LOCAL_LLM_MODEL, ResilientLLM(
+    client_factory=_local_client,
+    limiter=RateLimiter(rpm=LOCAL_LLM_RPM_LIMIT, tpm=0),
+    breaker=CircuitBreaker(name="modelo local"),
+)))
+register_backend(TemplateBackend())
+
+
+def backends_for(template):
+    """
+    Backends configurados para una plantilla de prompt, en orden de preferencia (se omiten los que no están
+    configurados, p. ej. 'local' sin LOCAL_LLM_BASE_URL).
+    :raises ValueError: Si LLM_BACKENDS_* incluye un backend desconocido.
+    :return: Lista de backends.
+    :rtype: list
+    """
+    names = [name.strip() for name in ROUTES.get(template, "azure").split(",") if name.strip()]
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        raise ValueError(f"Backend de generación desconocido: {', '.join(unknown)}. Usa {', '.join(BACKENDS)}.")
+    return [BACKENDS[name] for name in names if BACKENDS[name].is_configured()]
+
+
+def backend_status():
+    """Estado de cada backend y backends de cada plantilla."""
+    return {
+        "routes": {template: [name.strip() for name in names.split(",") if name.strip()] for template, names in ROUTES.items()},
+        "backends": {name: backend.status() for name, backend in BACKENDS.items()},
+    }
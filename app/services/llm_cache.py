@@ -0,0 +1,127 @@
+# app/services/llm_cache.py
+from pydantic import BaseModel
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import os
+
+# Configuración de la caché de respuestas del modelo
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3") # Fichero SQLite local (":memory:" para no persistir)
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))) # Segundos de validez de cada respuesta
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")) # Máximo de respuestas guardadas (LRU)
+
+
+class LLMResponseCache:
+    """
+    Caché persistente de respuestas del modelo direccionada por contenido.
+    La clave es un hash del despliegue, el mensaje de sistema, el prompt del usuario y el esquema de
+    respuesta, de modo que un prompt idéntico no vuelve a llamar a Azure OpenAI. Las entradas caducan
+    tras el TTL y, al superar el tamaño máximo, se descartan las menos usadas recientemente (LRU).
+    """
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, enabled=LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connection(self):
+        # La conexión se abre en el primer uso
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " schema TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+        return self._conn
+
+    @staticmethod
+    def make_key(deployment, system_message, user_message, response_format):
+        """Calcula la clave de caché a partir de todo lo que determina la respuesta del modelo."""
+        payload = json.dumps([
+            deployment,
+            system_message,
+            user_message,
+            response_format.__name__,
+            response_format.model_json_schema(),
+        ], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, response_format):
+        """Devuelve la respuesta guardada validada con response_format, o None si no existe o ha caducado."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return response_format.model_validate_json(row[0])
+
+    def set(self, key, parsed):
+        """Guarda una respuesta validada (modelo de Pydantic) y aplica la expulsión LRU."""
+        if not self.enabled or not isinstance(parsed, BaseModel):
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, schema, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, type(parsed).__name__, parsed.model_dump_json(), now, now)
+            )
+            count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+                self.evictions += excess
+
+    def reset(self):
+        """Descarta la conexión heredada tras un fork; cada proceso abre la suya."""
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        """Contadores de aciertos, fallos y expulsiones junto con el número de entradas guardadas."""
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] if self.enabled else 0
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+llm_cache = LLMResponseCache()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=llm_cache.reset)
@@ -0,0 +1,381 @@
+# app/services/llm_client.py
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from app.registry import LazyResource
+import logging
+import random
+import threading
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Configuración del cliente HTTP de Azure OpenAI (conexiones reutilizadas entre llamadas)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60")) # Segundos máximos por llamada al modelo
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5")) # Segundos máximos para abrir la conexión
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20")) # Conexiones simultáneas por proceso
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10")) # Conexiones abiertas en reposo
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")) # Segundos que se mantiene abierta una conexión en reposo
+
+# Reintentos y plazos de cada llamada al modelo
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90")) # Segundos máximos de una llamada incluidos los reintentos
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3")) # Reintentos ante 429, 5xx, timeouts o errores de conexión
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5")) # Segundos de espera base del backoff exponencial
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20")) # Espera máxima entre reintentos
+
+# Cuota del despliegue de Azure OpenAI (0 = sin límite)
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0")) # Peticiones por minuto
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0")) # Tokens por minuto
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1000")) # Tokens de respuesta reservados por llamada
+LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", "10")) # Espera máxima por cuota antes de rechazar la llamada
+
+# Circuit breaker: tras varios fallos seguidos del endpoint las llamadas fallan de inmediato durante un tiempo
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5")) # Fallos consecutivos que abren el circuito
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30")) # Segundos con el circuito abierto antes de probar de nuevo
+
+
+def create_http_client():
+    """Cliente HTTP con el pool de conexiones y los timeouts configurados (compartido por los clientes de openai)."""
+    # openai y su cliente HTTP se importan en el primer uso: no penalizan el arranque de la aplicación
+    from openai import DefaultHttpxClient
+    try:
+        import httpx2 as httpx # Cliente HTTP de las versiones recientes de openai
+    except ImportError:
+        import httpx
+    return DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+
+
+def _create_client():
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        http_client=create_http_client(),
+        max_retries=0, # Los reintentos los gestiona ResilientLLM
+    )
+
+
+def close_client(client):
+    close = getattr(client, "close", None)
+    if close is not None:
+        close()
+
+
+# Cliente de Azure OpenAI compartido por todos los hilos del proceso; tras un fork se crea uno nuevo
+openai_client = LazyResource("azure_openai", _create_client, dispose=close_client)
+
+
+def get_client():
+    """Cliente de Azure OpenAI del proceso (se crea en la primera llamada)."""
+    return openai_client.get()
+
+
+class LLMUnavailableError(RuntimeError):
+    """El modelo no está disponible: circuito abierto, cuota agotada o plazo de la llamada superado."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de tres estados. Tras failure_threshold fallos consecutivos se abre y rechaza las
+    llamadas durante reset_timeout segundos; después deja pasar una única llamada de prueba (semiabierto)
+    y se cierra si tiene éxito o se vuelve a abrir si falla.
+    """
+    CLOSED, OPEN, HALF_OPEN = "cerrado", "abierto", "semiabierto"
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET, name="Azure OpenAI"):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """Lanza CircuitOpenError si el circuito está abierto (o ya hay una llamada de prueba en curso)."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(f"El servicio de IA no responde; se volverá a intentar en {retry_in:.0f} s.")
+
+    def release(self):
+        """Termina sin resultado una llamada que pasó before_call (p. ej. el cliente cortó la conexión)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.reset()
+
+    def record_failure(self):
+        with self._lock:
+            self._trial_running = False
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuito de %s abierto tras %d fallos consecutivos", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """Cubo de tokens que se rellena a rate unidades por segundo hasta capacity."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Segundos hasta disponer de amount unidades (0 si ya están disponibles)."""
+        self._refill(now)
+        amount = min(amount, self.capacity) # Una petición mayor que la cuota completa espera al cubo lleno
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Limitador de peticiones y tokens por minuto ajustado a la cuota del despliegue (RPM/TPM).
+    Antes de cada llamada se reserva una estimación de tokens; al recibir la respuesta se corrige con el
+    consumo real, de modo que el cubo refleja lo que Azure contabiliza.
+    """
+    def __init__(self, rpm=LLM_RPM_LIMIT, tpm=LLM_TPM_LIMIT, max_wait=LLM_MAX_QUEUE_WAIT):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens, timeout=None):
+        """
+        Espera hasta que la cuota permite la llamada.
+        :raises LLMUnavailableError: Si la espera superaría max_wait o el plazo restante de la llamada.
+        """
+        limit = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        deadline = time.monotonic() + limit
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(bucket.wait_time(amount, now) for bucket, amount in ((self.requests, 1), (self.tokens, tokens))
+                           if bucket is not None) if (self.requests or self.tokens) else 0.0
+                if wait <= 0:
+                    if self.requests:
+                        self.requests.take(1)
+                    if self.tokens:
+                        self.tokens.take(tokens)
+                    return
+            if now + wait > deadline:
+                raise LLMUnavailableError("Se ha alcanzado la cuota del modelo de IA; inténtalo de nuevo en unos segundos.")
+            time.sleep(wait)
+
+    def settle(self, estimated, actual):
+        """Corrige la reserva de tokens con el consumo real de la llamada."""
+        if self.tokens is not None and actual is not None:
+            with self._lock:
+                self.tokens.take(actual - estimated)
+
+
+def _status_code(error):
+    return getattr(error, "status_code", None)
+
+
+def _is_transient(error):
+    """Errores que indican que el endpoint no está sano (cuentan para el circuit breaker)."""
+    import openai
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, TimeoutError)):
+        return True
+    status = _status_code(error)
+    return status is not None and status >= 500
+
+
+def _is_retryable(error):
+    return _is_transient(error) or _status_code(error) in (408, 409, 429)
+
+
+def retry_after(error):
+    """Segundos de espera indicados por el servidor (cabeceras retry-after-ms o Retry-After), o None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _stream_tokens(stream, estimated):
+    """
+    Tokens consumidos por un stream, también si se cortó a medias: el uso que envía el servidor si lo incluye
+    y, si no, los del prompt más los de la respuesta recibida hasta el momento, contados en local.
+    """
+    from app.services.prompts import count_tokens
+    if stream is None:
+        return None
+    try:
+        snapshot = stream.current_completion_snapshot
+    except (AttributeError, AssertionError): # Aún no ha llegado ningún fragmento
+        snapshot = None
+    total = getattr(getattr(snapshot, "usage", None), "total_tokens", None)
+    if total is not None:
+        return total
+    content = "".join(choice.message.content or "" for choice in getattr(snapshot, "choices", None) or ())
+    return estimated - LLM_COMPLETION_TOKENS_ESTIMATE + count_tokens(content)
+
+
+def estimate_tokens(messages):
+    """Estimación de tokens de una llamada: tokens de los mensajes contados en local más la respuesta reservada."""
+    from app.services.prompts import count_tokens
+    return sum(count_tokens(str(message.get("content") or "")) for message in messages) + LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+class ResilientLLM:
+    """
+    Envoltorio de las llamadas de chat completions con plazo por llamada, reintentos con backoff
+    exponencial y jitter (respetando Retry-After), limitador RPM/TPM y circuit breaker.
+    """
+    def __init__(self, deadline=LLM_DEADLINE, attempt_timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX, limiter=None, breaker=None,
+                 client_factory=get_client):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.client_factory = client_factory
+
+    def backoff(self, attempt, error=None):
+        """Espera antes del reintento número attempt (0, 1, ...): Retry-After si existe, si no full jitter."""
+        delay = retry_after(error) if error is not None else None
+        if delay is not None:
+            return min(delay, self.backoff_max) + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def parse(self, timeout=None, **kwargs):
+        """
+        Llama a beta.chat.completions.parse con reintentos.
+        :param timeout: Plazo total en segundos de la llamada, reintentos incluidos (por defecto LLM_DEADLINE).
+        :raises LLMUnavailableError: Si el circuito está abierto, no hay cuota o se agota el plazo.
+        """
+        from app.instrumentation import llm_retries
+        deadline = time.monotonic() + (timeout or self.deadline)
+        estimated = estimate_tokens(kwargs.get("messages") or [])
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise LLMUnavailableError("El modelo de IA no respondió a tiempo.")
+                self.limiter.acquire(estimated, timeout=remaining)
+            except BaseException:
+                self.breaker.release()
+                raise
+            try:
+                completion = self.client_factory().beta.chat.completions.parse(
+                    timeout=min(self.attempt_timeout, remaining), **kwargs)
+            except Exception as e:
+                if _is_transient(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success() # El endpoint responde (p. ej. 429 o 400): no está caído
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                logger.info("Reintento %d de la llamada al modelo en %.2f s: %s", attempt + 1, delay, e)
+                llm_retries.inc(reason=str(_status_code(e) or type(e).__name__))
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            usage = getattr(completion, "usage", None)
+            if usage is not None:
+                self.limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            return completion
+
+    @contextmanager
+    def stream(self, timeout=None, **kwargs):
+        """
+        Abre beta.chat.completions.stream con circuit breaker, limitador y plazo por intento.
+        No se reintenta: el cliente ya puede haber recibido parte de la respuesta. Si el stream se corta sin
+        error ni final (p. ej. GeneratorExit al cerrar el navegador la conexión SSE) se libera la llamada de
+        prueba del circuito; en todos los casos la reserva de tokens se corrige con lo consumido.
+        """
+        estimated = estimate_tokens(kwargs.get("messages") or [])
+        self.breaker.before_call()
+        try:
+            self.limiter.acquire(estimated, timeout=timeout or self.deadline)
+        except BaseException:
+            self.breaker.release()
+            raise
+        stream = None
+        recorded = False
+        try:
+            with self.client_factory().beta.chat.completions.stream(
+                    timeout=timeout or self.attempt_timeout, **kwargs) as stream:
+                yield stream
+        except Exception as e:
+            recorded = True
+            if _is_transient(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        else:
+            recorded = True
+            self.breaker.record_success()
+        finally:
+            if not recorded:
+                self.breaker.release()
+            self.limiter.settle(estimated, _stream_tokens(stream, estimated))
+
+    def status(self):
+        return {"circuit": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+
+# Llamadas al modelo del proceso (estado del circuito y de la cuota compartido entre hilos)
+llm = ResilientLLM()
@@ -0,0 +1,256 @@
+# app/services/prompts.py
+from functools import lru_cache
+from string import Formatter
+from textwrap import dedent
+import math
+import re
+import threading
+import os
+
+# Configuración de los prompts
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000")) # Tokens máximos de entrada de cada llamada (sistema + usuario)
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "auto") # auto (tiktoken si está instalado) o approx
+PROMPT_TOKEN_ENCODING = os.getenv("PROMPT_TOKEN_ENCODING", "o200k_base") # Codificación de tiktoken del modelo
+
+TRIM_MARKER = " […]"
+
+# Plantillas compiladas, por nombre
+TEMPLATES = {}
+
+# Aproximación local del pretokenizador de los modelos GPT: palabras con su espacio inicial, signos y saltos de línea
+_PIECES = re.compile(r" ?\w+| ?[^\w\s]+|\s+")
+_SENTENCES = re.compile(r"(?<=[.!?])\s+")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if PROMPT_TOKENIZER == "approx":
+        return None
+    try:
+        import tiktoken # Dependencia opcional: recuento exacto con el tokenizador del modelo
+    except ImportError:
+        return None
+    return tiktoken.get_encoding(PROMPT_TOKEN_ENCODING)
+
+
+def _approx_tokens(text):
+    # Cada fragmento cuesta al menos un token y las palabras largas uno por cada 4 caracteres
+    total = 0
+    for piece in _PIECES.findall(text):
+        length = len(piece.strip())
+        total += max(1, math.ceil(length / 4)) if length else (1 if "\n" in piece or len(piece) > 1 else 0)
+    return total
+
+
+def count_tokens(text):
+    """
+    Cuenta los tokens de un texto en local, sin llamar al proveedor.
+    Usa tiktoken con PROMPT_TOKEN_ENCODING si está instalado y, si no, una aproximación basada en su
+    pretokenizador (palabras, signos y saltos de línea) que tiende a sobreestimar, de modo que el
+    presupuesto de tokens se respeta también sin tiktoken.
+    :param text: Texto a contar.
+    :return: Número de tokens.
+    :rtype: int
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return _approx_tokens(text)
+
+
+def fit_text(text, max_tokens):
+    """
+    Recorta un texto para que no supere max_tokens conservando frases completas desde el principio
+    (resumen extractivo: las descripciones suelen empezar por lo esencial). Si ni la primera frase cabe,
+    se corta por palabras. Los textos recortados terminan en TRIM_MARKER.
+    :return: Texto original o recortado.
+    :rtype: str
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max(max_tokens - count_tokens(TRIM_MARKER), 0)
+    kept, used = [], 0
+    for sentence in _SENTENCES.split(text.strip()):
+        cost = count_tokens((" " if kept else "") + sentence)
+        if used + cost > budget:
+            break
+        kept.append(sentence)
+        used += cost
+    if not kept:
+        for word in text.split():
+            cost = count_tokens((" " if kept else "") + word)
+            if used + cost > budget:
+                break
+            kept.append(word)
+            used += cost
+    return " ".join(kept) + TRIM_MARKER
+
+
+class RenderedPrompt:
+    """
+    Mensajes de una llamada construidos a partir de una plantilla, con su recuento de tokens y los valores
+    (ya recortados) de sus campos, que usan los backends que no necesitan el texto del prompt.
+    """
+    def __init__(self, template, system, user, tokens, trimmed, values=None):
+        self.template = template
+        self.system = system
+        self.user = user
+        self.tokens = tokens
+        self.trimmed = trimmed
+        self.values = values or {}
+
+    @property
+    def messages(self):
+        # El mensaje de sistema (estático) va primero para que el prefijo sea idéntico en todas las llamadas
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": self.user}]
+
+
+class PromptTemplate:
+    """
+    Plantilla de prompt compilada una sola vez al importar el módulo.
+    El mensaje de sistema es estático y se envía siempre primero, de modo que todas las llamadas de la misma
+    plantilla comparten el prefijo y el proveedor puede reutilizarlo (prompt caching). El mensaje de usuario
+    se analiza al crear la plantilla y al renderizarlo solo se concatenan los fragmentos con los valores;
+    los tokens de las partes fijas también se cuentan una única vez.
+    :param name: Nombre de la plantilla (para las estadísticas).
+    :param system: Mensaje de sistema (sin campos variables).
+    :param user: Mensaje de usuario con campos {nombre}.
+    :param trim_fields: Campos que se pueden recortar si el prompt supera el presupuesto de tokens.
+    :param budget: Tokens máximos del prompt completo.
+    """
+    def __init__(self, name, system, user, trim_fields=(), budget=None):
+        self.name = name
+        self.system = dedent(system).strip()
+        self._parts = [(literal, field) for literal, field, _, _ in Formatter().parse(dedent(user).strip())]
+        self.fields = [field for _, field in self._parts if field]
+        self.trim_fields = tuple(trim_fields)
+        self.budget = budget
+        self.static_tokens = count_tokens(self.system) + count_tokens("".join(literal for literal, _ in self._parts))
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(("renders", "trimmed", "over_budget", "estimated_tokens", "max_tokens",
+                                     "calls", "prompt_tokens", "completion_tokens"), 0)
+        TEMPLATES[name] = self
+
+    def render(self, **values):
+        """
+        Construye los mensajes con los valores indicados, recortando trim_fields si hace falta para no superar
+        el presupuesto de tokens.
+        :return: Prompt renderizado.
+        :rtype: RenderedPrompt
+        """
+        values = {field: "" if values.get(field) is None else str(values[field]) for field in self.fields}
+        sizes = {field: count_tokens(value) for field, value in values.items()}
+        tokens = self.static_tokens + sum(sizes.values())
+        budget = self.budget if self.budget is not None else PROMPT_TOKEN_BUDGET
+        trimmed = False
+        if tokens > budget:
+            # Se reparte lo que queda del presupuesto entre los campos recortables: los más cortos primero,
+            # y lo que no usan queda para los más largos
+            fixed = tokens - sum(sizes[field] for field in self.trim_fields)
+            available = max(budget - fixed, 0)
+            for i, field in enumerate(sorted(self.trim_fields, key=sizes.get)):
+                share = available // (len(self.trim_fields) - i)
+                if sizes[field] > share:
+                    values[field] = fit_text(values[field], share)
+                    sizes[field] = count_tokens(values[field])
+                    trimmed = True
+                available -= sizes[field]
+            tokens = self.static_tokens + sum(sizes.values())
+        user = "".join(literal + (values[field] if field else "") for literal, field in self._parts)
+        with self._lock:
+            stats = self._stats
+            stats["renders"] += 1
+            stats["trimmed"] += trimmed
+            stats["over_budget"] += tokens > budget
+            stats["estimated_tokens"] += tokens
+            stats["max_tokens"] = max(stats["max_tokens"], tokens)
+        return RenderedPrompt(self.name, self.system, user, tokens, trimmed, values)
+
+    def record_usage(self, prompt_tokens, completion_tokens):
+        """Anota los tokens facturados por el proveedor en una llamada hecha con esta plantilla."""
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["completion_tokens"] += completion_tokens
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["static_tokens"] = self.static_tokens
+        stats["avg_tokens"] = round(stats["estimated_tokens"] / stats["renders"], 1) if stats["renders"] else 0
+        return stats
+
+
+def prompt_stats():
+    """Estadísticas de tokens de cada plantilla: estimación local, recortes y tokens facturados."""
+    return {name: template.stats() for name, template in TEMPLATES.items()}
+
+
+# Generación de historias de usuario: el prompt del usuario es la única parte variable
+USER_STORY_PROMPT = PromptTemplate(
+    "user_story",
+    system='''
+        Eres un asistente de creación de historias de usuario, cada historia de usuario tendrá la siguiente estructura:
+            project: Nombre del proyecto,
+            role: Rol del usuario que solicita la historia (ej. "Como usuario", "Como administrador"),
+            goal: Objetivo de la historia de usuario (ej. "Quiero poder iniciar sesión"),
+            reason: Razón del objetivo (ej. "Para acceder a mi cuenta"),
+            description: Descripción detallada de la historia de usuario,
+            priority: Prioridad de la historia de usuario (baja, media, alta, bloqueante),
+            story_points: Puntos de historia asignados a la historia de usuario (estimación del esfuerzo),
+            effort_hours: Horas de esfuerzo estimadas para completar la historia de usuario
+        ''',
+    user="{prompt}",
+    trim_fields=("prompt",),
+)
+
+# Generación de tareas: las instrucciones y el formato de respuesta son fijos (sistema) y la historia va al final
+TASK_PROMPT = PromptTemplate(
+    "tasks",
+    system='''
+        Eres un Product Owner experto en la creación de tareas para historias de usuario. Debes generar tareas técnicamente precisas y detalladas basadas en la historia de usuario proporcionada.
+
+        Genera una lista de tareas detalladas que deben realizarse para completar la historia de usuario. Cada tarea debe incluir:
+        - Título de la tarea
+        - Descripción detallada de la tarea
+        - Prioridad (baja, media, alta, bloqueante)
+        - Horas de esfuerzo estimadas
+        - Estado (pendiente, en progreso, en revisión, completada)
+        - Usuario asignado (nombre o ID del usuario)
+        - Categoría de la tarea (ej. 'Desarrollo', 'Pruebas', 'Documentación')
+        - Análisis de riesgos asociado a la tarea
+        - Plan de mitigación de riesgos asociado a la tarea
+        Formato de respuesta:
+        ```json
+        {
+          "tasks": [
+            {
+              "title": "Título de la tarea",
+              "description": "Descripción detallada de la tarea",
+              "priority": "baja/ media/ alta/ bloqueante",
+              "effort_hours": 0.0,
+              "status": "pendiente/ en progreso/ en revisión/ completada",
+              "assigned_to": "Nombre o ID del usuario",
+              "category": "Categoría de la tarea",
+              "risk_analysis": "Análisis de riesgos asociado a la tarea",
+              "risk_mitigation": "Plan de mitigación de riesgos asociado a la tarea"
+            }
+          ]
+        }
+        ```
+        ''',
+    user='''
+        Historia de Usuario:
+        - Proyecto: {project}
+        - Rol: {role}
+        - Objetivo: {goal}
+        - Razón: {reason}
+        - Descripción: {description}
+        - Prioridad: {priority}
+        - Puntos de Historia: {story_points}
+        - Horas de Esfuerzo: {effort_hours}
+        ''',
+    trim_fields=("description",),
+)
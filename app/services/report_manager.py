@@ -0,0 +1,189 @@
+# app/services/report_manager.py
+from app.models.user_story import UserStory
+from app.models.task import Task
+from app.models.task_summary import TaskSummary
+from app.services.cache import cached, index_key
+from app.db import db_session, read_only
+from sqlalchemy import select, insert, delete, func
+import math
+
+PRIORITIES = ['baja', 'media', 'alta', 'bloqueante']
+COMPLETED_STATUS = 'completada'
+SUMMARY_CHUNK_SIZE = 500 # Historias por sentencia al recalcular resúmenes
+
+
+def _summary_select(*conditions):
+    # Agregado de las tareas por historia, estado y prioridad con las columnas de task_summaries
+    return (
+        select(Task.user_story_id, Task.status, Task.priority, func.count(Task.id),
+               func.coalesce(func.sum(Task.effort_hours), 0))
+        .where(Task.user_story_id.is_not(None), *conditions)
+        .group_by(Task.user_story_id, Task.status, Task.priority)
+    )
+
+
+def _insert_summaries(bind, *conditions):
+    columns = ["user_story_id", "status", "priority", "task_count", "effort_hours"]
+    bind.execute(insert(TaskSummary.__table__).from_select(columns, _summary_select(*conditions)))
+
+
+def refresh_task_summaries(session, user_story_ids):
+    """
+    Recalcula en la transacción en curso el resumen de tareas de las historias indicadas.
+    Solo se agregan las tareas de esas historias (usando el índice por user_story_id), de modo que el coste
+    de cada escritura no depende del tamaño de la tabla de tareas. Se llama antes del commit de cada alta o
+    borrado de tareas; los resúmenes de una historia eliminada se borran con ella (ON DELETE CASCADE).
+    :param session: Sesión con los cambios pendientes.
+    :param user_story_ids: IDs de las historias cuyas tareas han cambiado.
+    """
+    story_ids = sorted({story_id for story_id in user_story_ids if story_id is not None})
+    if not story_ids:
+        return
+    session.flush()
+    for start in range(0, len(story_ids), SUMMARY_CHUNK_SIZE):
+        chunk = story_ids[start:start + SUMMARY_CHUNK_SIZE]
+        session.execute(delete(TaskSummary.__table__).where(TaskSummary.user_story_id.in_(chunk)))
+        _insert_summaries(session, Task.user_story_id.in_(chunk))
+
+
+def rebuild_task_summaries(bind):
+    """Reconstruye todos los resúmenes de tareas (migración inicial o reparación). Devuelve las filas creadas."""
+    bind.execute(delete(TaskSummary.__table__))
+    _insert_summaries(bind)
+    return bind.execute(select(func.count()).select_from(TaskSummary.__table__)).scalar()
+
+
+def _hours(value):
+    return round(float(value or 0), 2)
+
+
+def _priority_order(item):
+    priority = item["priority"]
+    return PRIORITIES.index(priority) if priority in PRIORITIES else len(PRIORITIES)
+
+
+class ReportManager:
+    """
+    Informes de esfuerzo por proyecto, prioridad y estado calculados con GROUP BY en la base de datos.
+    Los totales de tareas se leen de task_summaries (una fila por historia, estado y prioridad) y nunca de la
+    tabla de tareas; los resultados se sirven desde la caché de lectura hasta la siguiente escritura.
+    """
+    def __init__(self, db=None):
+        # Por defecto se usa la sesión de la petición en curso (scoped_session)
+        self.db = db if db is not None else db_session
+
+    @read_only
+    def project_summary(self):
+        """
+        Totales de cada proyecto: historias, story points y horas estimadas de las historias, y número de
+        tareas, horas de las tareas y horas pendientes (tareas no completadas).
+        :return: Lista de diccionarios ordenada por proyecto.
+        :rtype: list
+        """
+        return cached(index_key("report", "projects"), self._project_summary)
+
+    def _project_summary(self):
+        stories = self.db.execute(
+            select(UserStory.project, func.count(UserStory.id), func.coalesce(func.sum(UserStory.story_points), 0),
+                   func.coalesce(func.sum(UserStory.effort_hours), 0))
+            .group_by(UserStory.project)
+        )
+        report = {project: {
+            "project": project,
+            "stories": count,
+            "story_points": int(points),
+            "estimated_hours": _hours(hours),
+            "tasks": 0,
+            "task_hours": 0.0,
+            "remaining_hours": 0.0,
+        } for project, count, points, hours in stories}
+        for project, status, count, hours in self.db.execute(
+            select(UserStory.project, TaskSummary.status, func.sum(TaskSummary.task_count), func.sum(TaskSummary.effort_hours))
+            .join(UserStory, TaskSummary.user_story_id == UserStory.id)
+            .group_by(UserStory.project, TaskSummary.status)
+        ):
+            totals = report[project]
+            totals["tasks"] += int(count)
+            totals["task_hours"] = _hours(totals["task_hours"] + hours)
+            if status != COMPLETED_STATUS:
+                totals["remaining_hours"] = _hours(totals["remaining_hours"] + hours)
+        return [report[project] for project in sorted(report)]
+
+    @read_only
+    def project_report(self, project, capacity_hours=None):
+        """
+        Informe de un proyecto: totales, desglose por prioridad de las historias (con las tareas de cada una) y
+        por estado de las tareas, y horas de las tareas de cada historia frente a la estimación de la propia historia.
+        :param project: Nombre del proyecto.
+        :param capacity_hours: Horas disponibles por sprint; si se indica se calcula cuántos sprints faltan.
+        :return: Diccionario con el informe, o None si el proyecto no tiene historias.
+        :rtype: dict
+        """
+        report = cached(index_key("report", "project", project), lambda: self._project_report(project))
+        if report is not None and capacity_hours:
+            remaining = report["totals"]["remaining_hours"]
+            report = {**report, "capacity": {
+                "hours_per_sprint": capacity_hours,
+                "sprints_needed": math.ceil(remaining / capacity_hours) if remaining else 0,
+            }}
+        return report
+
+    def _project_report(self, project):
+        stories = [{
+            "id": story_id,
+            "goal": goal,
+            "priority": priority,
+            "story_points": points,
+            "estimated_hours": _hours(estimate),
+            "tasks": int(count),
+            "task_hours": _hours(hours),
+            "deviation_hours": _hours((hours or 0) - (estimate or 0)),
+        } for story_id, goal, priority, points, estimate, count, hours in self.db.execute(
+            select(UserStory.id, UserStory.goal, UserStory.priority, UserStory.story_points, UserStory.effort_hours,
+                   func.coalesce(func.sum(TaskSummary.task_count), 0), func.coalesce(func.sum(TaskSummary.effort_hours), 0))
+            .outerjoin(TaskSummary, TaskSummary.user_story_id == UserStory.id)
+            .where(UserStory.project == project)
+            .group_by(UserStory.id, UserStory.goal, UserStory.priority, UserStory.story_points, UserStory.effort_hours)
+            .order_by(UserStory.id)
+        )]
+        if not stories:
+            return None
+
+        # Desglose por la prioridad de la historia: las tareas cuentan en la de su historia, no en la suya propia,
+        # para que cada fila compare las horas de las tareas con la estimación de las mismas historias
+        by_priority = {}
+        for story in stories:
+            row = by_priority.setdefault(story["priority"], {"priority": story["priority"], "stories": 0, "story_points": 0,
+                                                             "estimated_hours": 0.0, "tasks": 0, "task_hours": 0.0})
+            row["stories"] += 1
+            row["story_points"] += story["story_points"] or 0
+            row["estimated_hours"] = _hours(row["estimated_hours"] + story["estimated_hours"])
+            row["tasks"] += story["tasks"]
+            row["task_hours"] = _hours(row["task_hours"] + story["task_hours"])
+
+        by_status = {}
+        remaining = 0.0
+        for status, count, hours in self.db.execute(
+            select(TaskSummary.status, func.sum(TaskSummary.task_count), func.sum(TaskSummary.effort_hours))
+            .join(UserStory, TaskSummary.user_story_id == UserStory.id)
+            .where(UserStory.project == project)
+            .group_by(TaskSummary.status)
+        ):
+            by_status[status] = {"status": status, "tasks": int(count), "task_hours": _hours(hours)}
+            if status != COMPLETED_STATUS:
+                remaining += hours
+
+        return {
+            "project": project,
+            "totals": {
+                "stories": len(stories),
+                "story_points": sum(story["story_points"] or 0 for story in stories),
+                "estimated_hours": _hours(sum(story["estimated_hours"] for story in stories)),
+                "tasks": sum(story["tasks"] for story in stories),
+                "task_hours": _hours(sum(story["task_hours"] for story in stories)),
+                "remaining_hours": _hours(remaining),
+            },
+            "by_priority": sorted(by_priority.values(), key=_priority_order),
+            "by_status": sorted(by_status.values(), key=lambda row: row["status"] or ""),
+            "stories": stories,
+        }
@@ -0,0 +1,365 @@
+# app/services/search_index.py
+from collections import Counter
+from sqlalchemy import select, text, inspect, or_
+from sqlalchemy.exc import OperationalError
+from app.services.story_index import WORD, normalize, words, stem
+from app.instrumentation import search_duration
+from app.db import read_only, primary_reads
+import heapq
+import logging
+import math
+import threading
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la búsqueda de texto completo
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto") # auto (FTS5 de SQLite o FULLTEXT de MySQL si existen) o memory
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20")) # Resultados por página
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100")) # Máximo de resultados por página
+
+# Campos indexados de cada tipo de documento
+STORY_FIELDS = ("goal", "reason", "description")
+TASK_FIELDS = ("title", "description", "risk_analysis")
+KINDS = ("user_story", "task")
+TABLES = {"user_story": ("user_stories", STORY_FIELDS), "task": ("tasks", TASK_FIELDS)}
+
+# Estructuras nativas creadas por la migración 6
+FTS_TABLES = {"user_story": "user_stories_fts", "task": "tasks_fts"}
+FULLTEXT_INDEXES = {"user_story": "ft_user_stories", "task": "ft_tasks"}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+EXCERPT_LENGTH = 200
+
+_STOPWORDS = frozenset("a al con de del e el en es la las lo los o para por que se su sus un una y the and for of to".split())
+
+
+def tokens(text):
+    """
+    Términos de búsqueda de un texto: minúsculas, sin tildes ni palabras vacías y recortados a un prefijo común.
+    :return: Lista de términos en el orden del texto (con repeticiones).
+    :rtype: list
+    """
+    return [stem(word) for word in words(text) if len(word) > 1 and word not in _STOPWORDS]
+
+
+def _document_text(row, fields):
+    return " ".join(getattr(row, field) or "" for field in fields)
+
+
+class InvertedIndex:
+    """
+    Índice invertido en memoria de historias de usuario y tareas con puntuación BM25, para las bases de datos
+    sin búsqueda de texto completo nativa.
+    Se construye desde la base de datos en la primera búsqueda; después, antes de cada búsqueda se leen solo
+    las filas nuevas (ID mayor que el último leído) y las historias marcadas con invalidate_story, que se
+    vuelven a leer junto con sus tareas. Las modificaciones y borrados hechos por otros procesos no se ven
+    hasta que se marcan en este (los resultados que ya no existen se descartan al leerlos).
+    """
+    name = "memory"
+
+    def __init__(self):
+        self._postings = {} # Término -> {(tipo, id): frecuencia}
+        self._docs = {} # (tipo, id) -> (número de términos, términos distintos)
+        self._story_tasks = {} # ID de la historia -> IDs de sus tareas
+        self._total_length = 0
+        self._max_ids = dict.fromkeys(KINDS, 0)
+        self._dirty = set()
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _add(self, kind, doc_id, text):
+        doc = (kind, doc_id)
+        self._remove(doc)
+        counts = Counter(tokens(text))
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[doc] = frequency
+        length = sum(counts.values())
+        self._docs[doc] = (length, tuple(counts))
+        self._total_length += length
+
+    def _remove(self, doc):
+        entry = self._docs.pop(doc, None)
+        if entry is None:
+            return
+        length, terms = entry
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= length
+
+    def invalidate(self, user_story_id=None):
+        """Marca una historia (o todas si es None) para volver a leerla con sus tareas en la siguiente búsqueda."""
+        with self._lock:
+            if user_story_id is None:
+                self.clear()
+            elif self._loaded:
+                self._dirty.add(user_story_id)
+
+    def sync(self, session):
+        """
+        Incorpora las filas nuevas y vuelve a leer las historias marcadas (todo la primera vez). Se lee del
+        primario: una réplica con retraso dejaría en el índice datos antiguos hasta el siguiente cambio.
+        """
+        from app.models.user_story import UserStory
+        from app.models.task import Task
+        with self._lock, primary_reads():
+            dirty, self._dirty = self._dirty, set()
+            for story_id in dirty:
+                self._remove(("user_story", story_id))
+                for task_id in self._story_tasks.pop(story_id, ()):
+                    self._remove(("task", task_id))
+            stories = select(UserStory.id, *(getattr(UserStory, field) for field in STORY_FIELDS)) \
+                .where(or_(UserStory.id > self._max_ids["user_story"], UserStory.id.in_(dirty)))
+            for row in session.execute(stories.execution_options(yield_per=1000)):
+                self._add("user_story", row.id, _document_text(row, STORY_FIELDS))
+                self._max_ids["user_story"] = max(self._max_ids["user_story"], row.id)
+            tasks = select(Task.id, Task.user_story_id, *(getattr(Task, field) for field in TASK_FIELDS)) \
+                .where(or_(Task.id > self._max_ids["task"], Task.user_story_id.in_(dirty)))
+            for row in session.execute(tasks.execution_options(yield_per=1000)):
+                self._add("task", row.id, _document_text(row, TASK_FIELDS))
+                self._story_tasks.setdefault(row.user_story_id, set()).add(row.id)
+                self._max_ids["task"] = max(self._max_ids["task"], row.id)
+            self._loaded = True
+
+    def search(self, session, terms, kinds, limit):
+        """
+        Documentos que contienen algún término, puntuados con BM25.
+        :return: Tupla (lista de (tipo, id, puntuación) con los limit mejores, total de documentos encontrados).
+        """
+        with self._lock:
+            self.sync(session)
+            count = len(self._docs)
+            if not count:
+                return [], 0
+            average = self._total_length / count or 1.0
+            scores = {}
+            for term in set(terms):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, frequency in postings.items():
+                    if doc[0] not in kinds:
+                        continue
+                    norm = 1 - BM25_B + BM25_B * self._docs[doc][0] / average
+                    scores[doc] = scores.get(doc, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0][1]))
+        return [(kind, doc_id, score) for (kind, doc_id), score in best], len(scores)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._docs.clear()
+            self._story_tasks.clear()
+            self._total_length = 0
+            self._max_ids = dict.fromkeys(KINDS, 0)
+            self._dirty.clear()
+            self._loaded = False
+
+
+class SQLiteFTSBackend:
+    """
+    Búsqueda con las tablas FTS5 de SQLite (contenido externo sobre user_stories y tasks, mantenidas por
+    triggers). La puntuación es bm25() con el signo cambiado (mayor es mejor).
+    """
+    name = "fts5"
+
+    @staticmethod
+    def _match(terms):
+        # Cada término es una palabra (\w+) entre comillas: el texto del usuario no puede inyectar sintaxis de FTS5
+        return " OR ".join(f'"{term}"*' for term in dict.fromkeys(terms))
+
+    def search(self, session, terms, kinds, limit):
+        hits, total = [], 0
+        match = self._match(terms)
+        for kind in kinds:
+            table = FTS_TABLES[kind]
+            rows = session.execute(text(f"SELECT rowid, bm25({table}) AS score FROM {table} WHERE {table} MATCH :match "
+                                        f"ORDER BY score, rowid LIMIT :limit"), {"match": match, "limit": limit})
+            hits.extend((kind, row.rowid, -row.score) for row in rows)
+            total += session.execute(text(f"SELECT count(*) FROM {table} WHERE {table} MATCH :match"),
+                                     {"match": match}).scalar()
+        return hits, total
+
+
+class MySQLFullTextBackend:
+    """Búsqueda con los índices FULLTEXT de MySQL (MATCH ... AGAINST en modo booleano, con prefijos)."""
+    name = "fulltext"
+
+    def search(self, session, terms, kinds, limit):
+        hits, total = [], 0
+        against = " ".join(f"{term}*" for term in dict.fromkeys(terms))
+        for kind in kinds:
+            table, fields = TABLES[kind]
+            match = f"MATCH ({', '.join(fields)}) AGAINST (:against IN BOOLEAN MODE)"
+            rows = session.execute(text(f"SELECT id, {match} AS score FROM {table} WHERE {match} "
+                                        f"ORDER BY score DESC, id LIMIT :limit"), {"against": against, "limit": limit})
+            hits.extend((kind, row.id, float(row.score)) for row in rows)
+            total += session.execute(text(f"SELECT count(*) FROM {table} WHERE {match}"), {"against": against}).scalar()
+        return hits, total
+
+
+def create_native_index(connection):
+    """
+    Crea las estructuras de búsqueda de texto completo del motor de base de datos: tablas FTS5 con sus
+    triggers en SQLite y los índices FULLTEXT en MySQL. En otros motores (o en un SQLite sin FTS5) no se crea
+    nada y la búsqueda usa el índice en memoria.
+    :return: Nombre del backend creado, o None.
+    :rtype: str
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        for kind, (table, fields) in TABLES.items():
+            fts = FTS_TABLES[kind]
+            columns = ", ".join(fields)
+            new = ", ".join(f"new.{field}" for field in fields)
+            old = ", ".join(f"old.{field}" for field in fields)
+            try:
+                connection.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='{table}', "
+                                           f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+            except OperationalError as e:
+                logger.warning("SQLite no incluye FTS5 (%s): la búsqueda usará el índice en memoria.", e)
+                return None
+            connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                                       f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END")
+            connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                                       f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); END")
+            connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+                                       f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+                                       f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END")
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        return SQLiteFTSBackend.name
+    if dialect in ("mysql", "mariadb"):
+        for kind, (table, fields) in TABLES.items():
+            if FULLTEXT_INDEXES[kind] not in {index["name"] for index in inspect(connection).get_indexes(table)}:
+                connection.exec_driver_sql(f"CREATE FULLTEXT INDEX {FULLTEXT_INDEXES[kind]} ON {table} ({', '.join(fields)})")
+        return MySQLFullTextBackend.name
+    return None
+
+
+class SearchIndex:
+    """
+    Búsqueda de texto completo sobre historias de usuario (objetivo, razón y descripción) y tareas (título,
+    descripción y análisis de riesgos), con resultados ordenados por relevancia y paginados.
+    Con SEARCH_BACKEND=auto usa la búsqueda nativa de la base de datos si la migración 6 la ha creado
+    (FTS5 en SQLite, FULLTEXT en MySQL) y, si no, el índice invertido en memoria.
+    :param session_factory: Función que devuelve la sesión de base de datos.
+    :param backend: 'auto' o 'memory'.
+    """
+    def __init__(self, session_factory=None, backend=SEARCH_BACKEND):
+        self.session_factory = session_factory
+        self.requested = backend
+        self.memory = InvertedIndex()
+        self._backend = None
+
+    def backend(self, session):
+        """Backend en uso (se detecta en la primera búsqueda)."""
+        if self._backend is None:
+            self._backend = self._detect(session) if self.requested != "memory" else self.memory
+            logger.info("Búsqueda de texto completo con el backend %s", self._backend.name)
+        return self._backend
+
+    def _detect(self, session):
+        connection = session.connection()
+        inspector = inspect(connection)
+        dialect = connection.dialect.name
+        if dialect == "sqlite" and all(inspector.has_table(table) for table in FTS_TABLES.values()):
+            return SQLiteFTSBackend()
+        if dialect in ("mysql", "mariadb") and all(
+                FULLTEXT_INDEXES[kind] in {index["name"] for index in inspector.get_indexes(table)}
+                for kind, (table, _) in TABLES.items()):
+            return MySQLFullTextBackend()
+        return self.memory
+
+    def invalidate_story(self, user_story_id=None):
+        """
+        Avisa de que una historia o sus tareas han cambiado (o todas, si es None). Solo afecta al índice en
+        memoria: las tablas nativas se actualizan en la propia transacción.
+        """
+        self.memory.invalidate(user_story_id)
+
+    @read_only
+    def search(self, query, kind=None, page=1, per_page=None):
+        """
+        Busca historias de usuario y tareas que contengan los términos de la consulta.
+        :param query: Texto a buscar.
+        :param kind: 'user_story', 'task' o None (ambos).
+        :param page: Página de resultados (desde 1).
+        :param per_page: Resultados por página (máximo SEARCH_MAX_PAGE_SIZE).
+        :raises ValueError: Si el tipo no es válido.
+        :return: Diccionario con la consulta, la página, el total de coincidencias, el backend y los resultados.
+        :rtype: dict
+        """
+        if kind is not None and kind not in KINDS:
+            raise ValueError(f"Tipo no soportado: {kind}. Usa {', '.join(KINDS)}.")
+        page = max(page or 1, 1)
+        per_page = min(max(per_page or SEARCH_PAGE_SIZE, 1), SEARCH_MAX_PAGE_SIZE)
+        result = {"query": query, "page": page, "per_page": per_page, "total": 0, "backend": None, "results": []}
+        terms = tokens(query)
+        if not terms:
+            return result
+        start = time.perf_counter()
+        session = self.session_factory()
+        backend = self.backend(session)
+        hits, total = backend.search(session, terms, (kind,) if kind else KINDS, page * per_page)
+        hits.sort(key=lambda hit: (-hit[2], hit[0], hit[1]))
+        result.update(total=total, backend=backend.name,
+                      results=self._documents(session, hits[(page - 1) * per_page:page * per_page], terms))
+        search_duration.observe(time.perf_counter() - start, backend=backend.name)
+        return result
+
+    @staticmethod
+    def _documents(session, hits, terms):
+        from app.models.user_story import UserStory
+        from app.models.task import Task
+        ids = {kind: [doc_id for hit_kind, doc_id, _ in hits if hit_kind == kind] for kind in KINDS}
+        rows = {}
+        if ids["user_story"]:
+            for row in session.execute(select(UserStory.id, UserStory.project, UserStory.goal, UserStory.description)
+                                       .where(UserStory.id.in_(ids["user_story"]))):
+                rows["user_story", row.id] = {"type": "user_story", "id": row.id, "user_story_id": row.id,
+                                              "project": row.project, "title": row.goal,
+                                              "excerpt": _excerpt(row.description, terms)}
+        if ids["task"]:
+            for row in session.execute(select(Task.id, Task.user_story_id, Task.title, Task.description)
+                                       .where(Task.id.in_(ids["task"]))):
+                rows["task", row.id] = {"type": "task", "id": row.id, "user_story_id": row.user_story_id,
+                                        "title": row.title, "excerpt": _excerpt(row.description, terms)}
+        # Los documentos que ya no existen (eliminados por otro proceso) se descartan
+        return [{**rows[kind, doc_id], "score": round(score, 4)} for kind, doc_id, score in hits if (kind, doc_id) in rows]
+
+
+def _excerpt(text, terms):
+    """Fragmento del texto que empieza poco antes del primer término encontrado."""
+    text = " ".join((text or "").split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    start = 0
+    for match in WORD.finditer(text):
+        if stem(normalize(match.group())) in terms:
+            start = max(match.start() - 40, 0)
+            break
+    excerpt = text[start:start + EXCERPT_LENGTH]
+    return ("…" if start else "") + excerpt + ("…" if start + EXCERPT_LENGTH < len(text) else "")
+
+
+def _session():
+    from app.db import db_session
+    return db_session()
+
+
+# Índice compartido por el proceso
+search_index = SearchIndex(_session)
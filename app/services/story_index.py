@@ -0,0 +1,251 @@
+# app/services/story_index.py
+from array import array
+import random
+import re
+import threading
+import unicodedata
+import zlib
+import os
+
+from sqlalchemy import select
+
+# Configuración de la detección de historias de usuario similares
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.6")) # Parte del prompt ya cubierta por la historia (0 - 1)
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64")) # Funciones hash de cada firma MinHash
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "32")) # Bandas LSH (DEDUP_NUM_PERM debe ser múltiplo)
+DEDUP_MIN_TERMS = int(os.getenv("DEDUP_MIN_TERMS", "2")) # Términos mínimos del prompt para buscar similares
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = 0xFFFFFFFF
+WORD = re.compile(r"\w+")
+STEM_LENGTH = 6 # Lematización aproximada: se compara el prefijo de cada palabra
+_STOPWORDS = frozenset("""
+a al algo ante asi como con contra cual cuando de del desde donde e el ella ellas ellos en entre era es esa ese
+eso esta este esto estos estas ha hay la las le les lo los mas me mi mis muy ni no nos o otra otro para pero poco
+por porque que quien se ser si sin sobre su sus tambien te tiene todo todos tu un una uno unos unas y ya yo
+quiero quieres poder pueda puedan puedo como usuario usuarios historia crear crea genera generar necesito
+the and for with that this from into user story want
+""".split())
+
+
+# Normalización compartida con el índice de búsqueda (search_index): los dos índices trocean y recortan
+# las palabras igual
+def normalize(text):
+    """Texto en minúsculas y sin tildes."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def words(text):
+    """Palabras normalizadas (minúsculas y sin tildes) de un texto, en orden y con repeticiones."""
+    return WORD.findall(normalize(text))
+
+
+def stem(word):
+    """Prefijo común de una palabra normalizada, para que 'sesión' y 'sesiones' coincidan."""
+    return word[:STEM_LENGTH]
+
+
+def terms(text):
+    """
+    Conjunto de términos normalizados de un texto: minúsculas, sin tildes, sin palabras vacías y
+    recortados a un prefijo común para que 'sesión' y 'sesiones' coincidan.
+    :param text: Texto a normalizar.
+    :return: Conjunto de términos.
+    :rtype: set
+    """
+    return {stem(word) for word in words(text) if len(word) > 2 and word not in _STOPWORDS and not word.isdigit()}
+
+
+class MinHasher:
+    """
+    Calcula firmas MinHash de conjuntos de términos: la proporción de posiciones iguales entre dos firmas
+    estima la similitud de Jaccard de los conjuntos sin necesidad de guardarlos.
+    :param num_perm: Número de funciones hash (longitud de la firma).
+    :param seed: Semilla de las permutaciones (fija para que las firmas sean comparables entre procesos).
+    """
+    def __init__(self, num_perm=DEDUP_NUM_PERM, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._a = [rng.randrange(1, _MERSENNE_PRIME) for _ in range(num_perm)]
+        self._b = [rng.randrange(0, _MERSENNE_PRIME) for _ in range(num_perm)]
+
+    def signature(self, term_set):
+        hashes = [zlib.crc32(term.encode("utf-8")) for term in term_set]
+        return array("I", (min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+                           for a, b in zip(self._a, self._b)))
+
+
+class StoryIndex:
+    """
+    Índice en memoria de historias de usuario para encontrar historias parecidas a un prompt sin llamar al modelo.
+    Las firmas MinHash de todas las historias se guardan contiguas en un único array de enteros de 32 bits
+    (num_perm por historia) y la búsqueda aproximada usa LSH: cada firma se divide en bandas y solo se
+    comparan las historias que coinciden con el prompt en alguna banda completa.
+    El índice se construye desde la base de datos en la primera búsqueda, se actualiza con cada historia
+    creada o eliminada en este proceso y, antes de cada búsqueda, incorpora las creadas por otros procesos.
+    :param session_factory: Función que devuelve la sesión de base de datos con la que se sincroniza.
+    :param num_perm: Longitud de las firmas MinHash.
+    :param bands: Número de bandas LSH; más bandas encuentran historias menos parecidas a cambio de más candidatos.
+    :param threshold: Proporción mínima de los términos del prompt presentes en la historia.
+    """
+    def __init__(self, session_factory=None, num_perm=DEDUP_NUM_PERM, bands=DEDUP_BANDS, threshold=DEDUP_THRESHOLD,
+                 min_terms=DEDUP_MIN_TERMS):
+        if num_perm % bands:
+            raise ValueError("DEDUP_NUM_PERM debe ser múltiplo de DEDUP_BANDS.")
+        self.session_factory = session_factory
+        self.hasher = MinHasher(num_perm)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.min_terms = min_terms
+        self._signatures = array("I") # Firmas de todas las historias, una tras otra
+        self._sizes = array("H") # Número de términos de cada historia
+        self._ids = array("q") # ID de la historia de cada fila
+        self._rows = {} # ID de la historia -> fila
+        self._buckets = [{} for _ in range(bands)] # Por banda: valores de la banda -> IDs de historias
+        self._max_id = 0 # Mayor ID leído de la base de datos
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _band_keys(self, signature):
+        size = self.rows * signature.itemsize
+        raw = signature.tobytes()
+        return [raw[i * size:(i + 1) * size] for i in range(self.bands)]
+
+    def _signature_at(self, row):
+        return self._signatures[row * self.num_perm:(row + 1) * self.num_perm]
+
+    def _insert(self, story_id, text):
+        term_set = terms(text)
+        if not term_set or story_id in self._rows:
+            return False
+        signature = self.hasher.signature(term_set)
+        self._rows[story_id] = len(self._ids)
+        self._ids.append(story_id)
+        self._sizes.append(min(len(term_set), 0xFFFF))
+        self._signatures.extend(signature)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, set()).add(story_id)
+        return True
+
+    def _remove(self, story_id):
+        row = self._rows.pop(story_id, None)
+        if row is None:
+            return False
+        for bucket, key in zip(self._buckets, self._band_keys(self._signature_at(row))):
+            ids = bucket.get(key)
+            if ids is not None:
+                ids.discard(story_id)
+                if not ids:
+                    del bucket[key]
+        # La última fila ocupa el hueco para mantener los arrays compactos
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._ids[row] = moved_id
+            self._sizes[row] = self._sizes[last]
+            self._signatures[row * self.num_perm:(row + 1) * self.num_perm] = self._signature_at(last)
+            self._rows[moved_id] = row
+        self._ids.pop()
+        self._sizes.pop()
+        del self._signatures[last * self.num_perm:]
+        return True
+
+    def add(self, story_id, goal, description):
+        """Añade una historia recién creada (si el índice aún no se ha construido, la leerá al construirse)."""
+        if not self._loaded:
+            return False
+        with self._lock:
+            return self._insert(story_id, f"{goal} {description}")
+
+    def remove(self, story_id):
+        """Quita una historia eliminada del índice."""
+        with self._lock:
+            return self._remove(story_id)
+
+    def sync(self):
+        """Lee de la base de datos las historias con ID mayor que el último leído (todas la primera vez)."""
+        from app.models.user_story import UserStory
+        with self._lock:
+            session = self.session_factory()
+            rows = session.execute(
+                select(UserStory.id, UserStory.goal, UserStory.description)
+                .where(UserStory.id > self._max_id)
+                .order_by(UserStory.id)
+            )
+            for story_id, goal, description in rows:
+                self._insert(story_id, f"{goal} {description}")
+                self._max_id = story_id
+            self._loaded = True
+
+    def search(self, text, limit=3):
+        """
+        Busca las historias más parecidas a un texto.
+        La puntuación estima qué proporción de los términos del texto aparecen en la historia: a partir de la
+        similitud de Jaccard J estimada con las firmas, |A ∩ B| = J (|A| + |B|) / (1 + J).
+        :param text: Prompt o texto con el que se comparan las historias.
+        :param limit: Máximo de resultados.
+        :return: Lista de tuplas (id de la historia, puntuación) ordenada de mayor a menor puntuación.
+        :rtype: list
+        """
+        term_set = terms(text)
+        if len(term_set) < self.min_terms:
+            return []
+        signature = self.hasher.signature(term_set)
+        with self._lock:
+            if self.session_factory is not None:
+                self.sync()
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(key, ()))
+            results = []
+            for story_id in candidates:
+                row = self._rows[story_id]
+                stored = self._signature_at(row)
+                jaccard = sum(1 for x, y in zip(signature, stored) if x == y) / self.num_perm
+                shared = jaccard * (len(term_set) + self._sizes[row]) / (1 + jaccard)
+                score = min(shared / len(term_set), 1.0)
+                if score >= self.threshold:
+                    results.append((story_id, round(score, 3)))
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._signatures = array("I")
+            self._sizes = array("H")
+            self._ids = array("q")
+            self._rows.clear()
+            self._buckets = [{} for _ in range(self.bands)]
+            self._max_id = 0
+            self._loaded = False
+
+
+def _session():
+    from app.db import db_session
+    return db_session()
+
+
+# Índice compartido por el proceso
+story_index = StoryIndex(_session)
+
+
+def find_similar_stories(prompt, limit=3):
+    """
+    Historias existentes parecidas a un prompt, para ofrecer reutilizarlas antes de generar una nueva.
+    :return: Lista de tuplas (id de la historia, puntuación); vacía si la detección está desactivada.
+    :rtype: list
+    """
+    if not DEDUP_ENABLED:
+        return []
+    return story_index.search(prompt, limit)
@@ -1,15 +1,52 @@
 # app/services/task_manager.py
 
 from app.models.task import Task
-from app.db import SessionLocal
+from app.models.user_story import UserStory
+from app.schemas.TaskSchema import TaskSchema
+from app.schemas.TaskSchemas import TaskSchemas
+from app.services.cache import cached, story_tasks_key, invalidate_story
+from app.services.search_index import search_index
+from app.services.report_manager import refresh_task_summaries
+from app.services.user_story_manager import touch_user_stories
+from app.db import db_session, read_only
+from sqlalchemy import select, insert, update, delete
+
+# Campos de una tarea que vienen del modelo y se actualizan al regenerarla; el estado y la persona asignada
+# los gestiona el equipo y se conservan
+GENERATED_FIELDS = ("description", "priority", "effort_hours", "risk_analysis", "risk_mitigation")
+# Estados de las tareas que se pueden eliminar si dejan de aparecer en una nueva generación
+DISCARDABLE_STATUSES = (None, "pendiente")
+
+
+def task_key(title, category):
+    """Clave con la que se emparejan las tareas generadas con las existentes: título y categoría normalizados."""
+    return " ".join((title or "").lower().split()), " ".join((category or "").lower().split())
+
 
 class TaskManager:
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, db=None):
+        # Por defecto se usa la sesión de la petición en curso (scoped_session)
+        self.db = db if db is not None else db_session
 
+    @read_only
     def get_tasks_by_user_story(self, user_story_id):
         return self.db.query(Task).filter(Task.user_story_id == user_story_id).all()
 
+    def get_task_list(self, user_story_id):
+        """Tareas de una historia de usuario (TaskSchema) servidas desde la caché de lectura."""
+        return cached(
+            story_tasks_key(user_story_id),
+            lambda: [TaskSchema.model_validate(task) for task in self.get_tasks_by_user_story(user_story_id)]
+        )
+
+    def get_task_by_id(self, task_id):
+        return self.db.get(Task, task_id)
+
+    @read_only
+    def get_last_modified(self, task_id):
+        """Fecha de la última modificación de una tarea (None si no existe), sin cargarla."""
+        return self.db.scalar(select(Task.updated_at).where(Task.id == task_id))
+
     def create_task(self, title, description, priority, effort_hours, status, assigned_to, user_story_id, category=None, risk_analysis=None, risk_mitigation=None):
         new_task = Task(
             title=title,
@@ -24,14 +61,178 @@ class TaskManager:
             risk_mitigation=risk_mitigation
         )
         self.db.add(new_task)
-        self.db.commit()
+        self._commit([user_story_id])
+        invalidate_story(user_story_id)
+        search_index.invalidate_story(user_story_id)
         self.db.refresh(new_task)
         return new_task
     
+    def create_tasks(self, tasks, user_story_id=None):
+        """
+        Crea varias tareas en una única transacción (todo o nada).
+        Primero se valida el lote completo y después se insertan todas las filas con un executemany,
+        usando RETURNING cuando el dialecto lo soporta para no volver a consultar las filas creadas.
+        :param tasks: TaskSchemas o iterable de TaskSchema (p. ej. tareas importadas desde un fichero).
+        :param user_story_id: Historia de usuario de todas las tareas; si es None se usa la de cada tarea.
+        :raises ValueError: Si alguna tarea no tiene título, descripción o historia de usuario.
+        :return: Lista de tareas creadas.
+        """
+        rows = [self._task_row(task, user_story_id) for task in self._items(tasks)]
+        if not rows:
+            return []
+
+        try:
+            created = self._insert_rows(rows)
+            refresh_task_summaries(self.db, {row["user_story_id"] for row in rows})
+            touch_user_stories(self.db, {row["user_story_id"] for row in rows})
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        for story_id in {row["user_story_id"] for row in rows}:
+            invalidate_story(story_id)
+            search_index.invalidate_story(story_id)
+        return created
+
+    def sync_tasks(self, user_story_id, tasks, fingerprint=None):
+        """
+        Aplica una nueva generación de tareas sobre las tareas existentes de una historia, en una transacción y
+        escribiendo solo las diferencias. Las tareas se emparejan por título y categoría (task_key):
+        - las que no existían se insertan;
+        - las que existen con otro contenido se actualizan (GENERATED_FIELDS; se conservan estado y asignación);
+        - las que ya no aparecen se eliminan si siguen pendientes (las empezadas se conservan), igual que los
+          duplicados que dejaron generaciones anteriores.
+        :param user_story_id: ID de la historia de usuario.
+        :param tasks: TaskSchemas o iterable de TaskSchema generados.
+        :param fingerprint: Huella del contenido de la historia usada en la generación (se guarda como tasks_fingerprint).
+        :raises ValueError: Si alguna tarea no tiene título o descripción (no se guarda ningún cambio).
+        :return: Diccionario con los IDs creados, actualizados y eliminados y el número de tareas sin cambios.
+        :rtype: dict
+        """
+        rows = [self._task_row(task, user_story_id) for task in self._items(tasks)]
+        existing = {}
+        for current in self.db.execute(
+            select(Task.id, Task.title, Task.category, Task.status, *(getattr(Task, field) for field in GENERATED_FIELDS))
+            .where(Task.user_story_id == user_story_id)
+            .order_by(Task.id)
+        ):
+            existing.setdefault(task_key(current.title, current.category), []).append(current)
+
+        new_rows, updates, unchanged, seen = [], [], 0, set()
+        for row in rows:
+            key = task_key(row["title"], row["category"])
+            if key in seen:
+                continue
+            seen.add(key)
+            matches = existing.get(key)
+            if not matches:
+                new_rows.append(row)
+                continue
+            current = matches.pop(0)
+            changes = {field: row[field] for field in GENERATED_FIELDS if row[field] != getattr(current, field)}
+            if changes:
+                updates.append({"id": current.id, **changes})
+            else:
+                unchanged += 1
+        stale = [current.id for matches in existing.values() for current in matches if current.status in DISCARDABLE_STATUSES]
+
+        try:
+            created = self._insert_rows(new_rows) if new_rows else []
+            if updates:
+                # UPDATE por clave primaria con executemany (agrupado por columnas modificadas)
+                self.db.execute(update(Task), updates)
+            if stale:
+                self.db.execute(delete(Task).where(Task.id.in_(stale)).execution_options(synchronize_session=False))
+            if fingerprint is not None:
+                self.db.execute(update(UserStory).where(UserStory.id == user_story_id).values(tasks_fingerprint=fingerprint)
+                                .execution_options(synchronize_session=False))
+            changed = [user_story_id] if (created or updates or stale) else []
+            refresh_task_summaries(self.db, changed)
+            touch_user_stories(self.db, changed)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        if created or updates or stale:
+            invalidate_story(user_story_id)
+            search_index.invalidate_story(user_story_id)
+        return {
+            "created": [task.id for task in created],
+            "updated": [item["id"] for item in updates],
+            "deleted": stale,
+            "unchanged": unchanged,
+        }
+
+    @staticmethod
+    def _items(tasks):
+        return tasks.tasks if isinstance(tasks, TaskSchemas) else list(tasks)
+
+    @staticmethod
+    def _task_row(task, user_story_id=None):
+        # Verificar que la tarea tenga un título y una descripción
+        if not task.title or not task.description:
+            raise ValueError('Todas las tareas deben tener un título y una descripción.')
+        story_id = user_story_id if user_story_id is not None else task.user_story_id
+        if story_id is None:
+            raise ValueError('Todas las tareas deben pertenecer a una historia de usuario.')
+        return {
+            "title": task.title,
+            "description": task.description,
+            "priority": task.priority,
+            "effort_hours": task.effort_hours,
+            "status": task.status,
+            "assigned_to": task.assigned_to,
+            "user_story_id": story_id,
+            "category": task.category,
+            "risk_analysis": task.risk_analysis,
+            "risk_mitigation": task.risk_mitigation,
+        }
+
+    def _insert_rows(self, rows):
+        # Inserta las filas con un executemany sin confirmar la transacción y devuelve las tareas creadas
+        if self.db.get_bind().dialect.insert_executemany_returning:
+            created = list(self.db.scalars(insert(Task).returning(Task), rows))
+        else:
+            # Sin RETURNING (MySQL) el ORM obtiene los IDs al hacer flush y una sola consulta carga los valores por defecto
+            created = [Task(**row) for row in rows]
+            self.db.add_all(created)
+            self.db.flush()
+            self.db.query(Task).filter(Task.id.in_([task.id for task in created])).all()
+        # Las tareas ya están cargadas: se separan de la sesión para que el commit no las expire
+        for task in created:
+            self.db.expunge(task)
+        return created
+
     def delete_tasks_by_user_story(self, user_story_id):
-        tasks = self.db.query(Task).filter(Task.user_story_id == user_story_id).all()
-        for task in tasks:
-            self.db.delete(task)
-        self.db.commit()
+        # Un único DELETE sin cargar las tareas en la sesión
+        self.db.execute(
+            delete(Task).where(Task.user_story_id == user_story_id).execution_options(synchronize_session=False)
+        )
+        # Sin tareas, la siguiente generación debe llamar al modelo aunque la historia no haya cambiado
+        self.db.execute(update(UserStory).where(UserStory.id == user_story_id).values(tasks_fingerprint=None)
+                        .execution_options(synchronize_session=False))
+        self._commit([user_story_id])
+        invalidate_story(user_story_id)
+        search_index.invalidate_story(user_story_id)
 
+    def delete_task(self, task_id):
+        task = self.get_task_by_id(task_id)
+        if task:
+            user_story_id = task.user_story_id
+            self.db.delete(task)
+            self._commit([user_story_id])
+            invalidate_story(user_story_id)
+            search_index.invalidate_story(user_story_id)
+            return True
+        return False
 
+    def _commit(self, user_story_ids=()):
+        # Se actualizan el resumen de tareas y la fecha de modificación de las historias afectadas en la misma
+        # transacción. Si el commit falla se deshace la transacción para no dejar la sesión inutilizable
+        try:
+            refresh_task_summaries(self.db, user_story_ids)
+            touch_user_stories(self.db, user_story_ids)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
@@ -0,0 +1,214 @@
+# app/services/transfer_manager.py
+from app.models.user_story import UserStory
+from app.models.task import Task
+from app.schemas.UserStorySchema import UserStorySchema
+from app.schemas.TaskSchema import TaskSchema
+from app.services.cache import invalidate_story
+from app.services.story_index import story_index
+from app.services.search_index import search_index
+from app.services.report_manager import refresh_task_summaries
+from app.services.user_story_manager import story_fingerprint, touch_user_stories
+from app.db import db_session, read_only
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+import csv
+import io
+import orjson
+import os
+
+# Configuración de la importación y exportación masiva
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000")) # Filas leídas del cursor del servidor en cada lote
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000")) # Filas insertadas y confirmadas en cada transacción
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100")) # Errores de validación detallados en el resumen
+
+# Tipos de registro que se pueden importar y exportar: modelo y esquema de validación
+KINDS = {
+    "user-stories": (UserStory, UserStorySchema),
+    "tasks": (Task, TaskSchema),
+}
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def detect_format(filename, default="ndjson"):
+    """Formato de un fichero según su extensión (.csv o .ndjson/.jsonl)."""
+    return "csv" if (filename or "").lower().endswith(".csv") else default
+
+
+class TransferManager:
+    """
+    Importación y exportación masiva de historias de usuario y tareas en NDJSON o CSV.
+    La exportación lee la tabla con un cursor del lado del servidor (yield_per) y emite cada lote en cuanto se
+    lee, de modo que la memoria usada no depende del tamaño de la tabla. La importación valida cada fila con
+    el esquema Pydantic y la inserta en lotes con un executemany, confirmando cada lote por separado.
+    """
+    def __init__(self, db=None):
+        # Por defecto se usa la sesión de la petición en curso (scoped_session)
+        self.db = db if db is not None else db_session
+
+    @staticmethod
+    def _kind(kind):
+        if kind not in KINDS:
+            raise ValueError(f"Tipo no soportado: {kind}. Usa {', '.join(KINDS)}.")
+        return KINDS[kind]
+
+    @read_only
+    def export_records(self, kind, fmt="ndjson", project=None, user_story_id=None, batch_size=None):
+        """
+        Exporta los registros de un tipo como fragmentos de bytes (uno por lote leído).
+        :param kind: 'user-stories' o 'tasks'.
+        :param fmt: 'ndjson' o 'csv' (con cabecera).
+        :param project: Exportar solo las historias (o las tareas de las historias) de un proyecto.
+        :param user_story_id: Exportar solo las tareas de una historia de usuario.
+        :return: Generador de bytes.
+        :rtype: generator
+        """
+        model, schema = self._kind(kind)
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato no soportado: {fmt}. Usa {', '.join(FORMATS)}.")
+        fields = list(schema.model_fields)
+        query = select(*(getattr(model, field) for field in fields)).order_by(model.id)
+        if project:
+            query = query.where(UserStory.project == project)
+            if model is Task:
+                query = query.join(UserStory, Task.user_story_id == UserStory.id)
+        if user_story_id is not None and model is Task:
+            query = query.where(Task.user_story_id == user_story_id)
+        result = self.db.execute(query.execution_options(yield_per=batch_size or EXPORT_BATCH_SIZE))
+        return self._encode(result, fields, fmt)
+
+    @staticmethod
+    def _encode(result, fields, fmt):
+        try:
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(fields)
+                for rows in result.partitions():
+                    writer.writerows(["" if v is None else v.isoformat() if hasattr(v, "isoformat") else v for v in row]
+                                     for row in rows)
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.tell():
+                    yield buffer.getvalue().encode("utf-8")
+            else:
+                for rows in result.partitions():
+                    yield b"".join(orjson.dumps(dict(zip(fields, row))) + b"\n" for row in rows)
+        finally:
+            result.close()
+
+    @staticmethod
+    def read_records(stream, fmt="ndjson"):
+        """
+        Lee registros de un fichero de texto NDJSON o CSV sin cargarlo entero en memoria.
+        En CSV las celdas vacías se interpretan como None.
+        :return: Generador de tuplas (número de línea, diccionario o excepción si la línea no se puede leer).
+        """
+        if fmt == "csv":
+            reader = csv.DictReader(stream)
+            for record in reader:
+                yield reader.line_num, {key: (value if value != "" else None) for key, value in record.items()}
+            return
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                yield line_number, ValueError(f"JSON no válido: {e}")
+                continue
+            yield line_number, record if isinstance(record, dict) else ValueError("Cada línea debe ser un objeto JSON.")
+
+    def import_records(self, kind, stream, fmt="ndjson", batch_size=None, keep_ids=True):
+        """
+        Importa registros validándolos con el esquema Pydantic e insertándolos por lotes.
+        Las filas no válidas se omiten y se informa de ellas en el resumen. Cada lote se confirma en su propia
+        transacción: si un lote falla en la base de datos se deshace ese lote, los anteriores quedan guardados
+        y se relanza la excepción.
+        :param kind: 'user-stories' o 'tasks'.
+        :param stream: Fichero de texto (o iterable de líneas) con los registros.
+        :param fmt: 'ndjson' o 'csv'.
+        :param batch_size: Filas por lote.
+        :param keep_ids: Conservar los IDs del fichero (p. ej. para migrar historias y tareas entre bases de datos).
+        :return: Resumen con las filas importadas, el número de lotes y los errores de validación.
+        :rtype: dict
+        """
+        model, schema = self._kind(kind)
+        batch_size = batch_size or IMPORT_BATCH_SIZE
+        defaults = dict.fromkeys(schema.model_fields)
+        summary = {"imported": 0, "batches": 0, "failed": 0, "errors": []}
+        story_ids = set()
+        batch = []
+
+        def flush():
+            self._insert_batch(model, batch)
+            summary["imported"] += len(batch)
+            summary["batches"] += 1
+            if model is Task:
+                story_ids.update(row["user_story_id"] for row in batch)
+            batch.clear()
+
+        try:
+            for line_number, record in self.read_records(stream, fmt):
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    item = schema.model_validate({**defaults, **record})
+                    batch.append(self._row(model, item, keep_ids))
+                except (ValidationError, ValueError) as e:
+                    summary["failed"] += 1
+                    if len(summary["errors"]) < IMPORT_MAX_ERRORS:
+                        message = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()) \
+                            if isinstance(e, ValidationError) else str(e)
+                        summary["errors"].append({"line": line_number, "error": message})
+                    continue
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        finally:
+            # Las lecturas en caché y los índices de historias similares y de búsqueda no conocen las filas importadas
+            if model is UserStory and summary["imported"]:
+                invalidate_story()
+                story_index.clear()
+                search_index.invalidate_story()
+            for story_id in story_ids:
+                invalidate_story(story_id)
+                search_index.invalidate_story(story_id)
+        return summary
+
+    @staticmethod
+    def _row(model, item, keep_ids):
+        row = item.model_dump(exclude={"id", "created_at"})
+        if model is Task and (not item.title or not item.description):
+            raise ValueError("Todas las tareas deben tener un título y una descripción.")
+        if model is Task and item.user_story_id is None:
+            raise ValueError("Todas las tareas deben pertenecer a una historia de usuario.")
+        if keep_ids and item.id is not None:
+            row["id"] = item.id
+        if item.created_at is not None:
+            row["created_at"] = item.created_at
+        if model is UserStory:
+            row["content_fingerprint"] = story_fingerprint(row)
+        return row
+
+    def _insert_batch(self, model, rows):
+        # executemany necesita las mismas columnas en todas las filas: las que no traen ID o fecha se
+        # insertan aparte para que la base de datos asigne sus valores por defecto. Se usa la tabla (Core)
+        # en lugar del modelo para evitar el coste por fila del bulk insert del ORM
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row), []).append(row)
+        try:
+            for group in groups.values():
+                self.db.execute(insert(model.__table__), group)
+            if model is Task:
+                refresh_task_summaries(self.db, {row["user_story_id"] for row in rows})
+                touch_user_stories(self.db, {row["user_story_id"] for row in rows})
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
@@ -1,11 +1,57 @@
 from app.models.user_story import UserStory
-from app.db import SessionLocal
+from app.models.task import Task
+from app.models.collection_change import CollectionChange
+from app.schemas.UserStorySchema import UserStorySchema
+from app.services.cache import cached, index_key, story_key, invalidate_story, invalidate_stories
+from app.services.story_index import story_index
+from app.services.search_index import search_index
+from app.db import db_session, read_only
+from sqlalchemy import select, insert, update, delete, func, or_, and_
 from sqlalchemy.orm import joinedload
+from collections.abc import Mapping
+from datetime import datetime
+import base64
+import hashlib
+import orjson
+
+# Campos de la historia que forman el prompt de generación de tareas
+FINGERPRINT_FIELDS = ("project", "role", "goal", "reason", "description", "priority", "story_points", "effort_hours")
+
+
+def story_fingerprint(story):
+    """
+    Huella del contenido de una historia de usuario: SHA-256 de los campos que forman el prompt de sus tareas.
+    Si la huella no cambia, volver a generar las tareas daría el mismo resultado.
+    :param story: Historia de usuario (modelo, esquema, diccionario o fila).
+    :return: Huella en hexadecimal (64 caracteres).
+    :rtype: str
+    """
+    values = [story.get(field) if isinstance(story, Mapping) else getattr(story, field, None) for field in FINGERPRINT_FIELDS]
+    # 8 y 8.0 son la misma estimación: los números se normalizan antes de calcular la huella
+    if values[-2] is not None:
+        values[-2] = int(values[-2])
+    if values[-1] is not None:
+        values[-1] = float(values[-1])
+    return hashlib.sha256(orjson.dumps(values)).hexdigest()
+
+
+def touch_user_stories(session, user_story_ids):
+    """
+    Marca como modificadas (updated_at) las historias cuyas tareas han cambiado, en la transacción en curso:
+    la fecha de modificación de una historia incluye la de sus tareas.
+    """
+    user_story_ids = list(user_story_ids)
+    if user_story_ids:
+        session.execute(update(UserStory).where(UserStory.id.in_(user_story_ids)).values(updated_at=func.now())
+                        .execution_options(synchronize_session=False))
+
 
 class UserStoryManager:
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, db=None):
+        # Por defecto se usa la sesión de la petición en curso (scoped_session)
+        self.db = db if db is not None else db_session
 
+    @read_only
     def get_all_user_stories(self):
         return (
         self.db.query(UserStory)
@@ -14,9 +60,107 @@ class UserStoryManager:
         .all()
     )
     
+    def list_user_stories(self, limit=20, cursor=None, project=None, priority=None):
+        """
+        Lista paginada de historias de usuario con el número de tareas de cada una.
+        Usa paginación por clave (created_at, id) en orden descendente, de modo que el coste de cada página
+        no depende de su posición, y calcula el número de tareas con una subconsulta agregada en lugar de
+        cargar las tareas completas. Las páginas se sirven desde la caché de lectura hasta que se modifica
+        alguna historia o tarea.
+        :param limit: Número máximo de historias por página.
+        :param cursor: Cursor opaco devuelto por la página anterior (None para la primera página).
+        :param project: Filtrar por proyecto.
+        :param priority: Filtrar por prioridad.
+        :raises ValueError: Si el cursor no es válido.
+        :return: Tupla (lista de (UserStorySchema, número de tareas), cursor de la página siguiente o None).
+        """
+        return cached(
+            index_key(limit, cursor, project, priority),
+            lambda: self._list_user_stories(limit, cursor, project, priority)
+        )
+
+    @read_only
+    def _list_user_stories(self, limit, cursor, project, priority):
+        task_count = (
+            select(func.count(Task.id))
+            .where(Task.user_story_id == UserStory.id)
+            .correlate(UserStory)
+            .scalar_subquery()
+            .label("task_count")
+        )
+        query = self.db.query(UserStory, task_count)
+        if project:
+            query = query.filter(UserStory.project == project)
+        if priority:
+            query = query.filter(UserStory.priority == priority)
+        if cursor:
+            created_at, last_id = self.decode_cursor(cursor)
+            query = query.filter(or_(
+                UserStory.created_at < created_at,
+                and_(UserStory.created_at == created_at, UserStory.id < last_id)
+            ))
+        rows = [
+            (UserStorySchema.model_validate(story), count)
+            for story, count in query.order_by(UserStory.created_at.desc(), UserStory.id.desc()).limit(limit + 1)
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1][0]
+            next_cursor = self.encode_cursor(last.created_at, last.id)
+        return rows, next_cursor
+
+    @staticmethod
+    def encode_cursor(created_at, user_story_id):
+        """Codifica la posición (created_at, id) de la última historia de una página."""
+        raw = f"{created_at.isoformat()}|{user_story_id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decodifica un cursor de paginación. Lanza ValueError si no es válido."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+            created_at, user_story_id = raw.rsplit("|", 1)
+            return datetime.fromisoformat(created_at), int(user_story_id)
+        except Exception:
+            raise ValueError('Cursor de paginación no válido.')
+
+    @read_only
     def get_user_story_by_id(self, user_story_id):
         return self.db.query(UserStory).options(joinedload(UserStory.tasks)).filter(UserStory.id == user_story_id).first()
 
+    @read_only
+    def get_user_story_detail(self, user_story_id):
+        """Ficha de una historia de usuario (sin tareas) servida desde la caché de lectura."""
+        def load():
+            story = self.db.get(UserStory, user_story_id)
+            return UserStorySchema.model_validate(story) if story else None
+        return cached(story_key(user_story_id), load)
+
+    @read_only
+    def get_user_stories_by_ids(self, user_story_ids):
+        return self.db.query(UserStory).filter(UserStory.id.in_(user_story_ids)).order_by(UserStory.id).all()
+
+    @read_only
+    def get_last_modified(self, user_story_id=None):
+        """
+        Fecha de la última modificación de una historia de usuario (incluidas sus tareas) o, sin ID, de
+        cualquier historia o tarea, incluidos los borrados de historias. Es una consulta por índice, para
+        responder a If-Modified-Since sin cargar los datos.
+        :return: Fecha, o None si la historia no existe (o no hay ninguna).
+        """
+        if user_story_id is not None:
+            return self.db.scalar(select(UserStory.updated_at).where(UserStory.id == user_story_id))
+        dates = [self.db.scalar(select(func.max(UserStory.updated_at))),
+                 self.db.scalar(select(CollectionChange.changed_at).where(CollectionChange.name == UserStory.__tablename__))]
+        dates = [date for date in dates if date is not None]
+        return max(dates) if dates else None
+
+    @read_only
+    def get_user_stories_by_project(self, project):
+        return self.db.query(UserStory).filter(UserStory.project == project).order_by(UserStory.id).all()
+
     def create_user_story(self, project, role, goal, reason, description, priority, story_points, effort_hours):
         new_story = UserStory(
             project=project,
@@ -28,19 +172,106 @@ class UserStoryManager:
             story_points=story_points,
             effort_hours=effort_hours
         )
+        new_story.content_fingerprint = story_fingerprint(new_story)
         self.db.add(new_story)
-        self.db.commit()
+        self._commit()
+        invalidate_story()
         self.db.refresh(new_story)
+        story_index.add(new_story.id, new_story.goal, new_story.description)
+        search_index.invalidate_story(new_story.id)
         return new_story
 
+    def update_user_story(self, user_story_id, **fields):
+        """
+        Modifica los campos de una historia de usuario y recalcula la huella de su contenido. Las tareas no se
+        tocan: la siguiente generación incremental detecta el cambio y actualiza solo las diferencias.
+        :param fields: Campos a modificar (los de FINGERPRINT_FIELDS).
+        :raises ValueError: Si se indica un campo que no se puede modificar.
+        :return: Historia modificada, o None si no existe.
+        """
+        unknown = set(fields) - set(FINGERPRINT_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos no modificables: {', '.join(sorted(unknown))}.")
+        story = self.db.get(UserStory, user_story_id)
+        if story is None:
+            return None
+        for field, value in fields.items():
+            setattr(story, field, value)
+        story.content_fingerprint = story_fingerprint(story)
+        self._commit()
+        invalidate_story(user_story_id)
+        story_index.remove(user_story_id)
+        story_index.add(story.id, story.goal, story.description)
+        search_index.invalidate_story(user_story_id)
+        return story
+
     def close(self):
         self.db.close()
     
     def delete_user_story(self, user_story_id):
-        user_story = self.get_user_story_by_id(user_story_id)
-        if user_story:
-            self.db.delete(user_story)
+        return bool(self.delete_user_stories(user_story_ids=[user_story_id]))
+
+    def delete_user_stories(self, user_story_ids=None, project=None):
+        """
+        Elimina varias historias de usuario (por ID, un proyecto completo o ambos filtros) y sus tareas en una
+        única transacción, con sentencias DELETE por conjuntos y sin cargar ninguna fila en la sesión.
+        Las tareas las borra la base de datos (ON DELETE CASCADE); en SQLite se borran además con un único
+        DELETE ... WHERE user_story_id IN (...) porque las bases de datos creadas antes de la migración 3
+        no tienen la cascada (SQLite no permite añadirla a una tabla existente).
+        :param user_story_ids: IDs de las historias a eliminar.
+        :param project: Proyecto cuyas historias se eliminan.
+        :raises ValueError: Si no se indica ningún filtro.
+        :return: IDs de las historias eliminadas.
+        :rtype: list
+        """
+        conditions = []
+        if user_story_ids is not None:
+            conditions.append(UserStory.id.in_(list(user_story_ids)))
+        if project:
+            conditions.append(UserStory.project == project)
+        if not conditions:
+            raise ValueError('Indica los IDs de las historias de usuario o un proyecto.')
+        condition = and_(*conditions)
+        dialect = self.db.get_bind().dialect
+        statement = delete(UserStory).where(condition).execution_options(synchronize_session=False)
+        try:
+            if dialect.name == "sqlite":
+                self.db.execute(
+                    delete(Task)
+                    .where(Task.user_story_id.in_(select(UserStory.id).where(condition)))
+                    .execution_options(synchronize_session=False)
+                )
+            if dialect.delete_returning:
+                deleted = list(self.db.scalars(statement.returning(UserStory.id)))
+            else:
+                deleted = list(self.db.scalars(select(UserStory.id).where(condition)))
+                self.db.execute(statement)
+            if deleted:
+                self._record_deletion()
             self.db.commit()
-            return True
-        return False
+        except Exception:
+            self.db.rollback()
+            raise
+        if deleted:
+            invalidate_stories(deleted)
+            for user_story_id in deleted:
+                story_index.remove(user_story_id)
+                search_index.invalidate_story(user_story_id)
+        return deleted
+
+    def _record_deletion(self):
+        # Las historias borradas no dejan fila de la que leer la fecha: el listado la toma de collection_changes
+        changed = {"changed_at": func.now()}
+        name = UserStory.__tablename__
+        if not self.db.execute(update(CollectionChange).where(CollectionChange.name == name).values(**changed)).rowcount:
+            self.db.execute(insert(CollectionChange).values(name=name, **changed))
+
+    def _commit(self):
+        # Si el commit falla se deshace la transacción para no dejar la sesión inutilizable
+        try:
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
 
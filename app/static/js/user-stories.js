@@ -0,0 +1,97 @@
+// app/static/js/user-stories.js
+// Historias parecidas al prompt (respuesta 409): se enlazan y el siguiente envío genera una nueva igualmente
+function showSimilar(form, status, data) {
+    status.textContent = data.error + ' ';
+    data.similar.forEach(function (story) {
+        var link = document.createElement('a');
+        link.href = story.url;
+        link.textContent = story.project + ': ' + story.goal;
+        status.appendChild(link);
+        status.appendChild(document.createTextNode(' '));
+    });
+    status.appendChild(document.createTextNode('Vuelve a enviar para generar una nueva.'));
+    form.querySelector('input[name=force]').value = '1';
+}
+
+// Generación en segundo plano: se encola el trabajo y se consulta su estado hasta que termina.
+// Sin JavaScript los formularios siguen funcionando con la generación síncrona.
+document.querySelectorAll('form.js-generation-job').forEach(function (form) {
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        var button = form.querySelector('button[type=submit]');
+        var status = form.querySelector('.js-job-status');
+        button.disabled = true;
+        if (status) { status.textContent = 'Generando...'; }
+        fetch(form.dataset.jobUrl, { method: 'POST', body: new FormData(form) })
+            .then(function (response) { return response.json(); })
+            .then(function (job) {
+                if (job.similar && status) { button.disabled = false; return showSimilar(form, status, job); }
+                if (!job.status_url) { throw new Error(job.error || 'Error al encolar la generación.'); }
+                var poll = function () {
+                    fetch(job.status_url).then(function (r) { return r.json(); }).then(function (current) {
+                        if (current.status === 'completado') {
+                            window.location = form.dataset.doneUrl || window.location.href;
+                        } else if (current.status === 'fallido') {
+                            throw new Error(current.error);
+                        } else {
+                            setTimeout(poll, 1000);
+                        }
+                    }).catch(fail);
+                };
+                poll();
+            })
+            .catch(fail);
+
+        function fail(error) {
+            button.disabled = false;
+            if (status) { status.textContent = error.message; } else { alert(error.message); }
+        }
+    });
+});
+
+// Generación en vivo: el texto de la historia se muestra a medida que llegan los tokens (Server-Sent Events)
+document.querySelectorAll('form .js-stream').forEach(function (button) {
+    button.addEventListener('click', function () {
+        var form = button.closest('form');
+        var status = form.querySelector('.js-job-status');
+        var output = form.querySelector('.js-stream-output');
+        button.disabled = true;
+        output.textContent = '';
+        status.textContent = 'Generando...';
+        fetch(form.dataset.streamUrl, { method: 'POST', body: new FormData(form) }).then(function (response) {
+            if (!response.ok) {
+                return response.json().then(function (data) {
+                    if (data.similar) { button.disabled = false; return showSimilar(form, status, data); }
+                    throw new Error(data.error);
+                });
+            }
+            var reader = response.body.getReader();
+            var decoder = new TextDecoder();
+            var buffer = '';
+            function pump() {
+                return reader.read().then(function (result) {
+                    if (result.done) { return; }
+                    buffer += decoder.decode(result.value, { stream: true });
+                    var chunks = buffer.split('\n\n');
+                    buffer = chunks.pop();
+                    chunks.forEach(function (chunk) {
+                        var event = chunk.match(/^event: (.*)$/m)[1];
+                        var data = JSON.parse(chunk.match(/^data: (.*)$/m)[1]);
+                        if (event === 'delta') {
+                            output.textContent += data.text;
+                        } else if (event === 'story') {
+                            window.location.reload();
+                        } else if (event === 'error') {
+                            throw new Error(data.error);
+                        }
+                    });
+                    return pump();
+                });
+            }
+            return pump();
+        }).catch(function (error) {
+            status.textContent = error.message;
+            button.disabled = false;
+        });
+    });
+});
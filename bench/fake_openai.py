@@ -0,0 +1,232 @@
+# bench/fake_openai.py
+"""
+Servidor HTTP local compatible con la API de chat completions de Azure OpenAI.
+Devuelve historias de usuario y tareas sintéticas con latencia configurable e inyección de fallos,
+de forma que las pruebas de carga no dependen de Azure ni consumen cuota.
+
+Uso independiente:
+    python -m bench.fake_openai --port 8089 --latency 0.2 --failure-rate 0.05
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+
+PRIORITIES = ["baja", "media", "alta", "bloqueante"]
+CATEGORIES = ["Desarrollo", "Pruebas", "Documentación"]
+
+
+def fake_user_story(n):
+    """Historia de usuario sintética con la forma de UserStorySchema."""
+    return {
+        "id": None,
+        "project": f"Proyecto {n % 10}",
+        "role": "Como usuario",
+        "goal": f"Quiero poder completar la acción {n}",
+        "reason": "Para ahorrar tiempo en el día a día",
+        "description": "Historia de usuario generada por el servidor de pruebas de rendimiento.",
+        "priority": PRIORITIES[n % len(PRIORITIES)],
+        "story_points": 1 + n % 8,
+        "effort_hours": float(2 + n % 16),
+        "created_at": None,
+    }
+
+
+def fake_tasks(n, count=5):
+    """Lista de tareas sintéticas con la forma de TaskSchemas."""
+    return {"tasks": [{
+        "id": None,
+        "title": f"Tarea {i + 1} de la petición {n}",
+        "description": "Tarea generada por el servidor de pruebas de rendimiento.",
+        "priority": PRIORITIES[i % len(PRIORITIES)],
+        "effort_hours": float(1 + i),
+        "status": "pendiente",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "risk_analysis": "Sin riesgos relevantes.",
+        "risk_mitigation": "No aplica.",
+        "assigned_to": None,
+        "user_story_id": None,
+        "created_at": None,
+    } for i in range(count)]}
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    Servidor de chat completions falso.
+    :param latency: Segundos de espera antes de responder (se suma un jitter aleatorio de hasta jitter segundos).
+    :param failure_rate: Proporción de peticiones que fallan (0.0 - 1.0).
+    :param failure_status: Código HTTP de las respuestas fallidas (429 incluye la cabecera Retry-After).
+    :param fail_first: Número de peticiones iniciales que fallan siempre (además de failure_rate).
+    :param retry_after: Segundos indicados en Retry-After / retry-after-ms en los fallos 429.
+    :param tasks_per_story: Número de tareas devueltas en cada generación de tareas.
+    :param chunk_size: Caracteres por fragmento en las respuestas en streaming.
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 failure_status=500, tasks_per_story=5, chunk_size=16, seed=None, fail_first=0, retry_after=1.0):
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.tasks_per_story = tasks_per_story
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0, "streams": 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_id(self):
+        return next(self._counter)
+
+    def record(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def should_fail(self):
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+            return self.random.random() < self.failure_rate
+
+    def delay(self):
+        with self._lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+        return self.latency + extra
+
+    def handle_error(self, request, client_address):
+        # El cliente cerró la conexión (p. ej. por timeout) antes de recibir la respuesta
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self):
+        """Arranca el servidor en un hilo en segundo plano y lo devuelve."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass # Sin log por petición para no distorsionar las mediciones
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "Ruta no soportada", "type": "not_found"}})
+        server.record("requests")
+        request = json.loads(body or b"{}")
+        time.sleep(server.delay())
+        if server.should_fail():
+            server.record("failures")
+            headers = {}
+            if server.failure_status == 429:
+                headers = {"Retry-After": str(max(1, round(server.retry_after))),
+                           "retry-after-ms": str(int(server.retry_after * 1000))}
+            return self._send_json(server.failure_status, {"error": {"message": "Fallo inyectado", "type": "server_error"}}, headers)
+
+        n = server.next_id()
+        schema = ((request.get("response_format") or {}).get("json_schema") or {}).get("name", "")
+        payload = fake_tasks(n, server.tasks_per_story) if schema == "TaskSchemas" else fake_user_story(n)
+        content = json.dumps(payload, ensure_ascii=False)
+        completion_id = f"chatcmpl-fake-{n}"
+        # Estimación aproximada de tokens (unos 4 caracteres por token)
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in request.get("messages") or []) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        model = request.get("model") or "fake"
+        if request.get("stream"):
+            server.record("streams")
+            return self._send_stream(completion_id, model, content)
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion_id, model, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        size = self.server.chunk_size
+        chunks = [{"role": "assistant", "content": ""}] + [{"content": content[i:i + size]} for i in range(0, len(content), size)]
+        for i, delta in enumerate(chunks + [{}]):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if i < len(chunks) else "stop"}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local compatible con Azure OpenAI para pruebas de carga")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de latencia por respuesta")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latencia aleatoria adicional máxima en segundos")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Proporción de respuestas fallidas (0-1)")
+    parser.add_argument("--failure-status", type=int, default=500, help="Código HTTP de los fallos inyectados")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Segundos de Retry-After en los fallos 429")
+    parser.add_argument("--tasks", type=int, default=5, help="Tareas devueltas por generación")
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                              failure_rate=args.failure_rate, failure_status=args.failure_status,
+                              retry_after=args.retry_after, tasks_per_story=args.tasks)
+    print(f"Servidor falso de Azure OpenAI escuchando en {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench/startup.py
+"""
+Mide el tiempo de arranque de la aplicación: importar run.py y atender la primera petición.
+Cada medición se hace en un proceso nuevo (importaciones en frío) contra un SQLite temporal ya migrado.
+
+Uso:
+    python -m bench.startup --runs 10
+    python -m bench.startup --root /ruta/a/otra/copia   # comparar con otra versión del código
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Se ejecuta en un proceso hijo con el directorio del proyecto como cwd
+PROBE = """
+import json, time
+start = time.perf_counter()
+from run import app
+imported = time.perf_counter()
+response = app.test_client().get("/api/v1/user-stories")
+first_request = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import": imported - start, "first_request": first_request - imported,
+                  "total": first_request - start}))
+"""
+
+
+def _env(database_url):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "AZURE_OPENAI_KEY": "bench",
+        "AZURE_OPENAI_ENDPOINT": "http://127.0.0.1:9",
+        "AZURE_OPENAI_API_VERSION": "2024-08-01-preview",
+        "AZURE_OPENAI_DEPLOYMENT": "bench",
+        "LLM_CACHE_PATH": ":memory:",
+        "PYTHONPATH": ".",
+    })
+    return env
+
+
+def measure(root=ROOT, runs=5):
+    """
+    Lanza runs procesos y devuelve la mediana de cada tiempo en milisegundos.
+    :param root: Directorio del proyecto que se mide.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = _env(f"sqlite:///{os.path.join(tmpdir, 'startup.sqlite3')}")
+    subprocess.run([sys.executable, "create_tables.py"], cwd=root, env=env, check=True, capture_output=True)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=root, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {name: round(statistics.median(s[name] for s in samples) * 1000, 1) for name in samples[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de importación y de la primera petición")
+    parser.add_argument("--root", default=ROOT, help="Directorio del proyecto a medir")
+    parser.add_argument("--runs", type=int, default=5, help="Procesos lanzados (se informa de la mediana)")
+    args = parser.parse_args(argv)
+    result = measure(os.path.abspath(args.root), args.runs)
+    print(json.dumps({"root": os.path.abspath(args.root), "runs": args.runs, "median_ms": result}, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # create_tables.py
-from app.db import engine, Base
-from app.models.user_story import UserStory
-from app.models.task import Task
+from app.migrations import upgrade
 
-Base.metadata.create_all(bind=engine)
-print("Tablas creadas exitosamente.")
\ No newline at end of file
+# Crea las tablas en una base de datos nueva y aplica las migraciones pendientes en una existente
+applied = upgrade()
+print(f"Migraciones aplicadas: {applied}" if applied else "El esquema ya está actualizado.")
+print("Tablas creadas exitosamente.")
@@ -0,0 +1,49 @@
+# gunicorn.conf.py
+# Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py run:app
+import multiprocessing
+import os
+
+# Dirección de escucha
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Procesos y hilos: gthread permite atender varias peticiones por proceso mientras otras esperan al modelo
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Cargar la aplicación en el proceso maestro antes del fork (menos memoria y arranque más rápido)
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# Tiempos: la generación con IA puede tardar, timeout debe superar la latencia máxima del modelo
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30")) # Margen para terminar peticiones al parar
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Reciclar workers periódicamente para acotar el crecimiento de memoria
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    # Se comprueba el esquema una sola vez, en el proceso maestro
+    from app.migrations import report_schema_drift
+    report_schema_drift()
+
+
+def post_fork(server, worker):
+    # Cada worker abre sus propias conexiones a la base de datos y a Azure OpenAI
+    # (app.registry también lo hace con os.register_at_fork)
+    from app import registry
+    registry.after_fork()
+
+
+def worker_exit(server, worker):
+    # Parada ordenada: esperar a que terminen las generaciones en segundo plano y cerrar las conexiones
+    from app.services.job_queue import job_queue
+    from app import registry
+    job_queue.shutdown(wait=True)
+    registry.dispose_all()
@@ -1,15 +1,11 @@
 # run.py
-from flask import Flask
-from app.routes.routes import routes
-import os
+from app import create_app
+from app.migrations import report_schema_drift
 
-app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), "app", "templates"))
-app.secret_key = os.getenv("APP_SECRET_KEY", "default")
-app.register_blueprint(routes)
-
-@app.route("/")
-def hello():
-    return "¡Hola, soy Miguel, bienvenido a mi app!"
+# Aplicación WSGI: gunicorn la sirve con "gunicorn -c gunicorn.conf.py run:app"
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
+    # Servidor de desarrollo (un único proceso); en producción usar gunicorn
+    report_schema_drift() # Avisar si el esquema no coincide con los modelos
+    app.run(host="0.0.0.0", port=5000, debug=False)
@@ -1,5 +1,6 @@
 import sys
 import os
+import time
 from unittest.mock import patch
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -10,6 +11,7 @@ os.environ["AZURE_OPENAI_ENDPOINT"] = "dummy"
 os.environ["AZURE_OPENAI_API_VERSION"] = "dummy"
 os.environ["AZURE_OPENAI_DEPLOYMENT"] = "dummy"
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["LLM_CACHE_PATH"] = ":memory:"
 
 # Mock de la respuesta de OpenAI
 # Esta función simula la respuesta de OpenAI para evitar llamadas reales a la API
@@ -58,15 +60,15 @@ class MockAzureOpenAI:
     def __init__(self, *args, **kwargs):
         self.chat = MockChat()
         self.beta = MockBeta()
-# Mock para reemplazar la clase AzureOpenAI en el código
-# Esto es necesario porque la clase AzureOpenAI no se puede instanciar directamente
-with patch("openai.AzureOpenAI", MockAzureOpenAI):
-    from run import app
-    app.config['TESTING'] = True
-    app.config['DEBUG'] = True
-    with app.app_context():
-        from app.db import Base, engine
-        Base.metadata.create_all(bind=engine)
+# El cliente de Azure OpenAI se crea en el primer uso: basta con sustituirlo por el mock en el registro
+from run import app
+from app.services.llm_client import openai_client
+openai_client.set(MockAzureOpenAI())
+app.config['TESTING'] = True
+app.config['DEBUG'] = True
+with app.app_context():
+    from app.db import Base, engine
+    Base.metadata.create_all(bind=engine)
 
 
 def test_root():
@@ -133,4 +135,1219 @@ def test_add_task_to_user_story():
     }
     response = tester.post('/user-stories/1/tasks', data=data, follow_redirects=True)
     assert response.status_code == 200
-    assert b"tarea" in response.data.lower()
\ No newline at end of file
+    assert b"tarea" in response.data.lower()
+
+def test_db_pool_status():
+    """Test para las métricas del pool de conexiones"""
+    tester = app.test_client()
+    tester.get('/user-stories')
+    response = tester.get('/db/pool')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["checkouts"] >= 1
+    assert "wait_avg_seconds" in data
+
+def test_session_released_after_request():
+    """Test para comprobar que la sesión de la petición se libera en el teardown"""
+    from app.db import db_session
+    tester = app.test_client()
+    tester.get('/user-stories')
+    assert not db_session.registry.has()
+
+def test_enqueue_user_story_job():
+    """Test para encolar la generación de una historia de usuario y consultar su estado"""
+    from app.services.job_queue import job_queue
+    tester = app.test_client()
+    with patch.object(job_queue, "max_workers", 0):
+        response = tester.post('/jobs/user-stories', data={'prompt': 'Como usuario quiero...'})
+    assert response.status_code == 202
+    job = response.get_json()
+    status = tester.get(job["status_url"]).get_json()
+    assert status["status"] == "completado"
+    assert status["result"]["user_story_id"] == status["user_story_id"]
+
+def test_enqueue_user_story_job_empty_prompt():
+    """Test para encolar una generación sin prompt"""
+    tester = app.test_client()
+    response = tester.post('/jobs/user-stories', data={'prompt': ''})
+    assert response.status_code == 400
+
+def test_job_queue_runs_in_background_thread():
+    """Test para ejecutar un trabajo en el pool de hilos y registrar su fallo"""
+    from app.services.job_queue import JobQueue
+    from app.services.job_manager import JobManager
+    with app.app_context():
+        job_id = JobManager().create_job('tasks', user_story_id=999).id
+    queue = JobQueue(max_workers=1)
+    def failing_job():
+        raise ValueError("fallo simulado")
+    queue.submit(job_id, failing_job).result(timeout=5)
+    queue.shutdown()
+    with app.app_context():
+        job = JobManager().get_job(job_id)
+        assert job.status == "fallido"
+        assert job.error == "fallo simulado"
+
+def test_job_not_found():
+    """Test para consultar un trabajo inexistente"""
+    tester = app.test_client()
+    response = tester.get('/jobs/no-existe')
+    assert response.status_code == 404
+
+def create_story(project="Proyecto Demo", **fields):
+    """Crea una historia de usuario directamente en la base de datos"""
+    from app.services.user_story_manager import UserStoryManager
+    data = dict(project=project, role="Usuario", goal="Hacer algo", reason="Para lograr un objetivo",
+                description="Descripción de la historia", priority="alta", story_points=5, effort_hours=8)
+    data.update(fields)
+    with app.app_context():
+        story = UserStoryManager().create_user_story(**data)
+        story_id = story.id
+        story = UserStoryManager().get_user_story_by_id(story_id)
+    return story
+
+def make_task_schemas(*titles):
+    """Construye un TaskSchemas válido con las tareas indicadas"""
+    from app.schemas.TaskSchemas import TaskSchemas
+    return TaskSchemas(tasks=[{
+        "id": None, "title": title, "description": f"Descripción de {title}", "priority": "media",
+        "effort_hours": 2.0, "status": "pendiente", "category": "Desarrollo", "risk_analysis": None,
+        "risk_mitigation": None, "assigned_to": None, "user_story_id": None, "created_at": None,
+    } for title in titles])
+
+def test_batch_task_generation_runs_concurrently():
+    """Test para generar tareas de varias historias en paralelo"""
+    import time
+    tester = app.test_client()
+    story_ids = [create_story().id for _ in range(3)]
+
+    def slow_generate(user_story, timeout=None, use_cache=True):
+        time.sleep(0.3)
+        return make_task_schemas("Tarea A", "Tarea B")
+
+    with patch("app.services.generation.generate_tasks", side_effect=slow_generate):
+        start = time.perf_counter()
+        response = tester.post('/user-stories/tasks/batch', json={'story_ids': story_ids + [9999], 'concurrency': 3})
+        elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    results = {r["user_story_id"]: r for r in response.get_json()["results"]}
+    assert all(results[story_id]["status"] == "ok" and len(results[story_id]["task_ids"]) == 2 for story_id in story_ids)
+    assert results[9999]["status"] == "error"
+    assert elapsed < 0.8
+
+def test_batch_task_generation_requires_stories():
+    """Test para la generación por lotes sin historias ni proyecto"""
+    tester = app.test_client()
+    response = tester.post('/user-stories/tasks/batch', json={})
+    assert response.status_code == 400
+
+def test_llm_cache_skips_repeated_calls():
+    """Test para comprobar que un prompt repetido se resuelve desde la caché"""
+    from app.services import generation
+    from app.services.llm_cache import llm_cache
+    from app.schemas.TaskSchemas import TaskSchemas
+
+    class Completion:
+        def __init__(self, parsed):
+            self.choices = [type("Choice", (), {"message": type("Message", (), {"parsed": parsed})()})()]
+
+    story = create_story(description="Historia para la caché")
+    calls = []
+    def parse(*args, **kwargs):
+        calls.append(kwargs)
+        return Completion(make_task_schemas("Tarea cacheada"))
+
+    with patch.object(generation.client.beta.chat.completions, "parse", side_effect=parse):
+        first = generation.generate_tasks(story)
+        hits = llm_cache.stats()["hits"]
+        second = generation.generate_tasks(story)
+        generation.generate_tasks(story, use_cache=False)
+    assert len(calls) == 2
+    assert isinstance(second, TaskSchemas)
+    assert second == first
+    assert llm_cache.stats()["hits"] == hits + 1
+
+def test_llm_cache_lru_and_ttl():
+    """Test para la expulsión LRU y la caducidad de la caché"""
+    from app.services.llm_cache import LLMResponseCache
+    from app.schemas.TaskSchemas import TaskSchemas
+    cache = LLMResponseCache(path=":memory:", ttl=3600, max_entries=2, enabled=True)
+    keys = [cache.make_key("dep", "sys", f"prompt {i}", TaskSchemas) for i in range(3)]
+    cache.set(keys[0], make_task_schemas("A"))
+    cache.set(keys[1], make_task_schemas("B"))
+    assert cache.get(keys[0], TaskSchemas) is not None # keys[0] pasa a ser la más reciente
+    cache.set(keys[2], make_task_schemas("C"))
+    assert cache.get(keys[1], TaskSchemas) is None
+    assert cache.get(keys[0], TaskSchemas).tasks[0].title == "A"
+    assert cache.stats()["evictions"] == 1
+    cache.ttl = -1
+    assert cache.get(keys[2], TaskSchemas) is None
+
+def test_bulk_create_tasks_single_statement():
+    """Test para la creación de tareas en bloque con un único INSERT"""
+    from sqlalchemy import event
+    from app.db import engine
+    from app.services.task_manager import TaskManager
+    story = create_story()
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        with app.app_context():
+            created = TaskManager().create_tasks(make_task_schemas("T1", "T2", "T3"), user_story_id=story.id)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert [task.title for task in created] == ["T1", "T2", "T3"]
+    assert all(task.id and task.created_at for task in created)
+    assert len([s for s in statements if s.lstrip().upper().startswith("INSERT INTO TASKS ")]) == 1
+    assert not [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+
+def test_bulk_create_tasks_all_or_nothing():
+    """Test para comprobar que un lote con una tarea inválida no guarda ninguna"""
+    from app.services.task_manager import TaskManager
+    story = create_story()
+    tasks = make_task_schemas("Válida", "Inválida")
+    tasks.tasks[1].description = ""
+    with app.app_context():
+        try:
+            TaskManager().create_tasks(tasks, user_story_id=story.id)
+            assert False, "Se esperaba ValueError"
+        except ValueError:
+            pass
+        assert TaskManager().get_tasks_by_user_story(story.id) == []
+
+def test_user_stories_keyset_pagination():
+    """Test para la paginación por clave y los filtros del listado de historias"""
+    from app.services.user_story_manager import UserStoryManager
+    from app.services.task_manager import TaskManager
+    ids = [create_story(project="Paginación", priority="media").id for _ in range(5)]
+    create_story(project="Paginación", priority="baja")
+    with app.app_context():
+        manager = UserStoryManager()
+        TaskManager().create_tasks(make_task_schemas("T1", "T2"), user_story_id=ids[-1])
+        seen, cursor = [], None
+        while True:
+            rows, cursor = manager.list_user_stories(limit=2, cursor=cursor, project="Paginación", priority="media")
+            seen.extend((story.id, task_count) for story, task_count in rows)
+            if cursor is None:
+                break
+    assert [story_id for story_id, _ in seen] == sorted(ids, reverse=True)
+    assert dict(seen)[ids[-1]] == 2
+
+def test_user_stories_list_filters_and_invalid_cursor():
+    """Test para el listado filtrado y un cursor no válido"""
+    tester = app.test_client()
+    create_story(project="Filtro Único")
+    response = tester.get('/user-stories?project=Filtro+%C3%9Anico&limit=1')
+    assert response.status_code == 200
+    assert "Filtro Único".encode() in response.data
+    response = tester.get('/user-stories?cursor=no-valido', follow_redirects=True)
+    assert response.status_code == 200
+    assert "Cursor de paginación no válido".encode() in response.data
+
+def test_migrations_upgrade_fresh_database():
+    """Test para aplicar las migraciones sobre una base de datos nueva"""
+    from sqlalchemy import create_engine
+    from app import migrations
+    engine = create_engine("sqlite://")
+    assert migrations.check_schema(engine)
+    assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.check_schema(engine) == []
+    assert migrations.upgrade(engine) == []
+
+def test_migrations_add_indexes_to_existing_tables():
+    """Test para detectar y corregir índices que faltan en tablas existentes"""
+    from sqlalchemy import create_engine, text, inspect
+    from app import migrations
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE user_stories (id INTEGER PRIMARY KEY, project VARCHAR(100), role VARCHAR(100), goal VARCHAR(255), reason VARCHAR(255), description TEXT, priority VARCHAR(10), story_points INTEGER, effort_hours FLOAT, created_at DATETIME)"))
+        connection.execute(text("CREATE INDEX ix_user_stories_id ON user_stories (id)"))
+        connection.execute(text("CREATE INDEX ix_user_stories_project ON user_stories (project)"))
+        connection.execute(text("CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR(255), description TEXT, priority VARCHAR(10), effort_hours FLOAT, status VARCHAR(11), assigned_to VARCHAR(100), category VARCHAR(100), risk_analysis TEXT, risk_mitigation TEXT, user_story_id INTEGER REFERENCES user_stories(id), created_at DATETIME)"))
+        connection.execute(text("CREATE INDEX ix_tasks_id ON tasks (id)"))
+        connection.execute(text("INSERT INTO user_stories (id, project, role, goal, reason, story_points, effort_hours) VALUES (1, 'P', 'Usuario', 'Quiero algo', 'Para algo', 3, 8), (2, 'P', 'Usuario', 'Quiero otra cosa', 'Para algo', 3, 8)"))
+        connection.execute(text("INSERT INTO tasks (title, description, user_story_id) VALUES ('Tarea', 'Descripción', 1)"))
+    problems = migrations.check_schema(engine)
+    assert "Falta el índice ix_tasks_user_story_id en tasks" in problems
+    migrations.upgrade(engine)
+    assert migrations.check_schema(engine) == []
+    indexes = {index["name"] for index in inspect(engine).get_indexes("user_stories")}
+    assert "ix_user_stories_project_created_at" in indexes
+    assert "ix_user_stories_project" not in indexes
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT content_fingerprint, tasks_fingerprint FROM user_stories ORDER BY id")).all()
+    assert rows[0][0] == rows[0][1] and rows[1][0] and rows[1][1] is None
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM user_stories WHERE updated_at IS NULL")).scalar() == 0
+        assert connection.execute(text("SELECT COUNT(*) FROM tasks WHERE updated_at IS NULL")).scalar() == 0
+
+class FakeStream:
+    """Simula el stream de chat completions con salida estructurada"""
+    def __init__(self, parsed, partials):
+        self.parsed = parsed
+        self.events = [type("Event", (), {"type": "content.delta", "delta": "{", "parsed": partial})() for partial in partials]
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
+    def __iter__(self):
+        return iter(self.events)
+    def get_final_completion(self):
+        message = type("Message", (), {"parsed": self.parsed})()
+        return type("Completion", (), {"choices": [type("Choice", (), {"message": message})()]})()
+
+def test_stream_tasks_sse():
+    """Test para generar tareas en streaming mediante Server-Sent Events"""
+    from app.services import generation
+    from app.services.llm_cache import llm_cache
+    llm_cache.clear()
+    story = create_story(description="Historia en streaming")
+    final = make_task_schemas("Primera", "Segunda")
+    first = final.tasks[0].model_dump(mode="json")
+    partials = [{"tasks": [{"title": "Pri"}]}, {"tasks": [first, {"title": "Seg"}]}]
+    tester = app.test_client()
+    with patch.object(generation.client.beta.chat.completions, "stream", create=True, return_value=FakeStream(final, partials)):
+        response = tester.post(f'/user-stories/{story.id}/tasks/stream')
+        body = response.get_data(as_text=True)
+    assert response.mimetype == "text/event-stream"
+    events = [chunk.split("\n")[0] for chunk in body.strip().split("\n\n")]
+    assert events == ["event: task", "event: task", "event: done"]
+    assert '"title": "Primera"' in body and '"title": "Segunda"' in body
+    with app.app_context():
+        from app.services.task_manager import TaskManager
+        assert [task.title for task in TaskManager().get_tasks_by_user_story(story.id)] == ["Primera", "Segunda"]
+
+def test_stream_user_story_sse_error():
+    """Test para informar de un error de generación en el stream"""
+    from app.services import generation
+    tester = app.test_client()
+    with patch.object(generation.client.beta.chat.completions, "stream", create=True, side_effect=RuntimeError("sin conexión")):
+        response = tester.post('/user-stories/stream', data={'prompt': 'Un prompt nuevo para el stream'})
+        body = response.get_data(as_text=True)
+    assert "event: error" in body
+    assert "sin conexión" in body
+
+def age_modification_dates():
+    """Lleva la fecha de modificación de todas las filas al pasado (las fechas tienen resolución de segundos)"""
+    from sqlalchemy import text
+    with app.app_context():
+        from app.db import engine
+        with engine.begin() as connection:
+            for table, column in (("user_stories", "updated_at"), ("tasks", "updated_at"), ("collection_changes", "changed_at")):
+                connection.execute(text(f"UPDATE {table} SET {column} = '2020-01-01 00:00:00'"))
+    return "Wed, 01 Jan 2020 00:00:00 GMT"
+
+def test_api_user_story_crud_and_conditional_get():
+    """Test para la API JSON de historias de usuario con ETag y Last-Modified"""
+    tester = app.test_client()
+    response = tester.post('/api/v1/user-stories', json={"project": "API", "role": "Usuario", "goal": "Usar la API", "reason": "Integraciones", "priority": "media"})
+    assert response.status_code == 201
+    story = response.get_json()
+    assert story["id"] and story["description"] is None
+
+    response = tester.get(f'/api/v1/user-stories/{story["id"]}')
+    assert response.status_code == 200
+    assert response.get_json()["tasks"] == []
+    etag = response.headers["ETag"]
+    # Modificada en el segundo en curso: todavía no se envía Last-Modified
+    assert "Last-Modified" not in response.headers
+    response = tester.get(f'/api/v1/user-stories/{story["id"]}', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = tester.get('/api/v1/user-stories?project=API')
+    assert [s["id"] for s in response.get_json()["user_stories"]] == [story["id"]]
+
+    last_modified = age_modification_dates()
+    response = tester.get(f'/api/v1/user-stories/{story["id"]}')
+    assert response.headers["Last-Modified"] == last_modified
+    # If-Modified-Since se resuelve con la fecha de modificación, sin cargar la historia ni el listado
+    from app.routes import api
+    with patch.object(api.user_story_manager, "get_user_story_detail", side_effect=AssertionError), \
+            patch.object(api.user_story_manager, "list_user_stories", side_effect=AssertionError):
+        response = tester.get(f'/api/v1/user-stories/{story["id"]}', headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+        assert tester.get('/api/v1/user-stories?project=API', headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    assert tester.patch(f'/api/v1/user-stories/{story["id"]}', json={"priority": "alta"}).status_code == 200
+    response = tester.get(f'/api/v1/user-stories/{story["id"]}', headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    assert response.get_json()["priority"] == "alta"
+
+    age_modification_dates()
+    assert tester.delete(f'/api/v1/user-stories/{story["id"]}').status_code == 204
+    assert tester.get(f'/api/v1/user-stories/{story["id"]}').status_code == 404
+    # El borrado no deja fila, pero cambia la fecha del listado
+    response = tester.get('/api/v1/user-stories?project=API', headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 200
+    assert response.get_json()["user_stories"] == []
+
+def test_api_tasks_create_get_delete():
+    """Test para la API JSON de tareas"""
+    tester = app.test_client()
+    story = create_story(project="API tareas")
+    response = tester.post(f'/api/v1/user-stories/{story.id}/tasks', json={"tasks": [{"title": "Endpoint", "description": "Crear endpoint", "status": "pendiente"}]})
+    assert response.status_code == 201
+    task = response.get_json()["tasks"][0]
+    assert task["user_story_id"] == story.id
+
+    response = tester.get(f'/api/v1/user-stories/{story.id}/tasks')
+    assert [t["title"] for t in response.get_json()["tasks"]] == ["Endpoint"]
+    list_etag = response.headers["ETag"]
+    response = tester.get(f'/api/v1/tasks/{task["id"]}')
+    response = tester.get(f'/api/v1/tasks/{task["id"]}', headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+    response = tester.post(f'/api/v1/user-stories/{story.id}/tasks', json={"tasks": [{"title": "Sin descripción"}]})
+    assert response.status_code == 422
+    last_modified = age_modification_dates()
+    assert tester.get(f'/api/v1/tasks/{task["id"]}', headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert tester.get(f'/api/v1/user-stories/{story.id}/tasks', headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert tester.delete(f'/api/v1/tasks/{task["id"]}').status_code == 204
+    assert tester.get(f'/api/v1/tasks/{task["id"]}').status_code == 404
+    # Tras borrar una tarea la lista ya no coincide con la copia del cliente
+    response = tester.get(f'/api/v1/user-stories/{story.id}/tasks', headers={"If-None-Match": list_etag})
+    assert response.status_code == 200
+    assert response.get_json()["tasks"] == []
+    response = tester.get(f'/api/v1/user-stories/{story.id}/tasks', headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 200
+
+def test_api_validation_error():
+    """Test para la validación de la API"""
+    tester = app.test_client()
+    response = tester.post('/api/v1/user-stories', json={"project": "API"})
+    assert response.status_code == 422
+    assert {error["field"] for error in response.get_json()["error"]} >= {"role", "goal", "reason"}
+
+def test_api_rejects_unknown_enum_values():
+    """Test para los valores de prioridad y estado que no están en los Enum del modelo"""
+    tester = app.test_client()
+    story = {"project": "API enum", "role": "Usuario", "goal": "Validar", "reason": "Test"}
+    response = tester.post('/api/v1/user-stories', json={**story, "priority": "nonsense"})
+    assert response.status_code == 422
+    assert [error["field"] for error in response.get_json()["error"]] == ["priority"]
+    assert tester.get('/api/v1/user-stories?project=API enum').get_json()["user_stories"] == []
+
+    created = tester.post('/api/v1/user-stories', json={**story, "priority": "alta"}).get_json()
+    assert tester.patch(f'/api/v1/user-stories/{created["id"]}', json={"priority": "urgente"}).status_code == 422
+    response = tester.post(f'/api/v1/user-stories/{created["id"]}/tasks',
+                           json={"tasks": [{"title": "Tarea", "description": "Desc", "status": "hecha", "priority": "media"}]})
+    assert response.status_code == 422
+    assert [error["field"] for error in response.get_json()["error"]] == ["tasks.0.status"]
+    assert tester.get(f'/api/v1/user-stories/{created["id"]}').get_json()["priority"] == "alta"
+
+class FakeRedis:
+    """Cliente Redis en memoria con las operaciones que usa RedisCache"""
+    def __init__(self):
+        self.data = {}
+    def get(self, key):
+        return self.data.get(key)
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if key.startswith(pattern.rstrip("*"))]
+
+def count_queries(fn):
+    """Ejecuta fn y devuelve el número de sentencias SQL lanzadas"""
+    from sqlalchemy import event
+    from app.db import engine
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return len(statements)
+
+def test_read_cache_serves_repeated_views_without_queries():
+    """Test para la caché de lectura de la vista de tareas y su invalidación"""
+    from app.services.task_manager import TaskManager
+    tester = app.test_client()
+    story = create_story(project="Caché")
+    assert tester.get(f'/user-stories/{story.id}/tasks').status_code == 200
+    assert count_queries(lambda: tester.get(f'/user-stories/{story.id}/tasks')) == 0
+
+    with app.app_context():
+        TaskManager().create_tasks(make_task_schemas("Nueva"), user_story_id=story.id)
+    response = tester.get(f'/user-stories/{story.id}/tasks')
+    assert b"Nueva" in response.data
+
+    response = tester.get('/api/v1/user-stories', query_string={"project": "Caché"})
+    assert [s["id"] for s in response.get_json()["user_stories"]] == [story.id]
+    # Solo se consulta la fecha de modificación (Last-Modified): la página sale de la caché
+    assert count_queries(lambda: tester.get('/api/v1/user-stories', query_string={"project": "Caché"})) == 2
+    tester.post(f'/user-stories/{story.id}/delete')
+    assert tester.get('/api/v1/user-stories', query_string={"project": "Caché"}).get_json()["user_stories"] == []
+    assert tester.get(f'/api/v1/user-stories/{story.id}').status_code == 404
+
+def test_read_cache_redis_backend():
+    """Test para el backend de caché compartido (Redis)"""
+    from app.services import cache as cache_module
+    backend = cache_module.RedisCache(FakeRedis(), prefix="test:")
+    previous = cache_module.cache
+    cache_module.set_cache(backend)
+    try:
+        tester = app.test_client()
+        story = create_story(project="Caché Redis")
+        assert tester.get(f'/api/v1/user-stories/{story.id}').status_code == 200
+        assert "test:" + cache_module.story_key(story.id) in backend.client.data
+        # Solo se consulta la fecha de modificación (Last-Modified): la historia sale de la caché
+        assert count_queries(lambda: tester.get(f'/api/v1/user-stories/{story.id}')) == 1
+        tester.delete(f'/api/v1/user-stories/{story.id}')
+        assert "test:" + cache_module.story_key(story.id) not in backend.client.data
+        assert backend.version(cache_module.INDEX_VERSION_KEY) >= 2
+        backend.clear()
+        assert backend.client.data == {}
+    finally:
+        cache_module.set_cache(previous)
+
+def test_read_cache_invalidation_across_workers():
+    """Test para la caché de lectura con varios workers: la de memoria es por proceso y la de Redis compartida"""
+    from app.services import cache as cache_module
+    writer, reader = cache_module.TTLCache(), cache_module.TTLCache()
+    assert reader.ttl == cache_module.CACHE_MEMORY_TTL <= 5
+    now = time.monotonic()
+    with patch.object(cache_module.time, "monotonic", return_value=now):
+        for worker in (writer, reader):
+            worker.set(cache_module.story_key(1), "antigua", ttl=300)
+        writer.delete(cache_module.story_key(1))
+        # La invalidación no llega al otro worker, que sirve el valor antiguo hasta que caduca
+        assert writer.get(cache_module.story_key(1)) is None
+        assert reader.get(cache_module.story_key(1)) == "antigua"
+    with patch.object(cache_module.time, "monotonic", return_value=now + cache_module.CACHE_MEMORY_TTL + 1):
+        assert reader.get(cache_module.story_key(1)) is None
+
+    client = FakeRedis()
+    writer, reader = cache_module.RedisCache(client, prefix="w:"), cache_module.RedisCache(client, prefix="w:")
+    reader.set(cache_module.story_key(1), "antigua")
+    writer.delete(cache_module.story_key(1))
+    assert reader.get(cache_module.story_key(1)) is None
+
+def test_fake_openai_server_with_real_client():
+    """Test para el servidor falso de Azure OpenAI usado en las pruebas de carga"""
+    import openai
+    from bench.fake_openai import FakeOpenAIServer
+    from app.services import generation
+    from app.services.llm_client import llm
+    server = FakeOpenAIServer(failure_rate=0.0).start()
+    try:
+        client = openai.AzureOpenAI(api_key="bench", api_version="2024-08-01-preview", azure_endpoint=server.url)
+        with patch.object(openai_client, "get", return_value=client):
+            tasks = generation.generate_tasks(create_story(project="Benchmark"), use_cache=False)
+            story = generation.generate_user_story("Historia de prueba", use_cache=False)
+        assert len(tasks.tasks) == server.tasks_per_story
+        assert story.project.startswith("Proyecto")
+        server.failure_rate = 1.0
+        client = openai.AzureOpenAI(api_key="bench", api_version="2024-08-01-preview", azure_endpoint=server.url, max_retries=0)
+        with patch.object(openai_client, "get", return_value=client), patch.object(llm, "max_retries", 0):
+            try:
+                generation.generate_user_story("Otra historia", use_cache=False)
+                assert False, "Se esperaba un error del servidor"
+            except openai.InternalServerError:
+                pass
+        assert server.stats == {"requests": 3, "failures": 1, "streams": 0}
+    finally:
+        server.stop()
+
+def test_benchmark_summary_percentiles():
+    """Test para el resumen de latencias de las pruebas de carga"""
+    from bench.benchmark import summarize, percentile
+    samples = [(i / 1000, 200 if i < 100 else 500, 2) for i in range(1, 101)]
+    assert percentile([1, 2, 3, 4], 50) == 2
+    stats = summarize(samples, elapsed=2.0)
+    assert stats["requests"] == 100 and stats["errors"] == 1 and stats["rps"] == 50.0
+    assert (stats["latency_ms"]["p50"], stats["latency_ms"]["p95"], stats["latency_ms"]["p99"]) == (50.0, 95.0, 99.0)
+    assert stats["queries_per_request"] == 2
+
+def test_metrics_and_server_timing():
+    """Test para la instrumentación por petición: Server-Timing, /metrics, peticiones lentas y N+1"""
+    import logging
+    import openai
+    from bench.fake_openai import FakeOpenAIServer
+    from app import instrumentation
+    tester = app.test_client()
+    server = FakeOpenAIServer().start()
+    try:
+        client = openai.AzureOpenAI(api_key="bench", api_version="2024-08-01-preview", azure_endpoint=server.url)
+        with patch.object(openai_client, "get", return_value=client):
+            response = tester.post('/user-stories', data={"prompt": "Historia instrumentada"})
+    finally:
+        server.stop()
+    timing = response.headers["Server-Timing"]
+    assert "db;dur=" in timing and 'llm;dur=' in timing and "total;dur=" in timing
+    assert instrumentation.llm_tokens.value(kind="completion") > 0
+
+    response = tester.get('/user-stories')
+    assert "render;dur=" in response.headers["Server-Timing"]
+    body = tester.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{method="GET",endpoint="routes.user_stories",status="200"}' in body
+    assert 'llm_requests_total{operation="parse",outcome="ok"}' in body
+    assert "db_pool_checkouts" in body
+
+    logger = logging.getLogger("app.instrumentation")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger.addHandler(handler)
+    try:
+        with patch.object(instrumentation, "SLOW_REQUEST_MS", 0), patch.object(instrumentation, "N_PLUS_ONE_THRESHOLD", 1):
+            tester.get('/api/v1/tasks/999999')
+    finally:
+        logger.removeHandler(handler)
+    messages = [record.getMessage() for record in records]
+    assert any(m.startswith("Petición lenta GET /api/v1/tasks/999999") for m in messages)
+    assert any(m.startswith("Posible N+1 en GET /api/v1/tasks/999999") for m in messages)
+    assert instrumentation.n_plus_one.value(endpoint="api.get_task") >= 1
+
+def test_create_app_factory():
+    """Test para la factoría única de la aplicación"""
+    from app import create_app
+    other = create_app({"TESTING": True})
+    assert other is not app and other.config["TESTING"]
+    assert {"routes", "api"} <= set(other.blueprints)
+    assert other.test_client().get('/').status_code == 200
+    assert other.test_client().get('/api/v1/user-stories').status_code == 200
+
+def test_gunicorn_config():
+    """Test para la configuración de gunicorn en producción"""
+    import runpy
+    env = {"GUNICORN_WORKERS": "3", "GUNICORN_THREADS": "8", "GUNICORN_PRELOAD": "false"}
+    with patch.dict(os.environ, env):
+        config = runpy.run_path(os.path.join(os.path.dirname(__file__), '..', 'gunicorn.conf.py'))
+    assert (config["workers"], config["threads"], config["worker_class"]) == (3, 8, "gthread")
+    assert config["preload_app"] is False
+    assert config["graceful_timeout"] > 0 and callable(config["post_fork"]) and callable(config["worker_exit"])
+
+def test_lazy_resource_lifecycle():
+    """Test para el registro de recursos perezosos: creación en el primer uso, fork y liberación"""
+    from app.registry import LazyResource, RESOURCES
+    created, disposed, hooked = [], [], []
+    resource = LazyResource("prueba", lambda: created.append(object()) or created[-1], dispose=disposed.append)
+    RESOURCES.remove(resource)
+    resource.on_create(hooked.append)
+    assert not resource.initialized and created == []
+    first = resource.get()
+    assert resource.get() is first and created == [first] and hooked == [first]
+    resource.reset_after_fork() # Sin after_fork el recurso heredado se descarta sin liberarlo
+    assert not resource.initialized and disposed == []
+    second = resource.get()
+    assert second is not first and hooked == [first, second]
+    resource.dispose()
+    assert disposed == [second] and not resource.initialized
+
+def test_import_does_not_create_clients():
+    """Test para comprobar que importar la aplicación no crea el engine ni el cliente de Azure OpenAI"""
+    import subprocess
+    code = ("import sys, run; from app.db import engine_resource; from app.services.llm_client import openai_client; "
+            "print(engine_resource.initialized, openai_client.initialized, 'openai' in sys.modules)")
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, env={**os.environ, "PYTHONPATH": root},
+                            capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["False", "False", "False"]
+
+def test_resilient_llm_retries_and_circuit_breaker():
+    """Test para los reintentos con Retry-After, el plazo por llamada y el circuit breaker del cliente de IA"""
+    import time
+    import openai
+    from bench.fake_openai import FakeOpenAIServer
+    from app.schemas.UserStorySchema import UserStorySchema
+    from app.services.llm_client import ResilientLLM, CircuitBreaker, CircuitOpenError
+    request = dict(model="bench", messages=[{"role": "user", "content": "Historia"}], response_format=UserStorySchema)
+    server = FakeOpenAIServer(fail_first=2, failure_status=429, retry_after=0.05).start()
+    try:
+        client = openai.AzureOpenAI(api_key="bench", api_version="2024-08-01-preview", azure_endpoint=server.url, max_retries=0)
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        resilient = ResilientLLM(max_retries=3, backoff_base=0.001, breaker=breaker, client_factory=lambda: client)
+        start = time.monotonic()
+        assert resilient.parse(**request).choices[0].message.parsed.project
+        assert server.stats["requests"] == 3 and time.monotonic() - start >= 0.1 # Se respetó Retry-After
+
+        server.failure_status, server.failure_rate = 500, 1.0
+        resilient.max_retries = 0
+        for _ in range(2):
+            try:
+                resilient.parse(**request)
+                assert False, "Se esperaba un error del servidor"
+            except openai.InternalServerError:
+                pass
+        assert breaker.state == CircuitBreaker.OPEN
+        try:
+            resilient.parse(**request)
+            assert False, "El circuito debería estar abierto"
+        except CircuitOpenError:
+            pass
+        assert server.stats["requests"] == 5 # La llamada con el circuito abierto no llega al servidor
+
+        breaker.reset_timeout = 0 # Pasa a semiabierto: una llamada de prueba que cierra el circuito
+        server.failure_rate = 0.0
+        resilient.parse(**request)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        server.latency = 0.5
+        start = time.monotonic()
+        try:
+            resilient.parse(timeout=0.1, **request)
+            assert False, "Se esperaba un timeout"
+        except openai.APITimeoutError:
+            pass
+        assert time.monotonic() - start < 0.5
+    finally:
+        server.latency = 0
+        server.stop()
+
+def test_resilient_llm_stream_disconnect_releases_trial():
+    """Test para un stream cortado por el cliente durante la llamada de prueba del circuit breaker"""
+    import openai
+    from bench.fake_openai import FakeOpenAIServer
+    from app.schemas.UserStorySchema import UserStorySchema
+    from app.services.llm_backends import OpenAICompatibleBackend
+    from app.services.llm_client import ResilientLLM, CircuitBreaker, RateLimiter
+    from app.services.prompts import RenderedPrompt
+    server = FakeOpenAIServer(chunk_size=4).start()
+    try:
+        client = openai.AzureOpenAI(api_key="bench", api_version="2024-08-01-preview", azure_endpoint=server.url, max_retries=0)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure() # Semiabierto: la siguiente llamada es la de prueba
+        limiter = RateLimiter(tpm=100000)
+        backend = OpenAICompatibleBackend("bench", "bench", ResilientLLM(
+            client_factory=lambda: client, max_retries=0, breaker=breaker, limiter=limiter))
+        events = backend.stream(RenderedPrompt("test", "Sistema", "Historia", 0, False), UserStorySchema)
+        with patch.object(limiter, "settle", wraps=limiter.settle) as settle:
+            assert next(events)[0] == "delta"
+            events.close() # El navegador cierra la conexión SSE: GeneratorExit
+        estimated, actual = settle.call_args.args
+        assert 0 < actual < estimated
+        assert breaker.state == CircuitBreaker.HALF_OPEN and not breaker._trial_running
+        breaker.before_call() # Se admite una nueva llamada de prueba
+    finally:
+        server.stop()
+
+def test_rate_limiter_quota():
+    """Test para el limitador de peticiones y tokens por minuto"""
+    from app.services.llm_client import RateLimiter, LLMUnavailableError
+    limiter = RateLimiter(rpm=3, tpm=1000, max_wait=0.01)
+    for _ in range(3):
+        limiter.acquire(100)
+    try:
+        limiter.acquire(100)
+        assert False, "Se esperaba superar la cuota de peticiones"
+    except LLMUnavailableError:
+        pass
+    limiter = RateLimiter(tpm=1000, max_wait=0.01)
+    limiter.acquire(900)
+    limiter.settle(900, 300) # La llamada consumió menos de lo reservado: se devuelven los tokens
+    limiter.acquire(600)
+    try:
+        limiter.acquire(500)
+        assert False, "Se esperaba superar la cuota de tokens"
+    except LLMUnavailableError:
+        pass
+
+
+def test_similar_story_offered_before_generation():
+    """Un prompt parecido a una historia existente no llama al modelo y ofrece reutilizarla"""
+    from app.services import generation
+    story = create_story("Portal clientes", goal="Quiero poder iniciar sesión con mi cuenta de Google",
+                         description="Inicio de sesión mediante OAuth de Google en el portal de clientes")
+    tester = app.test_client()
+    with patch.object(generation, "generate_user_story") as generate:
+        response = tester.post('/user-stories', data={'prompt': 'Iniciar sesión con la cuenta de Google'})
+        assert response.status_code == 302
+        assert f"similar={story.id}" in response.headers["Location"]
+        assert "prompt" not in response.headers["Location"]
+        response = tester.post('/jobs/user-stories', json={'prompt': 'Inicio de sesión con cuentas de Google'})
+        assert response.status_code == 409
+        assert response.get_json()["similar"][0]["id"] == story.id
+        generate.assert_not_called()
+    page = tester.get(f'/user-stories?similar={story.id}')
+    assert b"Historias similares a tu prompt" in page.data
+    # El prompt se recupera de la sesión para el formulario de "Generar una nueva igualmente"
+    assert 'value="Iniciar sesión con la cuenta de Google"'.encode() in page.data
+    # Con 'force' se genera igualmente
+    response = tester.post('/user-stories', data={'prompt': 'Iniciar sesión con la cuenta de Google', 'force': '1'},
+                           follow_redirects=True)
+    assert "Historia de usuario creada correctamente".encode() in response.data
+    # Al eliminar la historia el índice se actualiza
+    tester.post(f'/user-stories/{story.id}/delete')
+    with app.app_context():
+        from app.services.story_index import find_similar_stories
+        assert story.id not in dict(find_similar_stories('Iniciar sesión con la cuenta de Google'))
+
+
+def test_story_index_incremental_updates():
+    """El índice MinHash mantiene los arrays compactos al añadir y quitar historias"""
+    from app.services.story_index import StoryIndex
+    index = StoryIndex(num_perm=32, bands=16, threshold=0.5)
+    index._loaded = True
+    index.add(1, "Exportar facturas a PDF", "Descarga de las facturas mensuales en PDF")
+    index.add(2, "Recuperar contraseña olvidada", "Envío de un enlace de recuperación por correo electrónico")
+    index.add(3, "Notificaciones push de pedidos", "Avisar en el móvil cuando cambia el estado del pedido")
+    assert [i for i, _ in index.search("recuperar la contraseña por correo")] == [2]
+    assert index.remove(1)
+    assert len(index) == 2 and len(index._signatures) == 2 * 32
+    assert [i for i, _ in index.search("notificaciones push del estado del pedido")] == [3]
+    assert index.search("exportar facturas PDF") == []
+    assert index.search("algo") == []
+
+
+def test_export_import_roundtrip():
+    """Exportación en streaming e importación por lotes en NDJSON y CSV"""
+    import orjson
+    story = create_story("Proyecto Exportación")
+    tester = app.test_client()
+    body = "\n".join([
+        orjson.dumps({"title": f"Importada {i}", "description": "Tarea importada", "status": "pendiente",
+                      "user_story_id": story.id}).decode() for i in range(5)
+    ] + ['{"title": "Sin historia", "description": "x"}', 'no es json', '{"title": 3}'])
+    with patch("app.services.transfer_manager.IMPORT_BATCH_SIZE", 2):
+        response = tester.post('/api/v1/import/tasks?new_ids=1', data=body, content_type='application/x-ndjson')
+    summary = response.get_json()
+    assert response.status_code == 200
+    assert (summary["imported"], summary["batches"], summary["failed"]) == (5, 3, 3)
+    assert [error["line"] for error in summary["errors"]] == [6, 7, 8]
+    # Las lecturas en caché ven las tareas importadas
+    assert len(tester.get(f'/api/v1/user-stories/{story.id}/tasks').get_json()["tasks"]) == 5
+
+    response = tester.get('/api/v1/export/user-stories?project=Proyecto+Exportación')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.data.decode().splitlines()
+    assert [orjson.loads(line)["id"] for line in lines] == [story.id]
+    response = tester.get('/api/v1/export/tasks?format=csv&project=Proyecto+Exportación')
+    csv_body = response.data.decode()
+    assert csv_body.splitlines()[0].startswith("id,title,description")
+    assert len(csv_body.splitlines()) == 6
+
+    # El CSV exportado se vuelve a importar (con IDs nuevos) y las celdas vacías son None
+    response = tester.post('/api/v1/import/tasks?new_ids=true', data=csv_body, content_type='text/csv')
+    assert response.get_json()["imported"] == 5
+    tasks = tester.get(f'/api/v1/user-stories/{story.id}/tasks').get_json()["tasks"]
+    assert len(tasks) == 10 and tasks[-1]["assigned_to"] is None
+    assert tester.get('/api/v1/export/tasks?format=xml').status_code == 400
+
+
+def test_import_export_cli(tmp_path):
+    """Comandos export-data e import-data"""
+    create_story("Proyecto CLI")
+    output = tmp_path / "stories.csv"
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["export-data", "user-stories", "--project", "Proyecto CLI", "-o", str(output)])
+    assert result.exit_code == 0, result.output
+    assert output.read_text(encoding="utf-8").count("Proyecto CLI") == 1
+    result = runner.invoke(args=["import-data", "user-stories", str(output), "--new-ids"])
+    assert result.exit_code == 0, result.output
+    assert "Importados: 1 en 1 lotes" in result.output
+
+
+def test_bulk_delete_is_set_based():
+    """Eliminar un proyecto completo usa sentencias DELETE por conjuntos en una transacción"""
+    from app.services.task_manager import TaskManager
+    stories = [create_story("Proyecto Borrado") for _ in range(3)]
+    keep = create_story("Proyecto Conservado")
+    with app.app_context():
+        for story in stories + [keep]:
+            TaskManager().create_tasks(make_task_schemas("Uno", "Dos", "Tres"), user_story_id=story.id)
+    tester = app.test_client()
+    tester.get(f'/api/v1/user-stories/{stories[0].id}/tasks') # Queda en la caché de lectura
+
+    statements = []
+    from sqlalchemy import event
+    from app.db import engine
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = tester.delete('/api/v1/user-stories', json={"project": "Proyecto Borrado"})
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert sorted(response.get_json()["deleted"]) == [story.id for story in stories]
+    assert len([s for s in statements if s.startswith("DELETE")]) == 2
+    assert not [s for s in statements if s.startswith("SELECT")]
+    assert tester.get(f'/api/v1/user-stories/{stories[0].id}/tasks').status_code == 404
+    assert len(tester.get(f'/api/v1/user-stories/{keep.id}/tasks').get_json()["tasks"]) == 3
+    # Eliminar una historia desde la interfaz borra también sus tareas
+    tester.post(f'/user-stories/{keep.id}/delete')
+    with app.app_context():
+        assert TaskManager().get_tasks_by_user_story(keep.id) == []
+    assert tester.delete('/api/v1/user-stories', json={}).status_code == 400
+
+
+def test_reports_from_summary_table():
+    """Los informes se calculan con GROUP BY sobre task_summaries, que se actualiza en cada escritura de tareas"""
+    from sqlalchemy import event
+    from app.db import engine
+    from app.services.task_manager import TaskManager
+    first = create_story("Proyecto Informe", priority="alta", story_points=5, effort_hours=10)
+    second = create_story("Proyecto Informe", priority="baja", story_points=3, effort_hours=4)
+    with app.app_context():
+        TaskManager().create_tasks(make_task_schemas("A", "B", "C"), user_story_id=first.id)
+        done = TaskManager().create_task("D", "Hecha", "alta", 1.5, "completada", None, second.id)
+    tester = app.test_client()
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        report = tester.get('/api/v1/reports/projects/Proyecto Informe?capacity_hours=4').get_json()
+        projects = tester.get('/api/v1/reports/projects').get_json()["projects"]
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert not [s for s in statements if "FROM tasks" in s or "JOIN tasks" in s]
+    assert report["totals"] == {"stories": 2, "story_points": 8, "estimated_hours": 14.0, "tasks": 4,
+                                "task_hours": 7.5, "remaining_hours": 6.0}
+    assert report["capacity"] == {"hours_per_sprint": 4.0, "sprints_needed": 2}
+    assert [(row["priority"], row["stories"], row["tasks"]) for row in report["by_priority"]] == \
+        [("baja", 1, 1), ("alta", 1, 3)]
+    assert {row["status"]: row["tasks"] for row in report["by_status"]} == {"pendiente": 3, "completada": 1}
+    assert [(s["id"], s["task_hours"], s["deviation_hours"]) for s in report["stories"]] == \
+        [(first.id, 6.0, -4.0), (second.id, 1.5, -2.5)]
+    assert next(p for p in projects if p["project"] == "Proyecto Informe")["remaining_hours"] == 6.0
+
+    # Borrar tareas e historias actualiza los resúmenes
+    tester.delete(f'/api/v1/tasks/{done.id}')
+    assert tester.get('/api/v1/reports/projects/Proyecto Informe').get_json()["totals"]["tasks"] == 3
+    tester.delete('/api/v1/user-stories', json={"project": "Proyecto Informe"})
+    assert tester.get('/api/v1/reports/projects/Proyecto Informe').status_code == 404
+    with app.app_context():
+        from app.db import db_session
+        from app.models.task_summary import TaskSummary
+        assert db_session.query(TaskSummary).filter(TaskSummary.user_story_id.in_([first.id, second.id])).count() == 0
+
+
+def test_prompt_templates_and_token_budget():
+    """Las plantillas precompiladas recortan la descripción al presupuesto y registran estadísticas por plantilla"""
+    from app.services import generation
+    from app.services.prompts import PromptTemplate, TASK_PROMPT, count_tokens, fit_text
+    assert count_tokens("") == 0 and count_tokens("Quiero iniciar sesión") >= 3
+    text = "Primera frase importante. Segunda frase con detalle. " * 50
+    fitted = fit_text(text, 20)
+    assert fitted.startswith("Primera frase importante.") and fitted.endswith("[…]")
+    assert count_tokens(fitted) <= 20
+
+    story = create_story("Proyecto Prompts", description="Contexto de negocio esencial. " + "Detalle secundario. " * 2000)
+    prompt = generation.build_task_prompt(story)
+    assert prompt.trimmed and prompt.tokens <= 3000
+    assert prompt.messages[0] == {"role": "system", "content": TASK_PROMPT.system}
+    assert "Contexto de negocio esencial." in prompt.user and "Proyecto: Proyecto Prompts" in prompt.user
+    assert count_tokens(prompt.system) + count_tokens(prompt.user) <= 3000 + 10
+
+    # Un prompt corto no se modifica y las estadísticas se acumulan por plantilla
+    template = PromptTemplate("test_prompt", system="Sistema fijo.", user="Texto: {text}", trim_fields=("text",), budget=50)
+    assert template.render(text="hola").user == "Texto: hola"
+    assert template.render(text="palabra " * 200).trimmed
+    template.record_usage(30, 10)
+    stats = template.stats()
+    assert (stats["renders"], stats["trimmed"], stats["calls"], stats["prompt_tokens"]) == (2, 1, 1, 30)
+    tester = app.test_client()
+    assert tester.get('/llm/prompts').get_json()["test_prompt"]["renders"] == 2
+    assert 'llm_prompt_renders_total{template="test_prompt"} 2' in tester.get('/metrics').data.decode()
+
+
+def test_story_card_fragments_and_compressed_listing():
+    """Las tarjetas del listado se sirven desde la caché de fragmentos y la página se comprime y admite 304"""
+    import gzip
+    from app.services import cache as cache_module
+    from app.services.cache import story_card_key
+    from app.services.task_manager import TaskManager
+    story = create_story("Proyecto Fragmentos", goal="Quiero ver tarjetas cacheadas")
+    tester = app.test_client()
+    response = tester.get('/user-stories', headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    html = gzip.decompress(response.data).decode()
+    assert "Quiero ver tarjetas cacheadas" in html and "Tareas: 0" in html
+    assert cache_module.cache.get(story_card_key(story.id))[1] in html
+
+    # Sin cambios el navegador revalida con el ETag y recibe un 304 sin cuerpo
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/')
+    assert tester.get('/user-stories', headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+
+    # Al crear tareas se invalida solo la tarjeta de esa historia
+    with app.app_context():
+        TaskManager().create_tasks(make_task_schemas("Uno", "Dos"), user_story_id=story.id)
+    assert cache_module.cache.get(story_card_key(story.id)) is None
+    response = tester.get('/user-stories', headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Tareas: 2" in gzip.decompress(response.data).decode()
+
+
+def test_fingerprinted_static_assets():
+    """Los ficheros estáticos se sirven en local con huella, caché de un año y comprimidos"""
+    import gzip
+    from app.assets import asset_url, VENDOR_ASSETS
+    with app.test_request_context():
+        url = asset_url('js/user-stories.js')
+    assert url.startswith('/assets/') and url.endswith('/js/user-stories.js')
+    tester = app.test_client()
+    response = tester.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "immutable" in response.headers["Cache-Control"] and "max-age=31536000" in response.headers["Cache-Control"]
+    assert b"showSimilar" in gzip.decompress(response.data)
+    assert tester.get(url, headers={"If-None-Match": response.headers["ETag"], "Accept-Encoding": "gzip"}).status_code == 304
+    # Una huella antigua redirige a la vigente
+    stale = tester.get('/assets/000000000000/js/user-stories.js')
+    assert stale.status_code == 302 and stale.headers["Location"].endswith(url)
+    # La página enlaza los ficheros locales (o el CDN si Bootstrap aún no se ha descargado)
+    html = tester.get('/user-stories').get_data(as_text=True)
+    assert url in html
+    with app.test_request_context():
+        bootstrap = asset_url('vendor/bootstrap/bootstrap.min.css')
+    assert bootstrap in html
+    assert bootstrap.startswith('/assets/') or bootstrap == VENDOR_ASSETS['vendor/bootstrap/bootstrap.min.css'][0]
+    # Si falta el fichero local, el CDN solo se enlaza en depuración o tests y siempre con su hash de integridad
+    from app import assets as assets_module
+    filename, (cdn_url, integrity) = next(iter(VENDOR_ASSETS.items()))
+    with patch.object(assets_module, "fingerprint", return_value=None), app.test_request_context():
+        assert assets_module.asset_url(filename) == cdn_url
+        assert f'integrity="{integrity}"' in assets_module.asset_integrity(filename)
+        debug, app.debug, app.testing = app.debug, False, False
+        try:
+            assert assets_module.asset_url(filename).startswith('/static/')
+            assert assets_module.asset_integrity(filename) == ""
+        finally:
+            app.debug, app.testing = debug, True
+
+
+def test_generation_backends_route_and_fall_back():
+    """La generación se enruta por plantilla a un endpoint compatible con OpenAI y cae al generador sin modelo"""
+    import openai
+    from bench.fake_openai import FakeOpenAIServer
+    from app.services import generation
+    from app.services.llm_backends import ROUTES, BACKENDS, OpenAICompatibleBackend, backends_for
+    from app.services.llm_client import ResilientLLM, CircuitBreaker
+    from app.instrumentation import llm_fallbacks
+    server = FakeOpenAIServer().start()
+    client = openai.OpenAI(base_url=server.url + "/v1", api_key="local", max_retries=0)
+    local = OpenAICompatibleBackend("local", "modelo-local", ResilientLLM(
+        client_factory=lambda: client, max_retries=0, breaker=CircuitBreaker(name="test")))
+    story = create_story(project="Backends", goal="Quiero exportar informes", effort_hours=10)
+    try:
+        with patch.dict(BACKENDS, {"local": local}), patch.dict(ROUTES, {"tasks": "local,template", "user_story": "template"}):
+            assert [b.name for b in backends_for("tasks")] == ["local", "template"]
+            assert len(generation.generate_tasks(story, use_cache=False).tasks) == server.tasks_per_story
+            assert server.stats["requests"] == 1
+
+            # El endpoint local falla: se generan las tareas sin modelo
+            server.failure_rate = 1.0
+            before = llm_fallbacks._values.get((("template", "tasks"), ("backend", "local")), 0)
+            tasks = generation.generate_tasks(story, use_cache=False).tasks
+            assert [t.category for t in tasks] == ["Análisis", "Desarrollo", "Pruebas", "Documentación"]
+            assert sum(t.effort_hours for t in tasks) == 10
+            assert llm_fallbacks._values[(("template", "tasks"), ("backend", "local"))] == before + 1
+            other = create_story(project="Backends", goal="Quiero importar informes")
+            streamed = [value for kind, value in generation.stream_tasks(other) if kind == "task"]
+            assert [task["category"] for task in streamed][-1] == "Documentación" and len(streamed) == 4
+
+            # Las historias se generan sin red ni Azure, siempre igual para el mismo prompt
+            first = generation.generate_user_story("Quiero exportar las tareas del proyecto Alfa a CSV")
+            assert first == generation.generate_user_story("Quiero exportar las tareas del proyecto Alfa a CSV")
+            assert first.project == "Alfa" and first.goal.startswith("Quiero exportar")
+            assert app.test_client().get('/llm/backends').get_json()["routes"]["tasks"] == ["local", "template"]
+        with patch.dict(ROUTES, {"tasks": "desconocido"}):
+            try:
+                backends_for("tasks")
+                assert False, "Debe rechazar un backend desconocido"
+            except ValueError:
+                pass
+    finally:
+        server.stop()
+
+def test_stream_without_final_response_falls_back_or_fails():
+    """Un stream que se cierra sin respuesta final pasa al siguiente backend si no había empezado, y si no falla"""
+    from app.services import generation
+    from app.services.llm_backends import ROUTES, BACKENDS, GenerationBackend
+    from app.services.llm_client import LLMUnavailableError
+
+    class TruncatedBackend(GenerationBackend):
+        cacheable = False
+        def __init__(self, name, deltas):
+            self.name, self.deltas = name, deltas
+        def stream(self, prompt, response_format, timeout=None):
+            for delta in self.deltas:
+                yield "delta", delta, None
+
+    story = create_story(project="Streams", goal="Quiero exportar informes", effort_hours=10)
+    backends = {"empty": TruncatedBackend("empty", []), "partial": TruncatedBackend("partial", ['{"tasks": ['])}
+    with patch.dict(BACKENDS, backends), patch.dict(ROUTES, {"tasks": "empty,template"}):
+        events = list(generation.stream_tasks(story, use_cache=False))
+        assert events[-1][0] == "done" and len(events[-1][1].tasks) == 4
+    with patch.dict(BACKENDS, backends), patch.dict(ROUTES, {"tasks": "partial,template"}):
+        try:
+            list(generation.stream_tasks(story, use_cache=False))
+            assert False, "Se esperaba LLMUnavailableError"
+        except LLMUnavailableError:
+            pass
+
+def test_incremental_task_regeneration():
+    """Solo se regeneran las historias modificadas y se guardan las diferencias con sus tareas"""
+    from app.services import generation
+    from app.services.llm_backends import ROUTES
+    from app.services.task_manager import TaskManager
+    from app.services.user_story_manager import UserStoryManager
+    from app.models.task import Task
+    story = create_story(project="Incremental", goal="Quiero exportar informes", effort_hours=10)
+    with app.app_context(), patch.dict(ROUTES, {"tasks": "template"}):
+        manager, stories = TaskManager(), UserStoryManager()
+        first = generation.plan_tasks(stories.get_user_story_by_id(story.id), manager)
+        assert first["status"] == "synced" and len(first["created"]) == 4
+
+        # Sin cambios en la historia no se llama al modelo
+        with patch.object(generation, "generate_tasks", side_effect=AssertionError("no debe generar")):
+            assert generation.plan_tasks(stories.get_user_story_by_id(story.id), manager)["status"] == "unchanged"
+            assert app.test_client().post(f'/user-stories/{story.id}/tasks', follow_redirects=True).status_code == 200
+
+        # Cambia el esfuerzo: mismas tareas con otras horas, sin insertar ni borrar
+        response = app.test_client().patch(f'/api/v1/user-stories/{story.id}', json={"effort_hours": 20})
+        assert response.status_code == 200 and response.get_json()["effort_hours"] == 20
+        second = generation.plan_tasks(stories.get_user_story_by_id(story.id), manager)
+        assert (len(second["updated"]), second["created"], second["deleted"]) == (4, [], [])
+
+        # Cambia el objetivo: las tareas pendientes se sustituyen y la empezada se conserva
+        manager.db.execute(Task.__table__.update().where(Task.id == first["created"][1]).values(status="en_progreso"))
+        manager.db.commit()
+        stories.update_user_story(story.id, goal="Quiero importar informes")
+        third = generation.plan_tasks(stories.get_user_story_by_id(story.id), manager)
+        assert len(third["created"]) == 4 and sorted(third["deleted"]) == sorted(set(first["created"]) - {first["created"][1]})
+        assert len(manager.get_tasks_by_user_story(story.id)) == 5
+    assert app.test_client().patch(f'/api/v1/user-stories/{story.id}', json={"priority": 3}).status_code == 422
+
+def test_forced_task_regeneration_skips_llm_cache():
+    """Forzar la regeneración de una historia sin cambios llama al modelo en lugar de devolver la respuesta en caché"""
+    import openai
+    from bench.fake_openai import FakeOpenAIServer
+    from app.services import generation
+    from app.services.batch_generation import generate_tasks_for_stories
+    from app.services.task_manager import TaskManager
+    from app.services.user_story_manager import UserStoryManager
+    story = create_story(project="Forzada", goal="Quiero regenerar las tareas")
+    server = FakeOpenAIServer().start()
+    try:
+        client = openai.AzureOpenAI(api_key="bench", api_version="2024-08-01-preview", azure_endpoint=server.url, max_retries=0)
+        with patch.object(openai_client, "get", return_value=client), app.app_context():
+            manager, stories = TaskManager(), UserStoryManager()
+            assert generation.plan_tasks(stories.get_user_story_by_id(story.id), manager)["status"] == "synced"
+            calls = server.stats["requests"]
+            forced = generation.plan_tasks(stories.get_user_story_by_id(story.id), manager, force=True)
+            assert forced["status"] == "synced" and server.stats["requests"] == calls + 1
+            assert generate_tasks_for_stories([story.id], force=True)[0]["status"] == "ok"
+            assert server.stats["requests"] == calls + 2
+            body = app.test_client().post(f'/user-stories/{story.id}/tasks/stream', json={"force": True}).get_data(as_text=True)
+            assert "event: done" in body and server.stats["streams"] == 1
+    finally:
+        server.stop()
+
+def test_full_text_search_memory_and_fts5():
+    """Búsqueda de historias y tareas con el índice en memoria y con FTS5, actualizada con cada alta y borrado"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app import migrations
+    from app.services.search_index import SearchIndex
+    from app.services.task_manager import TaskManager
+    from app.services.user_story_manager import UserStoryManager
+    tester = app.test_client()
+    story = create_story(project="Busqueda", goal="Quiero conciliar facturas", description="Conciliación bancaria mensual")
+    other = create_story(project="Busqueda", goal="Quiero conciliar pagos", description="Pagos con tarjeta")
+    with app.app_context():
+        TaskManager().create_tasks(make_task_schemas("Conciliar extractos bancarios", "Revisar permisos"), user_story_id=story.id)
+    data = tester.get('/api/v1/search?q=conciliación bancaria').get_json()
+    assert data["backend"] == "memory" and data["total"] == 3
+    assert {r["type"] for r in data["results"][:2]} == {"user_story", "task"} and data["results"][2]["id"] == other.id
+    assert data["results"][0]["score"] >= data["results"][1]["score"] >= data["results"][2]["score"]
+    assert tester.get('/api/v1/search?q=conciliar&type=user_story&per_page=1&page=2').get_json()["results"][0]["id"] in (story.id, other.id)
+    assert tester.get('/api/v1/search?q=x&type=otro').status_code == 400
+
+    # Las modificaciones y borrados se reflejan en la siguiente búsqueda
+    with app.app_context():
+        UserStoryManager().update_user_story(other.id, description="Pagos con tarjeta y transferencias bancarias")
+        UserStoryManager().delete_user_story(story.id)
+    data = tester.get('/api/v1/search?q=bancaria').get_json()
+    assert [(r["type"], r["id"]) for r in data["results"]] == [("user_story", other.id)]
+    assert b"Quiero conciliar pagos" in tester.get('/search?q=transferencias').data
+
+    # Con la migración 6 en SQLite la búsqueda usa las tablas FTS5, mantenidas por triggers
+    engine = create_engine("sqlite://")
+    migrations.upgrade(engine)
+    session = Session(bind=engine)
+    try:
+        UserStoryManager(session).create_user_story("Fts", "Usuario", "Quiero exportar informes", "Para compartirlos",
+                                                    "Exportación en PDF", "media", 3, 8)
+        index = SearchIndex(lambda: session)
+        result = index.search("exportación")
+        assert result["backend"] == "fts5" and result["total"] == 1 and result["results"][0]["title"] == "Quiero exportar informes"
+        UserStoryManager(session).delete_user_stories(project="Fts")
+        assert index.search("exportación")["total"] == 0
+    finally:
+        session.close()
+
+def test_read_replica_routing(tmp_path):
+    """Lecturas en la réplica, lectura de lo escrito en el primario y vuelta al primario si la réplica cae"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app import db
+    from app.db import ReplicaSet, db_session, pool_status
+    from app.models.user_story import UserStory
+    from app.services.user_story_manager import UserStoryManager
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    replica = create_engine(replica_url)
+    db.Base.metadata.create_all(replica)
+    # La réplica tiene una historia que el primario no tiene, para saber de dónde se lee
+    with Session(replica) as session:
+        session.add(UserStory(id=424242, project="Replica", role="Usuario", goal="Solo en la réplica", reason="Test"))
+        session.commit()
+    replica.dispose()
+    story = create_story(project="Replica", goal="Solo en el primario")
+    manager = UserStoryManager()
+    with patch.object(db, "replicas", ReplicaSet([replica_url])):
+        with app.app_context():
+            assert db_session.get(UserStory, 424242) is None
+        with app.app_context():
+            assert manager.get_user_story_by_id(424242).goal == "Solo en la réplica"
+            assert manager.get_user_story_by_id(story.id) is None
+            # Tras escribir, la misma sesión lee del primario
+            created = manager.create_user_story("Replica", "Usuario", "Recién creada", "Test", None, "media", 1, 2)
+            assert manager.get_user_story_by_id(created.id).goal == "Recién creada"
+            assert pool_status()["replicas_available"] == 1
+
+        # Las consultas en la réplica cuentan en las métricas de la petición y en el pool de la réplica
+        primary_checkouts = db.pool_metrics.checkouts
+        response = app.test_client().get('/api/v1/user-stories/424242')
+        assert response.get_json()["goal"] == "Solo en la réplica"
+        assert 'desc="0 queries"' not in response.headers["Server-Timing"]
+        assert db.pool_metrics.checkouts == primary_checkouts
+        assert pool_status()["replicas"][0]["checkouts"] > 0
+
+        # El cliente que escribe sigue leyendo del primario en las peticiones siguientes (cookie de sesión)
+        writer = app.test_client()
+        assert writer.patch(f'/api/v1/user-stories/{story.id}', json={"priority": "baja"}).status_code == 200
+        assert app.test_client().get(f'/api/v1/user-stories/{story.id}').status_code == 404
+        assert writer.get(f'/api/v1/user-stories/{story.id}').get_json()["priority"] == "baja"
+
+    # Réplica caída: las lecturas van al primario y la réplica se marca como no disponible
+    down = ReplicaSet([f"sqlite:///{tmp_path / 'no-existe' / 'replica.db'}"])
+    with patch.object(db, "replicas", down), app.app_context():
+        assert manager.get_user_story_by_id(story.id).goal == "Solo en el primario"
+        assert down.status()[0]["available"] is False
+
+    # Elegir réplica no abre conexiones; si la réplica se cae a mitad de la sesión la lectura se repite en el primario
+    dropping = ReplicaSet([replica_url])
+    with patch.object(db, "replicas", dropping), app.app_context():
+        engine = dropping.choose()
+        assert dropping.metrics[replica_url].checkouts == 0
+        assert manager.get_user_story_by_id(424242).goal == "Solo en la réplica"
+        db_session.connection(bind_arguments={"bind": engine}).connection.dbapi_connection.close()
+        assert manager.get_user_story_by_id(story.id).goal == "Solo en el primario"
+        assert dropping.status()[0]["available"] is False